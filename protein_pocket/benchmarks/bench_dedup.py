@@ -0,0 +1,107 @@
+"""
+口袋去重扩展性基准：对比逐对比较的旧实现与 group_overlapping_pockets
+
+用法: python benchmarks/bench_dedup.py [口袋数 ...]
+旧实现是 O(n²) 的，超过 --legacy-max（默认 3000）个口袋时只运行新实现。
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import List
+
+from protein_pocket.filtering import (
+    DEFAULT_CENTER_DISTANCE_THRESHOLD,
+    DEFAULT_RESIDUE_JACCARD_THRESHOLD,
+    group_overlapping_pockets,
+    jaccard_residue_overlap,
+)
+from protein_pocket.fpocket import Pocket
+
+from synthetic import make_pockets
+
+
+def legacy_group_overlapping_pockets(
+    pockets: List[Pocket],
+    center_distance_threshold: float = DEFAULT_CENTER_DISTANCE_THRESHOLD,
+    residue_jaccard_threshold: float = DEFAULT_RESIDUE_JACCARD_THRESHOLD,
+) -> list[list[int]]:
+    """旧实现：深度优先搜索，每一步对所有口袋逐对判断重叠"""
+    groups: list[list[int]] = []
+    visited = [False] * len(pockets)
+
+    def is_overlapped(i: int, j: int) -> bool:
+        pi, pj = pockets[i], pockets[j]
+        dx = pi.center_x - pj.center_x
+        dy = pi.center_y - pj.center_y
+        dz = pi.center_z - pj.center_z
+        dist = (dx * dx + dy * dy + dz * dz) ** 0.5
+        if dist <= center_distance_threshold:
+            return True
+        ja = jaccard_residue_overlap(set(pi.residues), set(pj.residues))
+        return ja >= residue_jaccard_threshold
+
+    for i in range(len(pockets)):
+        if visited[i]:
+            continue
+        stack = [i]
+        group: list[int] = []
+        visited[i] = True
+        while stack:
+            u = stack.pop()
+            group.append(u)
+            for v in range(len(pockets)):
+                if visited[v] or v == u:
+                    continue
+                if is_overlapped(u, v):
+                    visited[v] = True
+                    stack.append(v)
+        groups.append(group)
+    return groups
+
+
+def make_assembly_pockets(n: int, seed: int = 0) -> List[Pocket]:
+    """口袋密度固定（盒子随口袋数增大），并混入残基高度重叠但中心相距较远的口袋"""
+    box = 120.0 * (n / 1000) ** (1 / 3)
+    pockets = make_pockets(n, seed=seed, box=box)
+    rnd = random.Random(seed + 1)
+    for i in range(0, n, 10):
+        twin = pockets[i]
+        residues = list(twin.residues)
+        residues[rnd.randrange(len(residues))] = f"B_{i}"
+        pockets[(i + n // 2) % n].residues = residues
+    return pockets
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes: List[int], legacy_max: int) -> None:
+    print(f"{'pockets':>8} {'groups':>7} {'legacy (ms)':>12} {'current (ms)':>13} {'speedup':>8}")
+    for n in sizes:
+        pockets = make_assembly_pockets(n)
+        current = group_overlapping_pockets(pockets)
+        repeat = 3 if n <= 1000 else 1
+        t_current = best_of(lambda: group_overlapping_pockets(pockets), repeat)
+        if n <= legacy_max:
+            # 分组及组内顺序必须与旧实现完全一致
+            assert legacy_group_overlapping_pockets(pockets) == current
+            t_legacy = best_of(lambda: legacy_group_overlapping_pockets(pockets), repeat)
+            print(f"{n:>8} {len(current):>7} {t_legacy * 1e3:>12.1f} {t_current * 1e3:>13.1f} {t_legacy / t_current:>7.1f}x")
+        else:
+            print(f"{n:>8} {len(current):>7} {'-':>12} {t_current * 1e3:>13.1f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[10, 100, 1000, 3000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=3000)
+    args = parser.parse_args()
+    main(args.sizes, args.legacy_max)
@@ -0,0 +1,74 @@
+"""
+fpocket 输出解析基准：对比逐行解析的旧实现与 read_fpocket_pockets
+
+用法: python benchmarks/bench_fpocket_parser.py [口袋数 ...]
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from protein_pocket.fpocket import Pocket, read_fpocket_pockets
+
+from synthetic import write_fpocket_output
+
+
+def legacy_read_fpocket_pockets(fp_out_dir: Path) -> List[Pocket]:
+    """旧实现：按 "Pocket " 切分 info 文件，只取 Score，逐个文件用 Python 循环求中心"""
+    info_file = list(fp_out_dir.glob("*_info.txt"))[0]
+    pockets: List[Pocket] = []
+    content = info_file.read_text()
+    for i, section in enumerate(content.split("Pocket ")[1:], 1):
+        score = 0.0
+        center_x = center_y = center_z = 0.0
+        for line in section.strip().split('\n'):
+            if "Score :" in line:
+                score = float(line.split(":")[1].strip())
+        pocket_pdb = fp_out_dir / "pockets" / f"pocket{i}_atm.pdb"
+        if pocket_pdb.exists():
+            coords = []
+            with open(pocket_pdb, 'r') as f:
+                for line in f:
+                    if line.startswith("ATOM"):
+                        coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            if coords:
+                center_x = sum(c[0] for c in coords) / len(coords)
+                center_y = sum(c[1] for c in coords) / len(coords)
+                center_z = sum(c[2] for c in coords) / len(coords)
+        pockets.append(Pocket(center_x, center_y, center_z, score, score, []))
+    return pockets
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes: List[int]) -> None:
+    print(f"{'pockets':>8} {'legacy (ms)':>12} {'current (ms)':>13} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            out_dir = write_fpocket_output(Path(tmp) / f"p{n}_out", f"p{n}", n)
+            legacy = legacy_read_fpocket_pockets(out_dir)
+            current = read_fpocket_pockets(out_dir)
+            # 中心必须与旧实现一致；旧实现的 "Score :" 匹配会被后面的 "Druggability Score :" 覆盖，
+            # 因此其 raw_score 实际是成药性分数
+            assert len(legacy) == len(current)
+            for a, b in zip(legacy, current):
+                assert abs(a.center_x - b.center_x) < 1e-9 and abs(a.center_z - b.center_z) < 1e-9
+                assert a.raw_score == b.descriptors["druggability_score"]
+
+            t_legacy = best_of(lambda: legacy_read_fpocket_pockets(out_dir))
+            t_current = best_of(lambda: read_fpocket_pockets(out_dir))
+            print(f"{n:>8} {t_legacy * 1e3:>12.2f} {t_current * 1e3:>13.2f} {t_legacy / t_current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10, 100, 300, 1000])
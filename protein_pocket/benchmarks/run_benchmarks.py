@@ -0,0 +1,264 @@
+"""
+纯 Python 热点路径的微基准套件：记录耗时与峰值内存，并与保存的基线比较
+
+用法:
+    python benchmarks/run_benchmarks.py                    # 快速规模，与 baselines.json 比较
+    python benchmarks/run_benchmarks.py --full             # 口袋数到 10k、蛋白质数到 100k
+    python benchmarks/run_benchmarks.py --save-baseline    # 用本次结果覆盖基线
+    python benchmarks/run_benchmarks.py -k dedup -k cliff  # 只运行名称包含关键字的用例
+    python benchmarks/run_benchmarks.py -k import           # 只测量 CLI 的导入与启动时间
+
+耗时取多次运行的最小值；峰值内存用 tracemalloc 单独运行一次测得（只统计被测函数内的分配）。
+import_* 用例在新的解释器进程中导入模块或执行命令，耗时包含解释器启动，不统计内存。
+存在回归（耗时或峰值内存超过基线的容差）时以退出码 1 结束。基线与机器相关，更换机器后需重新保存。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import protein_pocket
+from protein_pocket import batch
+from protein_pocket.cliff_analysis import analyze_cliff_pattern, get_cliff_summary_stats
+from protein_pocket.eval_topn import Site, recall_top_n_plus_2
+from protein_pocket.filtering import deduplicate_pockets
+from protein_pocket.fpocket import read_fpocket_pockets
+from protein_pocket.p2rank import ScoredPocket
+from protein_pocket.merge import merge_summaries
+from protein_pocket.pipeline import PipelineResult
+
+from synthetic import make_pockets, write_fpocket_output
+
+BASELINE_FILE = Path(__file__).with_name("baselines.json")
+MIN_TIME_DELTA = 1e-3  # 秒
+MIN_MEMORY_DELTA = 4096  # 字节
+# 子进程中导入与本进程相同的 protein_pocket（源码树或已安装的包）
+PACKAGE_PARENT = str(Path(protein_pocket.__file__).resolve().parents[1])
+
+
+@dataclass
+class Case:
+    """一个基准用例：setup(规模, 临时目录) 返回被测的无参函数"""
+    name: str
+    unit: str  # "pockets"、"proteins" 或 "processes"
+    quick_sizes: List[int]
+    full_sizes: List[int]
+    setup: Callable[[int, Path], Callable[[], object]]
+    measure_memory: bool = True
+
+
+def _scored_pockets(n: int, seed: int = 0) -> List[ScoredPocket]:
+    rnd = random.Random(seed)
+    return [
+        ScoredPocket(
+            center_x=p.center_x, center_y=p.center_y, center_z=p.center_z,
+            raw_score=p.raw_score, score=rnd.uniform(0, 50), residues=p.residues,
+        )
+        for p in make_pockets(n, seed=seed)
+    ]
+
+
+def setup_read_fpocket(n: int, tmp: Path) -> Callable[[], object]:
+    out_dir = write_fpocket_output(tmp / "fpocket_out", "bench", n)
+    return lambda: read_fpocket_pockets(out_dir)
+
+
+def setup_dedup(n: int, tmp: Path) -> Callable[[], object]:
+    # 口袋密度固定，盒子随口袋数增大
+    pockets = make_pockets(n, box=120.0 * (n / 1000) ** (1 / 3))
+    return lambda: deduplicate_pockets(pockets)
+
+
+def setup_cliff(n: int, tmp: Path) -> Callable[[], object]:
+    scored = _scored_pockets(n)
+    return lambda: analyze_cliff_pattern(scored, "bench")
+
+
+def setup_recall(n: int, tmp: Path) -> Callable[[], object]:
+    # 已知位点数为预测口袋数的 1/10，recall 只看前 (位点数 + 2) 个预测
+    rnd = random.Random(0)
+    predicted = [(p.center_x, p.center_y, p.center_z) for p in make_pockets(n)]
+    sites = [Site(*predicted[rnd.randrange(n)]) for _ in range(max(1, n // 10))]
+    return lambda: recall_top_n_plus_2(predicted, sites)
+
+
+def _protein_results(n: int, topk: int = 5) -> List[PipelineResult]:
+    results = []
+    for i in range(n):
+        scored = _scored_pockets(topk, seed=i)
+        results.append(PipelineResult(
+            top_pockets=sorted(scored, key=lambda p: p.score, reverse=True),
+            num_pockets_detected=topk,
+            num_pockets_filtered=topk,
+            all_pockets=scored,
+            filtered_pockets=scored,
+            cliff_analysis=analyze_cliff_pattern(scored, f"protein_{i}"),
+        ))
+    return results
+
+
+def setup_save_detailed(n: int, tmp: Path) -> Callable[[], object]:
+    results = _protein_results(n)
+    dirs = [tmp / f"protein_{i}" for i in range(n)]
+    for d in dirs:
+        d.mkdir()
+
+    def run() -> None:
+        for i, (result, result_dir) in enumerate(zip(results, dirs)):
+            batch.save_protein_detailed_results(f"protein_{i}", result, result_dir)
+    return run
+
+
+def setup_cliff_summary(n: int, tmp: Path) -> Callable[[], object]:
+    cliff_results = [r.cliff_analysis for r in _protein_results(n)]
+    return lambda: get_cliff_summary_stats(cliff_results)
+
+
+def setup_merge(n: int, tmp: Path) -> Callable[[], object]:
+    # 两个各含全部蛋白质的摘要（模拟重复运行），合并时每个蛋白质都要去重
+    results = [
+        batch.BatchResult(
+            protein_name=f"protein_{i}", protein_path=f"/data/protein_{i}.pdb", status="success",
+            top_pockets=[asdict(p) for p in r.top_pockets], high_confidence_count=r.cliff_analysis.high_confidence_count,
+            is_top1_dominant=r.cliff_analysis.is_top1_dominant, max_delta=r.cliff_analysis.max_delta,
+        )
+        for i, r in enumerate(_protein_results(n))
+    ]
+    inputs = [tmp / "run1.csv", tmp / "run2.csv"]
+    for path in inputs:
+        with batch.BatchSummaryWriter(str(path), topk=5) as writer:
+            for result in results:
+                writer.write(result)
+    return lambda: merge_summaries(inputs, tmp / "out" / "merged.csv")
+
+
+def import_case(statement: str) -> Callable[[int, Path], Callable[[], object]]:
+    """在新的解释器进程中执行 statement，测量冷启动的导入耗时"""
+    def setup(n: int, tmp: Path) -> Callable[[], object]:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_PARENT, env.get("PYTHONPATH")]))
+        cmd = [sys.executable, "-c", statement]
+        return lambda: subprocess.run(cmd, check=True, env=env, stdout=subprocess.DEVNULL)
+    return setup
+
+
+CASES = [
+    Case("read_fpocket_pockets", "pockets", [10, 100, 1000], [10, 100, 1000, 10000], setup_read_fpocket),
+    Case("deduplicate_pockets", "pockets", [10, 100, 1000], [10, 100, 1000, 10000], setup_dedup),
+    Case("analyze_cliff_pattern", "pockets", [10, 100, 1000], [10, 100, 1000, 10000], setup_cliff),
+    Case("recall_top_n_plus_2", "pockets", [10, 100, 1000], [10, 100, 1000, 10000], setup_recall),
+    Case("save_protein_detailed_results", "proteins", [1, 100, 1000], [1, 100, 1000, 10000, 100000], setup_save_detailed),
+    Case("get_cliff_summary_stats", "proteins", [1, 100, 1000], [1, 100, 1000, 10000, 100000], setup_cliff_summary),
+    Case("merge_summaries", "proteins", [1, 100, 1000], [1, 100, 1000, 10000, 100000], setup_merge),
+    Case("import_cli", "processes", [1], [1], import_case("import protein_pocket.cli"), measure_memory=False),
+    Case("import_pipeline", "processes", [1], [1], import_case("import protein_pocket.pipeline"), measure_memory=False),
+    Case(
+        "import_cli_version", "processes", [1], [1],
+        import_case("import sys; from protein_pocket.cli import app; sys.argv = ['protein-pocket', 'version']; app()"),
+        measure_memory=False,
+    ),
+]
+
+
+def measure(
+    fn: Callable[[], object], min_time: float = 0.2, max_repeat: int = 5, memory: bool = True
+) -> Dict[str, float]:
+    """耗时取最小值（快的函数最多重复 max_repeat 次），峰值内存单独测一次（memory=False 时记为 0）"""
+    timings = []
+    while len(timings) < max_repeat and (not timings or sum(timings) < min_time):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    if not memory:
+        return {"time_s": min(timings), "peak_bytes": 0}
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time_s": min(timings), "peak_bytes": peak}
+
+
+def compare(current: Dict[str, float], baseline: Optional[Dict[str, float]], time_tol: float, mem_tol: float) -> str:
+    if baseline is None:
+        return "new"
+    flags = []
+    # 亚毫秒级、几 KiB 以内的差异主要是噪声，不视为回归
+    slower = current["time_s"] - baseline["time_s"]
+    if current["time_s"] > baseline["time_s"] * (1 + time_tol) and slower > MIN_TIME_DELTA:
+        flags.append(f"TIME x{current['time_s'] / baseline['time_s']:.2f}")
+    more = current["peak_bytes"] - baseline["peak_bytes"]
+    if current["peak_bytes"] > baseline["peak_bytes"] * (1 + mem_tol) and more > MIN_MEMORY_DELTA:
+        flags.append(f"MEM x{current['peak_bytes'] / max(1, baseline['peak_bytes']):.2f}")
+    return "REGRESSION " + ", ".join(flags) if flags else "ok"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="运行完整规模（耗时较长）")
+    parser.add_argument("-k", "--keyword", action="append", default=[], help="只运行名称包含该关键字的用例")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="允许的耗时增长比例，默认 0.5")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2, help="允许的峰值内存增长比例，默认 0.2")
+    args = parser.parse_args(argv)
+
+    # 被测函数会为每个蛋白质打印一行，基准运行时关闭控制台输出
+    batch.console.quiet = True
+
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    baselines = stored.get("results", {})
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    regressions = 0
+
+    print(f"{'case':<32} {'size':>8} {'time (ms)':>11} {'peak (KiB)':>11}  vs baseline")
+    for case in CASES:
+        if args.keyword and not any(k in case.name for k in args.keyword):
+            continue
+        for size in (case.full_sizes if args.full else case.quick_sizes):
+            with tempfile.TemporaryDirectory(prefix="pp_bench_") as tmp:
+                fn = case.setup(size, Path(tmp))
+                current = measure(fn, memory=case.measure_memory)
+            results.setdefault(case.name, {})[str(size)] = current
+            verdict = compare(
+                current, baselines.get(case.name, {}).get(str(size)), args.time_tolerance, args.memory_tolerance
+            )
+            regressions += verdict.startswith("REGRESSION")
+            print(
+                f"{case.name:<32} {size:>8} {current['time_s'] * 1e3:>11.2f} "
+                f"{current['peak_bytes'] / 1024:>11.1f}  {verdict}"
+            )
+
+    if args.save_baseline:
+        # 只覆盖本次运行过的用例与规模
+        for name, sizes in results.items():
+            baselines.setdefault(name, {}).update(sizes)
+        args.baseline.write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": baselines,
+        }, indent=2, sort_keys=True) + "\n")
+        print(f"基线已保存: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{regressions} 个用例超过基线容差")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""
+基准测试用的合成数据：fpocket 输出目录与口袋列表
+"""
+from __future__ import annotations
+
+import random
+from typing import List
+
+from protein_pocket.fpocket import Pocket
+from protein_pocket.simulate import FPOCKET_DESCRIPTORS, write_fpocket_output  # noqa: F401  供各基准脚本使用
+
+
+def make_pockets(n_pockets: int, seed: int = 0, box: float = 120.0, residues_per_pocket: int = 12) -> List[Pocket]:
+    """生成随机口袋列表，口袋密度与大型组装体的 fpocket 输出相近"""
+    rnd = random.Random(seed)
+    pockets = []
+    for _ in range(n_pockets):
+        score = rnd.random()
+        pockets.append(Pocket(
+            center_x=rnd.uniform(0, box),
+            center_y=rnd.uniform(0, box),
+            center_z=rnd.uniform(0, box),
+            raw_score=score,
+            score=score,
+            residues=[f"A_{rnd.randint(1, n_pockets * 4)}" for _ in range(residues_per_pocket)],
+        ))
+    return pockets
@@ -1,2 +1,20 @@
+"""
+蛋白质口袋检测 pipeline
+
+作为库使用时的主要入口（按需导入，`import protein_pocket` 和 CLI 启动不承担其导入开销）：
+PocketPipeline、PipelineConfig、PipelineResult、PipelineError。
+"""
+
+_PIPELINE_EXPORTS = ("PocketPipeline", "PipelineConfig", "PipelineResult", "PipelineError")
+
+
+def __getattr__(name: str):
+    if name in _PIPELINE_EXPORTS:
+        from . import pipeline
+
+        return getattr(pipeline, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def main() -> None:
     print("Hello from protein-pocket!")
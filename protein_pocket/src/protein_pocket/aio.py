@@ -0,0 +1,444 @@
+"""
+asyncio 版本的 pipeline - 用一个事件循环驱动大量并发的 fpocket / prank 子进程
+
+fpocket 和 P2Rank 都是外部进程，同步实现中每个并发任务都要占用一个只在 subprocess.run 上阻塞的
+工作进程（或线程）。这里用 asyncio.create_subprocess_exec 启动子进程，等待期间不占用线程，
+并发度由信号量限制：fpocket_concurrency 限制同时运行的 fpocket，p2rank_concurrency 限制同时运行的 JVM。
+
+解析、去重、断崖分析和结果文件的读写是同步的 Python 代码，通过 asyncio.to_thread 放到线程池中执行，
+不阻塞事件循环。超时、进程组清理和重试的语义与 proc 模块相同；任务被取消时同样杀死整个进程组。
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import (
+    AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TypeVar, Union,
+)
+
+from .fpocket import collect_fpocket_output, job_scratch, stage_input, structure_stem
+from .p2rank import (
+    RescoreJob,
+    ScoredPocket,
+    find_predictions_csv,
+    prank_command,
+    read_p2rank_predictions,
+    resolve_p2rank_home,
+    write_rescore_dataset,
+)
+from .pipeline import (
+    DetectedPockets,
+    PipelineConfig,
+    PipelineError,
+    PipelineResult,
+    finalize_pipeline_result,
+    load_cached_pockets,
+    open_result_cache,
+    parse_detected_pockets,
+    store_cached_pockets,
+    unique_work_dir_name,
+)
+from .proc import FAILURE_TRANSIENT, RetryPolicy, _kill_process_group, classify_failure
+from .resources import MemoryBudget
+from .retention import apply_retention, copies_all_fpocket_output, validate_keep
+from .timing import stage_span
+
+T = TypeVar("T")
+
+
+def _decode(data: Optional[bytes]) -> Optional[str]:
+    return data.decode(errors="replace") if data is not None else None
+
+
+async def run_command_async(
+    cmd: Sequence[str],
+    timeout: Optional[float] = None,
+    capture_output: bool = False,
+    cwd: Optional[str | os.PathLike] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> subprocess.CompletedProcess:
+    """proc.run_command 的 asyncio 版本：超时或任务被取消时杀死子进程所在的整个进程组
+
+    超时抛出 subprocess.TimeoutExpired，非零退出码抛出 subprocess.CalledProcessError。
+    """
+    pipe = asyncio.subprocess.PIPE if capture_output else None
+    cmd = list(cmd)
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=pipe, stderr=pipe, cwd=cwd, env=env, start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except TimeoutError:
+        _kill_process_group(proc)
+        stdout, stderr = await proc.communicate()
+        raise subprocess.TimeoutExpired(cmd, timeout, output=_decode(stdout), stderr=_decode(stderr)) from None
+    except BaseException:
+        _kill_process_group(proc)
+        await proc.wait()
+        raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=_decode(stdout), stderr=_decode(stderr))
+    return subprocess.CompletedProcess(cmd, proc.returncode, _decode(stdout), _decode(stderr))
+
+
+async def call_with_retries_async(fn: Callable[[], Awaitable[T]], retry: Optional[RetryPolicy], what: str) -> T:
+    """proc.call_with_retries 的 asyncio 版本，退避等待期间不阻塞事件循环"""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if retry is None or attempt >= retry.max_retries or classify_failure(e) != FAILURE_TRANSIENT:
+                raise
+            delay = retry.delay(attempt)
+            attempt += 1
+            print(f"{what} 临时性失败（{e}），{delay:.1f} 秒后重试 ({attempt}/{retry.max_retries})")
+            await asyncio.sleep(delay)
+
+
+async def run_fpocket_async(
+    pdb_path: str | Path,
+    work_dir: Path,
+    scratch_dir: Optional[str | Path] = None,
+    copy_all: bool = True,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> Path:
+    """fpocket.run_fpocket 的 asyncio 版本；fpocket 的标准输出只在失败时随异常返回，不打印"""
+    pdb_path = Path(pdb_path)
+    if not pdb_path.exists():
+        raise FileNotFoundError(f"Input file not found: {pdb_path}")
+
+    stem = structure_stem(pdb_path)
+    work_out_dir = work_dir / (stem + "_fpocket")
+    with job_scratch(scratch_dir) as scratch:
+        staged = await asyncio.to_thread(stage_input, pdb_path, scratch)
+        expected_out_dir = scratch / (staged.stem + "_out")
+        cmd = ["fpocket", "-f", str(staged)]
+
+        async def attempt() -> subprocess.CompletedProcess:
+            # 重试前清除上一次失败留下的部分输出
+            shutil.rmtree(expected_out_dir, ignore_errors=True)
+            return await run_command_async(cmd, timeout=timeout, capture_output=True, cwd=scratch)
+
+        await call_with_retries_async(attempt, retry, f"fpocket {pdb_path.name}")
+        if not expected_out_dir.exists():
+            raise FileNotFoundError(f"fpocket output directory not found: {expected_out_dir}")
+        await asyncio.to_thread(collect_fpocket_output, expected_out_dir, work_out_dir, stem, copy_all)
+    return work_out_dir
+
+
+def _prepare_rescore(pdb_path: Path, work_dir: Path) -> Path:
+    out_dir = work_dir / "p2rank_out"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    dataset_file = out_dir / "fpocket_dataset.ds"
+    write_rescore_dataset(dataset_file, [RescoreJob(pdb_path=pdb_path, work_dir=work_dir)])
+    return dataset_file
+
+
+def _read_predictions(out_dir: Path, pdb_path: Path) -> List[ScoredPocket]:
+    return read_p2rank_predictions(find_predictions_csv(out_dir, pdb_path))
+
+
+async def rescore_with_p2rank_async(
+    pdb_path: Path,
+    work_dir: Path,
+    prank_home: Optional[str] = None,
+    threads: Optional[int] = None,
+    heap_mb: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[ScoredPocket]:
+    """p2rank.rescore_with_p2rank 的 asyncio 版本（每个蛋白质启动一次 prank）"""
+    p2rank_path = resolve_p2rank_home(prank_home)
+    dataset_file = await asyncio.to_thread(_prepare_rescore, pdb_path, work_dir)
+    out_dir = dataset_file.parent
+    cmd, env = prank_command(dataset_file, out_dir, p2rank_path, threads=threads, heap_mb=heap_mb)
+    await call_with_retries_async(
+        lambda: run_command_async(cmd, timeout=timeout, env=env), retry, f"P2Rank {dataset_file.name}"
+    )
+    return await asyncio.to_thread(_read_predictions, out_dir, pdb_path)
+
+
+async def run_pipeline_async(
+    pdb_path: str,
+    workdir: str,
+    config: PipelineConfig,
+    cache=None,
+    fpocket_slots: Optional[asyncio.Semaphore] = None,
+    p2rank_slots: Optional[asyncio.Semaphore] = None,
+    spans: Optional[list] = None,
+) -> PipelineResult:
+    """pipeline.run_pipeline_with_config 的 asyncio 版本
+
+    fpocket_slots / p2rank_slots 为多个任务共享的信号量，限制同时运行的外部进程数；
+    等待信号量的时间不计入对应阶段的耗时。spans 的含义同 run_pipeline_with_config。
+    """
+    fpocket_slots = fpocket_slots or asyncio.Semaphore(1)
+    p2rank_slots = p2rank_slots or asyncio.Semaphore(1)
+    cached = None
+    spans = [] if spans is None else spans
+    if cache is not None:
+        with stage_span(spans, "cache"):
+            cached, key = await asyncio.to_thread(load_cached_pockets, cache, pdb_path, workdir)
+
+    if cached is not None:
+        detected, rescored = cached
+        detected.spans = spans
+    else:
+        work_dir = Path(workdir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        async with fpocket_slots:
+            with stage_span(spans, "fpocket"):
+                fp_out = await run_fpocket_async(
+                    pdb_path, work_dir, scratch_dir=config.scratch_dir,
+                    copy_all=copies_all_fpocket_output(config.keep),
+                    timeout=config.fpocket_timeout, retry=config.retry,
+                )
+        detected: DetectedPockets = await asyncio.to_thread(
+            parse_detected_pockets, pdb_path, work_dir, fp_out, spans=spans
+        )
+        if cache is not None:
+            detected.cache_key = key
+
+        async with p2rank_slots:
+            with stage_span(detected.spans, "p2rank"):
+                rescored = await rescore_with_p2rank_async(
+                    detected.pdb_path, detected.work_dir, config.prank_home,
+                    threads=config.p2rank_threads, heap_mb=config.p2rank_heap_mb,
+                    timeout=config.p2rank_timeout, retry=config.retry,
+                )
+        if cache is not None:
+            with stage_span(detected.spans, "cache"):
+                await asyncio.to_thread(store_cached_pockets, cache, detected, rescored)
+
+    result = await asyncio.to_thread(
+        finalize_pipeline_result, detected, rescored, config.topk, config.enable_cliff_analysis
+    )
+    await asyncio.to_thread(apply_retention, detected.work_dir, detected.pdb_path, config.keep)
+    return result
+
+
+async def _aiter_paths(pdb_paths: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if hasattr(pdb_paths, "__aiter__"):
+        async for pdb_path in pdb_paths:
+            yield pdb_path
+    else:
+        for pdb_path in pdb_paths:
+            yield pdb_path
+
+
+class AsyncPocketPipeline:
+    """pipeline.PocketPipeline 的 asyncio 版本
+
+    构造时解析一次 P2Rank 路径、校验配置并打开结果缓存。fpocket_concurrency / p2rank_concurrency
+    限制该对象上所有调用同时运行的 fpocket 与 prank 进程数（默认分别为 CPU 核数和其一半）。
+    信号量绑定到第一次使用它们的事件循环，同一个对象只能在一个事件循环中使用。
+
+    用法:
+        pipeline = AsyncPocketPipeline(PipelineConfig(topk=3), workdir="runs")
+        result = await pipeline.run("1abc.pdb")
+        async for result in pipeline.run_many(paths, concurrency=200):
+            ...
+    """
+
+    def __init__(
+        self,
+        config: Optional[PipelineConfig] = None,
+        workdir: Union[str, Path] = "runs",
+        fpocket_concurrency: Optional[int] = None,
+        p2rank_concurrency: Optional[int] = None,
+    ):
+        config = config or PipelineConfig()
+        validate_keep(config.keep)
+        cpus = os.cpu_count() or 1
+        self.config = replace(config, prank_home=str(resolve_p2rank_home(config.prank_home)))
+        self.workdir = Path(workdir)
+        self.fpocket_concurrency = fpocket_concurrency or cpus
+        self.p2rank_concurrency = p2rank_concurrency or max(1, cpus // 2)
+        self._cache = open_result_cache(config.cache_dir, config.cache_max_bytes)
+        self._fpocket_slots = asyncio.Semaphore(self.fpocket_concurrency)
+        self._p2rank_slots = asyncio.Semaphore(self.p2rank_concurrency)
+
+    def work_dir_for(self, pdb_path: Union[str, Path]) -> Path:
+        return self.workdir / structure_stem(Path(pdb_path))
+
+    def unique_work_dir_for(self, pdb_path: Union[str, Path]) -> Path:
+        return self.workdir / unique_work_dir_name(pdb_path)
+
+    async def run(self, pdb_path: Union[str, Path], work_dir: Optional[Union[str, Path]] = None) -> PipelineResult:
+        """处理单个结构；失败时直接抛出原始异常"""
+        work_dir = work_dir or self.work_dir_for(pdb_path)
+        return await run_pipeline_async(
+            str(pdb_path), str(work_dir), self.config, cache=self._cache,
+            fpocket_slots=self._fpocket_slots, p2rank_slots=self._p2rank_slots,
+        )
+
+    async def run_many(
+        self,
+        pdb_paths: Union[Iterable[Union[str, Path]], AsyncIterable[Union[str, Path]]],
+        concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> AsyncIterator[Union[PipelineResult, PipelineError]]:
+        """并发处理多个结构，按完成顺序逐个产出结果，语义与 PocketPipeline.run_many 相同
+
+        pdb_paths 可以是普通或异步可迭代对象；每个输入的工作目录同 PocketPipeline.run_many。concurrency 为同时处理的结构数上限，
+        默认为 fpocket_concurrency + p2rank_concurrency（两个阶段都不空闲所需的最小值）。
+        提前停止迭代时取消所有未完成的结构并杀死其子进程。
+        """
+        concurrency = concurrency or self.fpocket_concurrency + self.p2rank_concurrency
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于等于 1")
+        paths = _aiter_paths(pdb_paths).__aiter__()
+        running: Dict[asyncio.Task, Path] = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) < concurrency:
+                    try:
+                        pdb_path = await paths.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    running[asyncio.ensure_future(self.run(pdb_path, self.unique_work_dir_for(pdb_path)))] = Path(pdb_path)
+                if not running:
+                    return
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pdb_path = running.pop(task)
+                    try:
+                        yield task.result()
+                    except Exception as e:
+                        error = PipelineError(pdb_path, e)
+                        error.__cause__ = e
+                        if not return_exceptions:
+                            raise error
+                        yield error
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _run_batch_async(
+    protein_paths: List[Path],
+    input_dir: Path,
+    results_dir: Path,
+    config: PipelineConfig,
+    fpocket_concurrency: int,
+    p2rank_concurrency: int,
+    emit: Callable,
+    budget: Optional[MemoryBudget] = None,
+    protein_mb: Optional[Dict[Path, float]] = None,
+) -> None:
+    """批处理的协程：按顺序放行蛋白质，每个蛋白质完成后调用 emit(BatchResult)"""
+    from .batch import _failed_batch_result, _protein_result_dir, _success_batch_result
+
+    cache = open_result_cache(config.cache_dir, config.cache_max_bytes)
+    fpocket_slots = asyncio.Semaphore(fpocket_concurrency)
+    p2rank_slots = asyncio.Semaphore(p2rank_concurrency)
+    concurrency = fpocket_concurrency + p2rank_concurrency
+    protein_mb = protein_mb or {}
+
+    async def process(protein_path: Path):
+        start_time = time.time()
+        protein_name = structure_stem(protein_path)
+        spans: list = []
+        try:
+            result_subdir = _protein_result_dir(protein_path, input_dir, results_dir)
+            result = await run_pipeline_async(
+                str(protein_path), str(result_subdir), config, cache=cache,
+                fpocket_slots=fpocket_slots, p2rank_slots=p2rank_slots, spans=spans,
+            )
+            return await asyncio.to_thread(
+                _success_batch_result, protein_name, protein_path, result, result_subdir,
+                time.time() - start_time, config.keep, config.record_all_pockets,
+            )
+        except Exception as e:
+            return _failed_batch_result(protein_name, protein_path, e, time.time() - start_time, spans)
+        finally:
+            if budget is not None:
+                budget.release(protein_mb.get(protein_path, 0.0))
+
+    running: set = set()
+
+    async def drain(return_when) -> None:
+        nonlocal running
+        done, running = await asyncio.wait(running, return_when=return_when)
+        for task in done:
+            emit(task.result())
+
+    try:
+        for protein_path in protein_paths:
+            # 与进程池模式相同的准入规则：并发数和内存预算都允许时才开始下一个蛋白质，按原顺序放行
+            while len(running) >= concurrency or (
+                budget is not None and not budget.try_acquire(protein_mb.get(protein_path, 0.0))
+            ):
+                await drain(asyncio.FIRST_COMPLETED)
+            running.add(asyncio.create_task(process(protein_path)))
+        while running:
+            await drain(asyncio.FIRST_COMPLETED)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+def iter_async_batch_results(
+    protein_paths: List[Path],
+    input_dir: Path,
+    results_dir: Path,
+    config: PipelineConfig,
+    fpocket_concurrency: int,
+    p2rank_concurrency: int,
+    budget: Optional[MemoryBudget] = None,
+    protein_mb: Optional[Dict[Path, float]] = None,
+) -> Iterator:
+    """在后台线程的事件循环中运行批处理，按完成顺序产出 BatchResult
+
+    供同步的 run_batch_pipeline 使用：结果的记录与进度条仍在调用线程中进行。
+    调用方停止迭代（如 Ctrl+C 后 close()）时取消事件循环中的所有任务并杀死其子进程。
+    """
+    results: queue.Queue = queue.Queue()
+    done = object()
+    started = threading.Event()
+    state: Dict[str, object] = {}
+
+    async def main() -> None:
+        state["loop"] = asyncio.get_running_loop()
+        state["task"] = asyncio.current_task()
+        started.set()
+        try:
+            await _run_batch_async(
+                protein_paths, input_dir, results_dir, config, fpocket_concurrency, p2rank_concurrency,
+                results.put, budget=budget, protein_mb=protein_mb,
+            )
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), name="async-batch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        started.wait()
+        if thread.is_alive():
+            state["loop"].call_soon_threadsafe(state["task"].cancel)
+        thread.join()
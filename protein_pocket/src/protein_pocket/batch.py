@@ -3,22 +3,65 @@
 """
 
 import csv
+from contextlib import nullcontext
+import hashlib
+import os
+import queue
+import shutil
 import time
+import uuid
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import Iterator, List, Optional, Dict, Any, Tuple
 from dataclasses import dataclass, asdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
 import multiprocessing as mp
 
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn
 from rich.table import Table
 
-from .pipeline import run_pipeline
-from .fpocket import Pocket
+from .pipeline import (
+    run_pipeline_with_config,
+    PipelineConfig,
+    DetectedPockets,
+    detect_pockets,
+    finalize_pipeline_result,
+    open_result_cache,
+    load_cached_pockets,
+    store_cached_pockets,
+)
+from .cache import DEFAULT_CACHE_MAX_BYTES, format_size
+from .journal import BatchJournal, load_journal, journal_path_for
+from .p2rank import RescoreJob, rescore_batch_with_p2rank
+from .fpocket import Pocket, structure_stem
+from .filtering import match_pockets_by_center
+from .proc import RetryPolicy, classify_failure
+from .resources import (
+    MemoryBudget,
+    available_cpus,
+    count_atoms,
+    estimate_task_mb,
+    pin_to_cpus,
+    split_cpus,
+)
+from .timing import STAGES, ChromeTraceWriter, spans_to_records, stage_span, stage_totals
+from .retention import (
+    KEEP_ALL,
+    apply_retention,
+    copies_all_fpocket_output,
+    keeps_detailed_results,
+    remove_if_empty,
+    validate_keep,
+)
 
 console = Console()
 
+# 蛋白质的提交顺序：按路径，或按原子数从大到小（缩短批处理末尾只剩一个大结构在运行的时间）
+ORDER_PATH = "path"
+ORDER_LARGEST_FIRST = "largest-first"
+SCHEDULE_ORDERS = (ORDER_PATH, ORDER_LARGEST_FIRST)
+
 
 @dataclass
 class BatchResult:
@@ -30,20 +73,67 @@ class BatchResult:
     num_pockets_detected: int = 0
     num_pockets_filtered: int = 0
     top_pockets: List[Dict[str, Any]] = None
+    # 全部重打分口袋（与 top_pockets 格式相同），只在 PipelineConfig.record_all_pockets 时记录
+    rescored_pockets: List[Dict[str, Any]] = None
     processing_time: float = 0.0
     # 断崖分析结果
     high_confidence_count: int = 0
     is_top1_dominant: bool = False
     max_delta: float = 0.0
     cliff_index: int = 0
+    # 各阶段耗时记录（timing.StageSpan 的字典形式）
+    stage_spans: List[Dict[str, Any]] = None
+    # 失败类型（proc.FAILURE_*），成功时为 None
+    failure_class: Optional[str] = None
+    # 详细结果 CSV（*_pocket_results.csv）的绝对路径，按保留策略未保存时为 None
+    detailed_csv: Optional[str] = None
     
     def __post_init__(self):
         if self.top_pockets is None:
             self.top_pockets = []
+        if self.rescored_pockets is None:
+            self.rescored_pockets = []
+        if self.stage_spans is None:
+            self.stage_spans = []
+
+
+def protein_key(protein_path: Path, input_dir: Path) -> str:
+    """蛋白质在批处理中的唯一标识：相对于输入目录的路径"""
+    return protein_path.relative_to(input_dir).as_posix()
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析 "i/N" 形式的分片参数，返回 (i, N)，i 从 0 开始"""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"分片参数必须是 i/N 的形式，如 0/8: {spec}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片编号必须满足 0 <= i < N: {spec}")
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    """按蛋白质标识（protein_key）的稳定哈希分配分片
+
+    不使用内置 hash()（每个进程的字符串哈希种子不同），保证不同节点、不同次运行的分配一致。
+    """
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_path(path: str | Path, index: int, count: int) -> Path:
+    """在文件名的扩展名之前加上分片后缀，如 batch_results.csv -> batch_results.shard-03-of-16.csv"""
+    path = Path(path)
+    width = len(str(count - 1))
+    return path.with_name(f"{path.stem}.shard-{index:0{width}d}-of-{count}{path.suffix}")
 
 
 def find_protein_files(input_dir: str, extensions: List[str]) -> List[Path]:
-    """在指定目录中查找蛋白质结构文件（递归查找，保持目录结构）"""
+    """在指定目录中查找蛋白质结构文件（递归查找，保持目录结构）
+
+    每个扩展名同时匹配其 gzip 压缩版本，如 pdb 同时匹配 .pdb 和 .pdb.gz。
+    """
     input_path = Path(input_dir)
     if not input_path.exists():
         raise FileNotFoundError(f"输入目录不存在: {input_dir}")
@@ -58,8 +148,9 @@ def find_protein_files(input_dir: str, extensions: List[str]) -> List[Path]:
             ext = f'.{ext}'
         
         # 递归查找所有匹配的文件，保持目录结构
-        files = list(input_path.rglob(f"*{ext}"))
-        protein_files.extend(files)
+        patterns = [f"*{ext}"] if ext.endswith(".gz") else [f"*{ext}", f"*{ext}.gz"]
+        for pattern in patterns:
+            protein_files.extend(input_path.rglob(pattern))
     
     # 去重并排序
     protein_files = sorted(list(set(protein_files)))
@@ -68,105 +159,294 @@ def find_protein_files(input_dir: str, extensions: List[str]) -> List[Path]:
     return protein_files
 
 
+def preflight_atom_counts(protein_files: List[Path]) -> Dict[Path, int]:
+    """流式统计每个输入文件的原子数；无法读取的文件记为 0，处理时再报错"""
+    started = time.time()
+    atoms: Dict[Path, int] = {}
+    with console.status("统计原子数..."):
+        for protein_path in protein_files:
+            try:
+                atoms[protein_path] = count_atoms(protein_path)
+            except (OSError, EOFError):
+                atoms[protein_path] = 0
+    console.print(
+        f"预检: {len(atoms)} 个结构共 {sum(atoms.values())} 个原子，最大 {max(atoms.values(), default=0)} 个"
+        f"（{time.time() - started:.1f} 秒）"
+    )
+    return atoms
+
+
 def process_single_protein_worker(args) -> BatchResult:
     """并行处理单个蛋白质文件的工作函数"""
-    protein_path, input_dir, results_dir, topk, prank_home = args
-    return process_single_protein(protein_path, input_dir, results_dir, topk, prank_home, None, None)
+    protein_path, input_dir, results_dir, config = args
+    return process_single_protein(protein_path, input_dir, results_dir, config, None, None)
+
+
+def process_protein_chunk_worker(args) -> List[BatchResult]:
+    """并行处理一组蛋白质文件的工作函数（共享一次 P2Rank 启动）"""
+    protein_paths, input_dir, results_dir, config = args
+    return process_protein_chunk(protein_paths, input_dir, results_dir, config)
+
+
+def _protein_result_dir(protein_path: Path, input_dir: Path, results_dir: Path) -> Path:
+    """计算并创建蛋白质的结果目录，保持与输入目录相同的结构"""
+    # 计算相对于输入目录的路径，保持目录结构
+    relative_path = protein_path.relative_to(input_dir)
+    # 移除文件扩展名，作为结果目录名
+    result_subdir = results_dir / relative_path.parent / structure_stem(protein_path)
+
+    # 创建结果目录
+    result_subdir.mkdir(parents=True, exist_ok=True)
+    return result_subdir
+
+
+def pocket_records(result, pockets: Optional[list] = None) -> List[Dict[str, Any]]:
+    """口袋的字典形式（BatchResult.top_pockets）；pockets 默认为前 topk 个口袋，须按分数从高到低排列
+
+    P2Rank 重打分的口袋只有中心和分数，按中心距离对应回 fpocket 口袋，补上原始分数、
+    fpocket 排名（按原始分数）和描述符；对应不上时原始分数为 0、fpocket_rank 为 None。
+    """
+    all_pockets = getattr(result, 'all_pockets', None) or []
+    fpocket_ranks = {
+        idx: rank for rank, idx in enumerate(
+            sorted(range(len(all_pockets)), key=lambda idx: all_pockets[idx].raw_score, reverse=True), start=1
+        )
+    }
+    cliff_analysis = getattr(result, 'cliff_analysis', None)
+    high_confidence_count = cliff_analysis.high_confidence_count if cliff_analysis else 0
+    if pockets is None:
+        pockets = result.top_pockets
+    records = []
+    matches = match_pockets_by_center(pockets, all_pockets)
+    for i, (pocket, match) in enumerate(zip(pockets, matches)):
+        source = all_pockets[match] if match is not None else None
+        records.append({
+            'rank': i + 1,
+            'score': pocket.score,
+            'center_x': pocket.center_x,
+            'center_y': pocket.center_y,
+            'center_z': pocket.center_z,
+            'raw_score': source.raw_score if source is not None else pocket.raw_score,
+            'fpocket_rank': fpocket_ranks[match] if match is not None else None,
+            'is_high_confidence': i < high_confidence_count,
+            'descriptors': dict(source.descriptors) if source is not None else {},
+        })
+    return records
+
+
+def _success_batch_result(
+    protein_name: str,
+    protein_path: Path,
+    result,
+    result_subdir: Path,
+    processing_time: float,
+    keep: str = KEEP_ALL,
+    record_all_pockets: bool = False,
+) -> BatchResult:
+    """根据 pipeline 结果生成成功的 BatchResult，并按保留策略保存蛋白质的详细结果
+
+    record_all_pockets 为 True 时同时记录全部重打分口袋（BatchResult.rescored_pockets）。
+    """
+    # 提取结果信息
+    top_pockets = []
+    rescored_pockets = []
+    detailed_csv = None
+    cliff_analysis = None
+    spans = list(getattr(result, 'stage_spans', []))
+    if result and hasattr(result, 'top_pockets'):
+        top_pockets = pocket_records(result)
+        if record_all_pockets:
+            rescored_pockets = pocket_records(result, getattr(result, 'rescored_pockets', None) or result.top_pockets)
+
+        # 提取断崖分析结果
+        if hasattr(result, 'cliff_analysis') and result.cliff_analysis:
+            cliff_analysis = result.cliff_analysis
+
+        # 为每个蛋白质生成详细的CSV文件
+        if keeps_detailed_results(keep):
+            with stage_span(spans, "output"):
+                detailed_csv = save_protein_detailed_results(protein_name, result, result_subdir)
+        else:
+            remove_if_empty(result_subdir)
+
+    return BatchResult(
+        protein_name=protein_name,
+        protein_path=str(protein_path),
+        status="success",
+        num_pockets_detected=getattr(result, 'num_pockets_detected', 0),
+        num_pockets_filtered=getattr(result, 'num_pockets_filtered', 0),
+        top_pockets=top_pockets,
+        rescored_pockets=rescored_pockets,
+        processing_time=processing_time,
+        # 断崖分析结果
+        high_confidence_count=getattr(cliff_analysis, 'high_confidence_count', 0) if cliff_analysis else 0,
+        is_top1_dominant=getattr(cliff_analysis, 'is_top1_dominant', False) if cliff_analysis else False,
+        max_delta=getattr(cliff_analysis, 'max_delta', 0.0) if cliff_analysis else 0.0,
+        cliff_index=getattr(cliff_analysis, 'cliff_index', 0) if cliff_analysis else 0,
+        stage_spans=spans_to_records(spans),
+        detailed_csv=str(detailed_csv.resolve()) if detailed_csv is not None else None,
+    )
+
+
+def _failed_batch_result(
+    protein_name: str,
+    protein_path: Path,
+    error: Exception,
+    processing_time: float,
+    spans: Optional[list] = None,
+) -> BatchResult:
+    """生成失败的 BatchResult；spans 为失败前已执行阶段（包括出错阶段）的耗时"""
+    error_msg = str(error)
+    failure_class = classify_failure(error)
+    console.print(f"[red]处理 {protein_name} 时出错 ({failure_class}): {error_msg}[/red]")
+
+    return BatchResult(
+        protein_name=protein_name,
+        protein_path=str(protein_path),
+        status="failed",
+        error_message=error_msg,
+        processing_time=processing_time,
+        failure_class=failure_class,
+        stage_spans=spans_to_records(spans or []),
+    )
 
 
 def process_single_protein(
     protein_path: Path, 
     input_dir: Path,
     results_dir: Path,
-    topk: int, 
-    prank_home: Optional[str],
+    config: PipelineConfig,
     progress: Optional[Progress] = None,
     task_id: Optional[int] = None
 ) -> BatchResult:
     """处理单个蛋白质文件"""
     start_time = time.time()
-    protein_name = protein_path.stem
+    protein_name = structure_stem(protein_path)
+    spans: list = []
     
     try:
         # 更新进度条（如果提供）
         if progress and task_id is not None:
             progress.update(task_id, description=f"处理 {protein_name}")
         
-        # 计算相对于输入目录的路径，保持目录结构
-        relative_path = protein_path.relative_to(input_dir)
-        # 移除文件扩展名，作为结果目录名
-        result_subdir = results_dir / relative_path.parent / protein_name
-        
-        # 创建结果目录
-        result_subdir.mkdir(parents=True, exist_ok=True)
+        result_subdir = _protein_result_dir(protein_path, input_dir, results_dir)
         
         # 运行 pipeline，使用结果目录作为工作目录
-        from .pipeline import run_pipeline
-        result = run_pipeline(
-            pdb_path=str(protein_path),
-            workdir=str(result_subdir),
-            topk=topk,
-            prank_home=prank_home,
-            return_results=True,  # 我们需要返回结果而不是直接打印
-            enable_cliff_analysis=True  # 启用断崖分析
+        result = run_pipeline_with_config(
+            str(protein_path),
+            str(result_subdir),
+            config,
+            cache=open_result_cache(config.cache_dir, config.cache_max_bytes),
+            spans=spans,
         )
         
         processing_time = time.time() - start_time
-        
-        # 提取结果信息
-        top_pockets = []
-        cliff_analysis = None
-        if result and hasattr(result, 'top_pockets'):
-            for i, pocket in enumerate(result.top_pockets):
-                top_pockets.append({
-                    'rank': i + 1,
-                    'score': pocket.score,
-                    'center_x': pocket.center_x,
-                    'center_y': pocket.center_y,
-                    'center_z': pocket.center_z,
-                    'raw_score': pocket.raw_score
-                })
-            
-            # 提取断崖分析结果
-            if hasattr(result, 'cliff_analysis') and result.cliff_analysis:
-                cliff_analysis = result.cliff_analysis
-            
-            # 为每个蛋白质生成详细的CSV文件
-            save_protein_detailed_results(protein_name, result, result_subdir)
-        
-        return BatchResult(
-            protein_name=protein_name,
-            protein_path=str(protein_path),
-            status="success",
-            num_pockets_detected=getattr(result, 'num_pockets_detected', 0),
-            num_pockets_filtered=getattr(result, 'num_pockets_filtered', 0),
-            top_pockets=top_pockets,
-            processing_time=processing_time,
-            # 断崖分析结果
-            high_confidence_count=getattr(cliff_analysis, 'high_confidence_count', 0) if cliff_analysis else 0,
-            is_top1_dominant=getattr(cliff_analysis, 'is_top1_dominant', False) if cliff_analysis else False,
-            max_delta=getattr(cliff_analysis, 'max_delta', 0.0) if cliff_analysis else 0.0,
-            cliff_index=getattr(cliff_analysis, 'cliff_index', 0) if cliff_analysis else 0
+        return _success_batch_result(
+            protein_name, protein_path, result, result_subdir, processing_time, keep=config.keep,
+            record_all_pockets=config.record_all_pockets,
         )
         
     except Exception as e:
         processing_time = time.time() - start_time
-        error_msg = str(e)
-        console.print(f"[red]处理 {protein_name} 时出错: {error_msg}[/red]")
-        
-        return BatchResult(
-            protein_name=protein_name,
-            protein_path=str(protein_path),
-            status="failed",
-            error_message=error_msg,
-            processing_time=processing_time
-        )
+        return _failed_batch_result(protein_name, protein_path, e, processing_time, spans)
+
+
+def process_protein_chunk(
+    protein_paths: List[Path],
+    input_dir: Path,
+    results_dir: Path,
+    config: PipelineConfig,
+) -> List[BatchResult]:
+    """处理一组蛋白质文件：逐个运行 fpocket，然后只启动一次 P2Rank 为整组重打分"""
+    results: Dict[Path, BatchResult] = {}
+    detected_list: List[DetectedPockets] = []
+    elapsed: Dict[Path, float] = {}
+    cache = open_result_cache(config.cache_dir, config.cache_max_bytes)
+
+    for protein_path in protein_paths:
+        start_time = time.time()
+        spans: list = []
+        try:
+            result_subdir = _protein_result_dir(protein_path, input_dir, results_dir)
+            key = None
+            if cache is not None:
+                with stage_span(spans, "cache"):
+                    cached, key = load_cached_pockets(cache, str(protein_path), str(result_subdir))
+                if cached is not None:
+                    # 命中缓存的蛋白质不需要参与本组的 P2Rank 重打分
+                    detected, rescored = cached
+                    detected.spans = spans
+                    result = finalize_pipeline_result(
+                        detected, rescored, config.topk, enable_cliff_analysis=config.enable_cliff_analysis
+                    )
+                    results[protein_path] = _success_batch_result(
+                        structure_stem(protein_path), protein_path, result, result_subdir, time.time() - start_time,
+                        keep=config.keep, record_all_pockets=config.record_all_pockets,
+                    )
+                    continue
+            detected = detect_pockets(
+                str(protein_path), str(result_subdir),
+                scratch_dir=config.scratch_dir, copy_all=copies_all_fpocket_output(config.keep),
+                timeout=config.fpocket_timeout, retry=config.retry, spans=spans,
+            )
+            detected.cache_key = key
+            detected_list.append(detected)
+        except Exception as e:
+            results[protein_path] = _failed_batch_result(
+                structure_stem(protein_path), protein_path, e, time.time() - start_time, spans
+            )
+        elapsed[protein_path] = time.time() - start_time
 
+    if detected_list:
+        start_time = time.time()
+        jobs = [RescoreJob(pdb_path=d.pdb_path, work_dir=d.work_dir) for d in detected_list]
+        chunk_out_dir = results_dir / ".p2rank_chunks" / f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        launch_spans: list = []
+        try:
+            with stage_span(launch_spans, "p2rank", shared_with=len(jobs)):
+                outcomes = rescore_batch_with_p2rank(
+                    jobs, chunk_out_dir, config.prank_home,
+                    threads=config.p2rank_threads, heap_mb=config.p2rank_heap_mb,
+                    timeout=config.p2rank_timeout, retry=config.retry,
+                )
+        except Exception as e:
+            outcomes = [e] * len(jobs)
+        # P2Rank 的耗时由整组蛋白质平均分摊
+        rescore_share = (time.time() - start_time) / len(detected_list)
 
-def save_protein_detailed_results(protein_name: str, result, result_dir: Path) -> None:
-    """为单个蛋白质保存详细的CSV结果文件"""
+        for detected, outcome in zip(detected_list, outcomes):
+            protein_path = detected.pdb_path
+            start_time = time.time()
+            # 同一次 prank 启动的时间段记录到组内每个蛋白质上（shared_with 为组大小）
+            detected.spans.extend(launch_spans)
+            try:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                if cache is not None:
+                    with stage_span(detected.spans, "cache"):
+                        store_cached_pockets(cache, detected, outcome)
+                result = finalize_pipeline_result(
+                    detected, outcome, config.topk, enable_cliff_analysis=config.enable_cliff_analysis
+                )
+                apply_retention(detected.work_dir, detected.pdb_path, config.keep)
+                processing_time = elapsed[protein_path] + rescore_share + (time.time() - start_time)
+                results[protein_path] = _success_batch_result(
+                    structure_stem(protein_path), protein_path, result, detected.work_dir, processing_time, keep=config.keep,
+                    record_all_pockets=config.record_all_pockets,
+                )
+            except Exception as e:
+                processing_time = elapsed[protein_path] + rescore_share + (time.time() - start_time)
+                results[protein_path] = _failed_batch_result(
+                    structure_stem(protein_path), protein_path, e, processing_time, detected.spans
+                )
+
+    return [results[p] for p in protein_paths]
+
+
+def save_protein_detailed_results(protein_name: str, result, result_dir: Path) -> Optional[Path]:
+    """为单个蛋白质保存详细的CSV结果文件，返回文件路径"""
     if not result or not hasattr(result, 'top_pockets'):
-        return
+        return None
     
     # 创建详细的CSV文件
     detailed_csv = result_dir / f"{protein_name}_pocket_results.csv"
@@ -239,70 +519,159 @@ def save_protein_detailed_results(protein_name: str, result, result_dir: Path) -
             writer.writerow(['高置信度口袋集合', ', '.join(cliff_analysis.high_confidence_set)])
     
     console.print(f"✓ {protein_name} 详细结果已保存到: {detailed_csv}")
+    return detailed_csv
 
 
-def save_batch_results(results: List[BatchResult], output_csv: str) -> None:
-    """保存批量处理结果到CSV文件"""
-    output_path = Path(output_csv)
-    
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        
-        # 写入表头
-        writer.writerow([
-            'protein_name', 'protein_path', 'status', 'error_message',
-            'num_pockets_detected', 'num_pockets_filtered', 'processing_time',
-            'top_pocket_1_score', 'top_pocket_1_center_x', 'top_pocket_1_center_y', 'top_pocket_1_center_z',
-            'top_pocket_2_score', 'top_pocket_2_center_x', 'top_pocket_2_center_y', 'top_pocket_2_center_z',
-            'top_pocket_3_score', 'top_pocket_3_center_x', 'top_pocket_3_center_y', 'top_pocket_3_center_z',
-            # 断崖分析结果
-            'high_confidence_count', 'is_top1_dominant', 'max_delta', 'cliff_index'
+def summary_header(topk: int) -> List[str]:
+    """批量处理摘要 CSV 的表头，口袋列的数量与 topk 一致"""
+    header = [
+        'protein_name', 'protein_path', 'status', 'error_message', 'failure_class',
+        'num_pockets_detected', 'num_pockets_filtered', 'processing_time',
+    ]
+    for i in range(1, topk + 1):
+        header.extend([
+            f'top_pocket_{i}_score', f'top_pocket_{i}_center_x', f'top_pocket_{i}_center_y', f'top_pocket_{i}_center_z',
         ])
-        
-        # 写入数据
-        for result in results:
-            row = [
-                result.protein_name,
-                result.protein_path,
-                result.status,
-                result.error_message or '',
-                result.num_pockets_detected,
-                result.num_pockets_filtered,
-                f"{result.processing_time:.2f}",
-            ]
-            
-            # 添加前3个口袋的信息
-            for i in range(3):
-                if i < len(result.top_pockets):
-                    pocket = result.top_pockets[i]
-                    row.extend([
-                        f"{pocket['score']:.4f}",
-                        f"{pocket['center_x']:.3f}",
-                        f"{pocket['center_y']:.3f}",
-                        f"{pocket['center_z']:.3f}",
-                    ])
-                else:
-                    row.extend(['', '', '', ''])
-            
-            # 添加断崖分析结果
+    # 断崖分析结果
+    header.extend(['high_confidence_count', 'is_top1_dominant', 'max_delta', 'cliff_index'])
+    # 各阶段耗时（秒）
+    header.extend(f'{stage}_time' for stage in STAGES)
+    # 详细结果 CSV 的位置：合并多个节点的摘要后，据此找到每个蛋白质（胜出记录）的详细结果
+    header.append('detailed_csv')
+    return header
+
+
+def summary_row(result: BatchResult, topk: int) -> list:
+    row = [
+        result.protein_name,
+        result.protein_path,
+        result.status,
+        result.error_message or '',
+        result.failure_class or '',
+        result.num_pockets_detected,
+        result.num_pockets_filtered,
+        f"{result.processing_time:.2f}",
+    ]
+    
+    # 添加前 topk 个口袋的信息
+    for i in range(topk):
+        if i < len(result.top_pockets):
+            pocket = result.top_pockets[i]
             row.extend([
-                result.high_confidence_count,
-                result.is_top1_dominant,
-                f"{result.max_delta:.4f}",
-                result.cliff_index
+                f"{pocket['score']:.4f}",
+                f"{pocket['center_x']:.3f}",
+                f"{pocket['center_y']:.3f}",
+                f"{pocket['center_z']:.3f}",
             ])
-            
-            writer.writerow(row)
+        else:
+            row.extend(['', '', '', ''])
     
-    console.print(f"✓ 批量处理结果已保存到: {output_path}")
+    # 添加断崖分析结果
+    row.extend([
+        result.high_confidence_count,
+        result.is_top1_dominant,
+        f"{result.max_delta:.4f}",
+        result.cliff_index
+    ])
+    
+    # 添加各阶段耗时，未经过的阶段留空
+    totals = stage_totals(result.stage_spans)
+    row.extend(f"{totals[stage]:.3f}" if stage in totals else '' for stage in STAGES)
+    row.append(result.detailed_csv or '')
+    return row
 
 
-def print_batch_summary(results: List[BatchResult]) -> None:
+class BatchSummaryWriter:
+    """流式写入批量处理摘要 CSV
+
+    结果到达时立即写入一行，每 flush_every 行或每 flush_interval 秒刷新一次到磁盘，
+    批处理仍在运行时下游任务即可读取已完成的部分。
+    """
+
+    def __init__(self, output_csv: str, topk: int, flush_every: int = 100, flush_interval: float = 5.0):
+        self.output_path = Path(output_csv)
+        self.topk = topk
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._file = open(self.output_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(summary_header(topk))
+        self.flush()
+
+    def write(self, result: BatchResult) -> None:
+        self._writer.writerow(summary_row(result, self.topk))
+        self.rows_written += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self) -> "BatchSummaryWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def save_batch_results(results: List[BatchResult], output_csv: str, topk: int = 3) -> None:
+    """保存批量处理结果到CSV文件"""
+    with BatchSummaryWriter(output_csv, topk) as writer:
+        for result in results:
+            writer.write(result)
+    
+    console.print(f"✓ 批量处理结果已保存到: {writer.output_path}")
+
+
+class BatchStats:
+    """批量处理统计的增量累加器，内存占用与蛋白质数量无关（失败列表只保留前若干条）"""
+
+    max_failures_kept = 50
+
+    def __init__(self):
+        self.total_files = 0
+        self.successful = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.top1_dominant_count = 0
+        self.sum_high_confidence = 0
+        self.sum_max_delta = 0.0
+        self.failures: List[tuple] = []
+        self.failure_classes: Dict[str, int] = {}
+
+    def add(self, result: BatchResult) -> None:
+        self.total_files += 1
+        self.total_time += result.processing_time
+        if result.status == "success":
+            self.successful += 1
+            self.top1_dominant_count += int(bool(result.is_top1_dominant))
+            self.sum_high_confidence += result.high_confidence_count
+            self.sum_max_delta += result.max_delta
+        elif result.status == "failed":
+            self.failed += 1
+            failure_class = result.failure_class or "unknown"
+            self.failure_classes[failure_class] = self.failure_classes.get(failure_class, 0) + 1
+            if len(self.failures) < self.max_failures_kept:
+                self.failures.append((result.protein_name, result.error_message))
+
+
+def print_batch_stats(stats: BatchStats) -> None:
     """打印批量处理摘要"""
-    total_files = len(results)
-    successful = sum(1 for r in results if r.status == "success")
-    failed = sum(1 for r in results if r.status == "failed")
-    total_time = sum(r.processing_time for r in results)
+    total_files = stats.total_files
+    successful = stats.successful
+    failed = stats.failed
+    total_time = stats.total_time
     
     # 创建摘要表格
     table = Table(title="批量处理摘要")
@@ -312,6 +681,8 @@ def print_batch_summary(results: List[BatchResult]) -> None:
     table.add_row("总文件数", str(total_files))
     table.add_row("成功处理", str(successful))
     table.add_row("处理失败", str(failed))
+    if stats.failure_classes:
+        table.add_row("失败类型", ", ".join(f"{k} {v}" for k, v in sorted(stats.failure_classes.items())))
     table.add_row("成功率", f"{(successful/total_files*100):.1f}%" if total_files > 0 else "0%")
     table.add_row("总处理时间", f"{total_time:.1f} 秒")
     table.add_row("平均处理时间", f"{total_time/total_files:.1f} 秒" if total_files > 0 else "0 秒")
@@ -320,28 +691,100 @@ def print_batch_summary(results: List[BatchResult]) -> None:
     
     # 断崖分析统计
     if successful > 0:
-        successful_results = [r for r in results if r.status == "success"]
-        top1_dominant_count = sum(1 for r in successful_results if r.is_top1_dominant)
-        avg_high_confidence = sum(r.high_confidence_count for r in successful_results) / len(successful_results)
-        avg_max_delta = sum(r.max_delta for r in successful_results) / len(successful_results)
-        
         cliff_table = Table(title="断崖分析统计")
         cliff_table.add_column("统计项", style="cyan")
         cliff_table.add_column("数值", style="magenta")
         
-        cliff_table.add_row("Top1主导蛋白数", str(top1_dominant_count))
-        cliff_table.add_row("Top1主导比例", f"{(top1_dominant_count/len(successful_results)*100):.1f}%")
-        cliff_table.add_row("平均高置信度口袋数", f"{avg_high_confidence:.1f}")
-        cliff_table.add_row("平均最大分数差", f"{avg_max_delta:.4f}")
+        cliff_table.add_row("Top1主导蛋白数", str(stats.top1_dominant_count))
+        cliff_table.add_row("Top1主导比例", f"{(stats.top1_dominant_count/successful*100):.1f}%")
+        cliff_table.add_row("平均高置信度口袋数", f"{stats.sum_high_confidence/successful:.1f}")
+        cliff_table.add_row("平均最大分数差", f"{stats.sum_max_delta/successful:.4f}")
         
         console.print(cliff_table)
     
     # 显示失败的文件
     if failed > 0:
         console.print("\n[red]处理失败的文件:[/red]")
-        for result in results:
-            if result.status == "failed":
-                console.print(f"  - {result.protein_name}: {result.error_message}")
+        for protein_name, error_message in stats.failures:
+            console.print(f"  - {protein_name}: {error_message}")
+        if failed > len(stats.failures):
+            console.print(f"  ... 以及另外 {failed - len(stats.failures)} 个（见摘要CSV）")
+
+
+def print_batch_summary(results: List[BatchResult]) -> None:
+    """打印批量处理摘要"""
+    stats = BatchStats()
+    for result in results:
+        stats.add(result)
+    print_batch_stats(stats)
+
+
+def _future_results(future: Future, args) -> List[BatchResult]:
+    """取出一个任务的 BatchResult 列表；工作进程异常退出时整个任务的蛋白质都记为失败"""
+    protein_paths = args[0] if isinstance(args[0], list) else [args[0]]
+    try:
+        outcome = future.result()
+    except Exception as e:
+        # 工作进程已退出，它记录的阶段耗时随之丢失
+        return [_failed_batch_result(structure_stem(p), p, e, 0.0) for p in protein_paths]
+    return outcome if isinstance(outcome, list) else [outcome]
+
+
+def _pin_pool_worker(cpu_queue) -> None:
+    """进程池 worker 的初始化函数：领取一个核集合并绑定，fpocket 与 prank 子进程会继承"""
+    try:
+        pin_to_cpus(cpu_queue.get(timeout=5))
+    except queue.Empty:
+        pass
+
+
+def _iter_pool_results(
+    worker,
+    process_args: list,
+    max_workers: int,
+    budget: Optional[MemoryBudget] = None,
+    task_mb: Optional[List[float]] = None,
+    cpu_sets: Optional[List[List[int]]] = None,
+) -> Iterator[BatchResult]:
+    """使用进程池并行处理，按完成顺序产出 BatchResult
+
+    指定 budget 时做内存准入控制：task_mb[i] 为第 i 个任务的估算内存，只有预算足够时才提交
+    下一个任务。任务按原顺序放行，队首的大任务等待期间不会被后面的小任务插队。
+    指定 cpu_sets 时每个 worker 进程启动时绑定到其中一个核集合。
+    """
+    pool_options = {}
+    if cpu_sets:
+        cpu_queue = mp.Queue()
+        for cpus in cpu_sets:
+            cpu_queue.put(cpus)
+        pool_options = {"initializer": _pin_pool_worker, "initargs": (cpu_queue,)}
+    executor = ProcessPoolExecutor(max_workers=max_workers, **pool_options)
+    try:
+        if budget is None:
+            # 提交所有任务
+            future_to_args = {executor.submit(worker, args): args for args in process_args}
+            
+            # 收集结果
+            for future in as_completed(future_to_args):
+                yield from _future_results(future, future_to_args[future])
+        else:
+            pending = deque(zip(process_args, task_mb))
+            running: Dict[Future, tuple] = {}
+            while pending or running:
+                # 已提交的任务不超过进程数，否则排队中的任务也会占用预算
+                while pending and len(running) < max_workers and budget.try_acquire(pending[0][1]):
+                    args, mb = pending.popleft()
+                    running[executor.submit(worker, args)] = (args, mb)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    args, mb = running.pop(future)
+                    budget.release(mb)
+                    yield from _future_results(future, args)
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
 
 
 def run_batch_pipeline(
@@ -352,14 +795,114 @@ def run_batch_pipeline(
     output_csv: str = "batch_results.csv",
     file_extensions: str = "pdb,cif",
     max_workers: Optional[int] = None,
+    enable_cliff_analysis: bool = True,
+    p2rank_chunk_size: int = 1,
+    p2rank_threads: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    resume: bool = False,
+    retry_failed: bool = False,
+    journal_path: Optional[str] = None,
+    scheduler: str = "pool",
+    fpocket_workers: Optional[int] = None,
+    parse_workers: Optional[int] = None,
+    p2rank_workers: Optional[int] = None,
+    stage_queue_size: int = 16,
+    scratch_dir: Optional[str] = None,
+    keep: str = KEEP_ALL,
+    trace_file: Optional[str] = None,
+    p2rank_heap_mb: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+    cpu_budget: Optional[int] = None,
+    pin_cpus: bool = False,
+    order: str = ORDER_PATH,
+    fpocket_timeout: Optional[float] = None,
+    p2rank_timeout: Optional[float] = None,
+    max_retries: int = 2,
+    retry_backoff: float = 5.0,
+    shard: Optional[str] = None,
+    pocket_table: Optional[str] = None,
+    pocket_table_row_group: Optional[int] = None,
 ) -> None:
-    """运行批量处理 pipeline"""
+    """运行批量处理 pipeline
+
+    p2rank_chunk_size > 1 时，每个工作进程一次处理一组蛋白质，整组只启动一次 P2Rank，
+    避免每个蛋白质都承担 JVM 启动和模型加载的开销。
+
+    每个蛋白质完成后立即追加写入进度日志（默认 results_dir/batch_journal.jsonl）。
+    resume=True 时读取日志并跳过已成功的蛋白质；retry_failed=True 时重新处理失败的蛋白质。
+
+    scheduler="staged" 时使用分阶段流水线调度（见 scheduler.StagedScheduler），
+    fpocket、解析去重和 P2Rank 各自使用独立的并发度（未指定时由 max_workers 推算）。
+    scheduler="async" 时由一个事件循环驱动所有 fpocket / prank 子进程（见 aio 模块），
+    fpocket_workers / p2rank_workers 为同时运行的进程数上限；该模式下每个蛋白质单独启动 P2Rank。
+
+    keep 控制每个蛋白质结果目录中保留的中间产物（none/summary/essential/all，见 retention 模块）；
+    失败的蛋白质总是保留已生成的文件，便于排查。
+
+    每个蛋白质各阶段（缓存、fpocket、解析、去重、P2Rank、断崖分析、输出）的耗时写入摘要 CSV 的
+    *_time 列；指定 trace_file 时同时写出 Chrome trace JSON，可在 chrome://tracing 或 Perfetto 中查看。
+
+    p2rank_heap_mb 限制每次 prank 启动的 JVM 堆（MiB）。指定 memory_budget（字节）时先统计每个输入的
+    原子数，按 resources 模块的估算只在预算足够时才开始处理下一个蛋白质（或一组蛋白质）；
+    此时未指定 max_workers 则使用全部 CPU 核数，同时运行的任务数由内存预算决定。
+
+    cpu_budget 为所有 worker 共用的核数：未指定 p2rank_threads 时按 cpu_budget / worker 数分配
+    P2Rank 线程，并据此限制 JVM 的处理器数和 GC 线程数。pin_cpus=True 时按 CPU 拓扑把每个 worker
+    绑定到互不相交的核集合（未指定 cpu_budget 时使用全部可用核）。
+
+    order="largest-first" 时先统计每个输入的原子数，按原子数从大到小提交（p2rank_chunk_size > 1 时
+    大小相近的蛋白质分在同一组）。统计过原子数时（largest-first 或指定 memory_budget），
+    进度条按原子数计算完成比例和剩余时间。
+
+    fpocket_timeout / p2rank_timeout 为每个蛋白质各阶段的超时（秒），超时后杀死整个子进程组，
+    该蛋白质记为失败（failure_class="timeout"）。临时性失败（进程被信号杀死、JVM 崩溃等）
+    最多重试 max_retries 次，第 n 次重试前等待 retry_backoff * 2^(n-1) 秒。
+
+    shard="i/N" 时只处理第 i 个分片（0 <= i < N）：按相对于 input_dir 的路径的稳定哈希分配，
+    各节点使用相同的参数即可分担同一个输入目录，无需协调。摘要 CSV、进度日志和 trace 文件名
+    加上分片后缀（见 shard_path），多个分片可以共用同一个 results_dir。
+
+    指定 pocket_table（.parquet 或 .arrow）时，同时把所有成功蛋白质的全部重打分口袋写成一张列式表
+    （不受 topk 限制，按 rank / is_high_confidence 列筛选），每个口袋一行，每 pocket_table_row_group 行写出一个 row group（见 columnar 模块，需要 pyarrow）。
+    """
     
     console.print(f"[bold blue]开始批量处理蛋白质口袋检测[/bold blue]")
     console.print(f"输入目录: {input_dir}")
     console.print(f"结果目录: {results_dir}")
     console.print(f"输出CSV: {output_csv}")
     console.print(f"文件扩展名: {file_extensions}")
+    if cache_dir:
+        console.print(f"结果缓存: {cache_dir}")
+    
+    if scheduler not in ("pool", "staged", "async"):
+        console.print(f"[red]错误: 未知的调度方式 {scheduler}（可选: pool, staged, async）[/red]")
+        return
+    if order not in SCHEDULE_ORDERS:
+        console.print(f"[red]错误: 未知的处理顺序 {order}（可选: {', '.join(SCHEDULE_ORDERS)}）[/red]")
+        return
+    try:
+        validate_keep(keep)
+    except ValueError as e:
+        console.print(f"[red]错误: {e}[/red]")
+        return
+    if keep != KEEP_ALL:
+        console.print(f"中间产物保留策略: {keep}")
+    if pocket_table:
+        from .columnar import require_pyarrow, table_format
+        try:
+            table_format(pocket_table)
+            require_pyarrow()
+        except (ImportError, ValueError) as e:
+            console.print(f"[red]错误: {e}[/red]")
+            return
+    shard_index = shard_count = None
+    if shard:
+        try:
+            shard_index, shard_count = parse_shard(shard)
+        except ValueError as e:
+            console.print(f"[red]错误: {e}[/red]")
+            return
     
     # 解析文件扩展名
     extensions = [ext.strip() for ext in file_extensions.split(',')]
@@ -380,6 +923,43 @@ def run_batch_pipeline(
     results_path = Path(results_dir)
     results_path.mkdir(parents=True, exist_ok=True)
     
+    # 分片：只保留属于本分片的文件，每个分片写自己的摘要、进度日志和 trace
+    journal_file = journal_path_for(results_path, journal_path)
+    if shard_count is not None:
+        total_files = len(protein_files)
+        protein_files = [
+            p for p in protein_files if shard_of(protein_key(p, input_path), shard_count) == shard_index
+        ]
+        journal_file = shard_path(journal_file, shard_index, shard_count)
+        output_csv = str(shard_path(output_csv, shard_index, shard_count))
+        if trace_file:
+            trace_file = str(shard_path(trace_file, shard_index, shard_count))
+        if pocket_table:
+            pocket_table = str(shard_path(pocket_table, shard_index, shard_count))
+        console.print(f"分片 {shard_index}/{shard_count}: {len(protein_files)}/{total_files} 个蛋白质，摘要 {output_csv}")
+        if not protein_files:
+            console.print("[yellow]本分片没有分配到蛋白质文件[/yellow]")
+            return
+    
+    # 读取进度日志，确定需要处理的蛋白质
+    previous_records = []
+    if resume:
+        records = load_journal(journal_file)
+        pending_files = []
+        for protein_path in protein_files:
+            record = records.get(protein_key(protein_path, input_path))
+            if record and (record["result"]["status"] == "success" or not retry_failed):
+                previous_records.append(record)
+            else:
+                pending_files.append(protein_path)
+        del records
+        console.print(
+            f"从进度日志恢复: {len(previous_records)} 个蛋白质已完成，{len(pending_files)} 个待处理 ({journal_file})"
+        )
+        protein_files = pending_files
+    elif journal_file.exists():
+        console.print(f"[yellow]覆盖已有的进度日志: {journal_file}（使用 --resume 可从中断处继续）[/yellow]")
+    
     # 预先检查P2Rank安装（只检查一次）
     console.print("🔍 检查P2Rank安装...")
     from .installer import ensure_p2rank_installed
@@ -391,24 +971,163 @@ def run_batch_pipeline(
         return
     
     # 确定并行工作进程数
+    cpus = available_cpus()
+    if pin_cpus and cpu_budget is None:
+        cpu_budget = len(cpus)
     if max_workers is None:
-        max_workers = min(mp.cpu_count(), 8)  # 最多使用8个进程，避免过度并行
+        if cpu_budget:
+            max_workers = max(1, cpu_budget // (p2rank_threads or 1))  # 每个 worker 占用 P2Rank 线程数个核
+        elif memory_budget:
+            max_workers = mp.cpu_count()  # 由内存预算限制实际并发
+        else:
+            max_workers = min(mp.cpu_count(), 8)  # 最多使用8个进程，避免过度并行
     
     console.print(f"使用 {max_workers} 个并行进程处理")
+    if p2rank_heap_mb:
+        console.print(f"P2Rank 堆上限: {p2rank_heap_mb} MiB")
     
-    # 准备并行处理参数（使用预先检查的P2Rank路径）
-    process_args = [
-        (protein_path, input_path, results_path, topk, str(p2rank_path))
-        for protein_path in protein_files
-    ]
+    stage_config = None
+    if scheduler in ("staged", "async"):
+        p2rank_workers = p2rank_workers or max(1, max_workers // 2)
+        if cpu_budget:
+            # 一半的核留给 P2Rank，其余给单线程的 fpocket
+            p2rank_threads = p2rank_threads or max(1, cpu_budget // (2 * p2rank_workers))
+            fpocket_workers = fpocket_workers or max(1, cpu_budget - p2rank_workers * p2rank_threads)
+        fpocket_workers = fpocket_workers or max_workers
+    if scheduler == "staged":
+        from .scheduler import StageConfig
+        
+        stage_config = StageConfig(
+            fpocket_workers=fpocket_workers,
+            parse_workers=parse_workers or max(1, max_workers // 4),
+            p2rank_workers=p2rank_workers,
+            queue_size=stage_queue_size,
+            p2rank_chunk_size=p2rank_chunk_size,
+        )
+    elif cpu_budget and p2rank_threads is None:
+        p2rank_threads = max(1, cpu_budget // max_workers)
+    
+    # CPU 绑定：每个 worker（流水线模式下每个 fpocket / P2Rank 线程）一个互不相交的核集合
+    cpu_sets = None
+    if cpu_budget:
+        console.print(f"CPU 预算: {cpu_budget} 核，每次 P2Rank 启动使用 {p2rank_threads} 个线程")
+    if pin_cpus and scheduler == "async":
+        console.print("[yellow]async 调度的子进程由同一个事件循环启动，不支持 --pin-cpus，不绑定 CPU[/yellow]")
+    elif pin_cpus:
+        if stage_config is not None:
+            sizes = [1] * stage_config.fpocket_workers + [p2rank_threads] * stage_config.p2rank_workers
+        else:
+            sizes = [p2rank_threads] * max_workers
+        cpu_sets = split_cpus(cpus[:cpu_budget], sizes)
+        if cpu_sets is None:
+            console.print(
+                f"[yellow]可用的 {min(len(cpus), cpu_budget)} 个核不足以给每个 worker 分配独立的核集合"
+                f"（需要 {sum(sizes)} 个），不绑定 CPU[/yellow]"
+            )
+        elif stage_config is not None:
+            stage_config.fpocket_cpus = cpu_sets[:stage_config.fpocket_workers]
+            stage_config.p2rank_cpus = cpu_sets[stage_config.fpocket_workers:]
+    
+    config = PipelineConfig(
+        topk=topk,
+        prank_home=str(p2rank_path),  # 使用预先检查的P2Rank路径
+        enable_cliff_analysis=enable_cliff_analysis,
+        p2rank_threads=p2rank_threads,
+        p2rank_heap_mb=p2rank_heap_mb,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        scratch_dir=scratch_dir,
+        keep=keep,
+        fpocket_timeout=fpocket_timeout,
+        p2rank_timeout=p2rank_timeout,
+        retry=RetryPolicy(max_retries=max_retries, backoff=retry_backoff),
+        record_all_pockets=bool(pocket_table),
+    )
+    
+    # 预检原子数，用于处理顺序、内存估算和按原子数加权的剩余时间
+    atoms: Optional[Dict[Path, int]] = None
+    if order != ORDER_PATH or memory_budget:
+        atoms = preflight_atom_counts(protein_files)
+    if order == ORDER_LARGEST_FIRST:
+        # 大结构最先开始，避免最后提交的大复合物在其他 worker 空闲后仍在运行；原子数相同时保持路径顺序
+        protein_files = sorted(protein_files, key=lambda p: atoms[p], reverse=True)
+        console.print("处理顺序: 按原子数从大到小")
+    
+    # 准备并行处理参数：每个任务是一个蛋白质，或一组共享 P2Rank 启动的蛋白质
+    if p2rank_chunk_size > 1 and scheduler == "async":
+        console.print("[yellow]async 调度不支持 P2Rank 批量重打分，每个蛋白质单独启动 P2Rank[/yellow]")
+        p2rank_chunk_size = 1
+    if p2rank_chunk_size > 1:
+        console.print(f"P2Rank 批量重打分: 每 {p2rank_chunk_size} 个蛋白质启动一次")
+        worker = process_protein_chunk_worker
+        process_args = [
+            (protein_files[i:i + p2rank_chunk_size], input_path, results_path, config)
+            for i in range(0, len(protein_files), p2rank_chunk_size)
+        ]
+    else:
+        worker = process_single_protein_worker
+        process_args = [
+            (protein_path, input_path, results_path, config)
+            for protein_path in protein_files
+        ]
+    
+    # 内存准入控制：按原子数估算每个任务的峰值内存
+    budget = None
+    task_mb: List[float] = []
+    protein_mb: Dict[Path, float] = {}
+    if memory_budget:
+        budget = MemoryBudget(memory_budget / 1024 ** 2)
+        for protein_path in protein_files:
+            protein_mb[protein_path] = estimate_task_mb([atoms[protein_path]], p2rank_heap_mb)
+        task_mb = [
+            estimate_task_mb([atoms[p] for p in (args[0] if isinstance(args[0], list) else [args[0]])], p2rank_heap_mb)
+            for args in process_args
+        ]
+        console.print(
+            f"内存预算: {format_size(memory_budget)}，单个任务估算峰值 {max(task_mb):.0f} MiB"
+            f"（中位数 {sorted(task_mb)[len(task_mb) // 2]:.0f} MiB）"
+        )
+        oversized = sum(1 for mb in task_mb if mb > budget.total_mb)
+        if oversized:
+            console.print(f"[yellow]{oversized} 个任务的估算内存超过预算，将在没有其他任务运行时单独处理[/yellow]")
+    
+    # 批量处理：结果到达时立即写入进度日志和摘要CSV，不在内存中累积
+    journal = BatchJournal(journal_file, append=resume)
+    summary_writer = BatchSummaryWriter(output_csv, topk)
+    trace = ChromeTraceWriter(trace_file) if trace_file else None
+    pocket_writer = None
+    if pocket_table:
+        from .columnar import DEFAULT_ROW_GROUP_SIZE, PocketTableWriter
+        pocket_writer = PocketTableWriter(pocket_table, pocket_table_row_group or DEFAULT_ROW_GROUP_SIZE)
+    stats = BatchStats()
+    
+    # 恢复运行时，先把之前已完成的结果写入新的摘要
+    for record in previous_records:
+        previous_result = BatchResult(**record["result"])
+        summary_writer.write(previous_result)
+        if pocket_writer is not None:
+            pocket_writer.write(record["key"], previous_result)
+        stats.add(previous_result)
+    del previous_records
     
-    # 批量处理
-    results = []
+    def record_result(result: BatchResult) -> None:
+        key = protein_key(Path(result.protein_path), input_path)
+        journal.append(key, asdict(result))
+        summary_writer.write(result)
+        if pocket_writer is not None:
+            pocket_writer.write(key, result)
+        if trace is not None:
+            trace.write_spans(key, result.stage_spans, status=result.status)
+        stats.add(result)
     
-    with Progress(
+    # 进度条的工作量：有原子数时按原子数计（大结构占更大比例），否则按蛋白质个数
+    weights = {str(p): max(1, atoms[p]) for p in protein_files} if atoms is not None else {}
+    
+    with journal, summary_writer, (trace or nullcontext()), (pocket_writer or nullcontext()), Progress(
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         "[progress.percentage]{task.percentage:>3.0f}%",
+        TextColumn("{task.fields[proteins]}"),
         "•",
         TimeElapsedColumn(),
         "•",
@@ -416,50 +1135,67 @@ def run_batch_pipeline(
         console=console,
     ) as progress:
         
-        task_id = progress.add_task("批量处理中...", total=len(protein_files))
+        total_work = sum(weights.values()) if weights else len(protein_files)
+        task_id = progress.add_task("批量处理中...", total=total_work, proteins=f"0/{len(protein_files)}")
+        completed = 0
         
-        # 使用进程池并行处理
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_protein = {
-                executor.submit(process_single_protein_worker, args): args[0]
-                for args in process_args
-            }
+        if stage_config is not None:
+            from .scheduler import StagedScheduler
             
-            # 收集结果
-            for future in as_completed(future_to_protein):
-                protein_path = future_to_protein[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    progress.advance(task_id)
-                    
-                    # 更新进度条描述
-                    if result.status == "success":
-                        progress.update(task_id, description=f"完成 {result.protein_name}")
-                    else:
-                        progress.update(task_id, description=f"失败 {result.protein_name}")
-                        
-                except Exception as e:
-                    # 处理异常情况
-                    protein_name = protein_path.stem
-                    error_result = BatchResult(
-                        protein_name=protein_name,
-                        protein_path=str(protein_path),
-                        status="failed",
-                        error_message=str(e),
-                        processing_time=0.0
-                    )
-                    results.append(error_result)
-                    progress.advance(task_id)
-                    progress.update(task_id, description=f"异常 {protein_name}")
+            console.print(
+                f"流水线调度: fpocket {stage_config.fpocket_workers} / 解析 {stage_config.parse_workers} / "
+                f"P2Rank {stage_config.p2rank_workers} 并发，队列容量 {stage_config.queue_size}"
+            )
+            result_stream = StagedScheduler(
+                input_path, results_path, config, stage_config, budget=budget, protein_mb=protein_mb
+            ).run(protein_files)
+        elif scheduler == "async":
+            from .aio import iter_async_batch_results
+            
+            console.print(f"asyncio 调度: 最多 {fpocket_workers} 个 fpocket / {p2rank_workers} 个 P2Rank 同时运行")
+            result_stream = iter_async_batch_results(
+                protein_files, input_path, results_path, config, fpocket_workers, p2rank_workers,
+                budget=budget, protein_mb=protein_mb,
+            )
+        else:
+            result_stream = _iter_pool_results(
+                worker, process_args, max_workers, budget=budget, task_mb=task_mb, cpu_sets=cpu_sets
+            )
+        
+        try:
+            for result in result_stream:
+                record_result(result)
+                completed += 1
+                progress.update(
+                    task_id, advance=weights.get(result.protein_path, 1), proteins=f"{completed}/{len(protein_files)}"
+                )
+                
+                # 更新进度条描述
+                if result.status == "success":
+                    progress.update(task_id, description=f"完成 {result.protein_name}")
+                else:
+                    progress.update(task_id, description=f"失败 {result.protein_name}")
+        except KeyboardInterrupt:
+            result_stream.close()
+            console.print(f"\n[yellow]批量处理被中断，已完成的结果记录在 {journal_file}，使用 --resume 继续[/yellow]")
+            raise
+    
+    # 清理批量重打分的临时目录；分片运行时其他分片可能正在使用同一目录，只在其为空时删除
+    chunk_root = results_path / ".p2rank_chunks"
+    if shard_count is not None:
+        remove_if_empty(chunk_root)
+    elif chunk_root.exists():
+        shutil.rmtree(chunk_root, ignore_errors=True)
     
-    # 保存结果
-    save_batch_results(results, output_csv)
+    console.print(f"✓ 批量处理结果已保存到: {summary_writer.output_path}")
     
     # 打印摘要
-    print_batch_summary(results)
+    print_batch_stats(stats)
     
     console.print(f"\n[bold green]批量处理完成![/bold green]")
     console.print(f"详细结果请查看: {output_csv}")
     console.print(f"每个蛋白质的详细结果保存在: {results_dir}/")
+    if trace_file:
+        console.print(f"各阶段耗时 trace: {trace_file}")
+    if pocket_writer is not None:
+        console.print(f"口袋表: {pocket_table}（{pocket_writer.rows_written} 个口袋）")
@@ -0,0 +1,192 @@
+"""
+端到端吞吐量测试 - 用模拟的 fpocket / prank 运行 run_batch_pipeline，比较不同并发度与输入规模
+
+报告每组参数的吞吐量（蛋白质/秒）、单个蛋白质处理时间的 p50/p95/p99，
+以及相对最小并发度的扩展效率（吞吐量之比 / 并发度之比）。
+"""
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from .simulate import SimulationProfile, install_simulated_tools, write_synthetic_structures
+
+console = Console()
+
+
+@dataclass
+class BenchResult:
+    """一组参数的测试结果"""
+    proteins: int
+    workers: int
+    wall_time: float
+    throughput: float  # 蛋白质/秒
+    p50: float
+    p95: float
+    p99: float
+    failed: int
+    efficiency: Optional[float] = None  # 相对同一规模下最小并发度的扩展效率
+
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值的分位数，q 取 0-100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+@contextmanager
+def _silenced_output() -> Iterator[None]:
+    """在文件描述符层面屏蔽 stdout/stderr（批处理的工作进程会继承），结束后恢复"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+
+@contextmanager
+def _prepend_path(directory: Path) -> Iterator[None]:
+    previous = os.environ.get("PATH", "")
+    os.environ["PATH"] = f"{directory}{os.pathsep}{previous}"
+    try:
+        yield
+    finally:
+        os.environ["PATH"] = previous
+
+
+def _read_summary(output_csv: Path) -> tuple[List[float], int]:
+    times, failed = [], 0
+    with open(output_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["status"] == "success":
+                times.append(float(row["processing_time"]))
+            else:
+                failed += 1
+    return times, failed
+
+
+def run_throughput_benchmark(
+    worker_counts: List[int],
+    input_sizes: List[int],
+    profile: SimulationProfile,
+    work_dir: Optional[str] = None,
+    scheduler: str = "pool",
+    p2rank_chunk_size: int = 1,
+    atoms: int = 2000,
+    batch_options: Optional[Dict] = None,
+) -> List[BenchResult]:
+    """对每个 (输入规模, 并发度) 组合运行一次批量处理
+
+    每次运行使用全新的结果目录且不启用结果缓存，模拟工具的输出与真实工具布局一致。
+    batch_options 中的其他参数原样传给 run_batch_pipeline。
+    """
+    from .batch import run_batch_pipeline
+    from .cache import tool_fingerprint
+
+    results: List[BenchResult] = []
+    if work_dir is not None:
+        Path(work_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="protein_pocket_bench_", dir=work_dir) as tmp:
+        root = Path(tmp)
+        bin_dir, prank_home = install_simulated_tools(root / "tools", profile)
+        # 模拟的 fpocket 改变了工具指纹，清除本进程中缓存的旧值
+        tool_fingerprint.cache_clear()
+
+        with _prepend_path(bin_dir):
+            for size in input_sizes:
+                input_dir = root / f"inputs_{size}"
+                write_synthetic_structures(input_dir, size, atoms=atoms)
+                baseline: Optional[BenchResult] = None
+                for workers in sorted(worker_counts):
+                    run_dir = root / f"run_{size}_{workers}"
+                    output_csv = run_dir / "summary.csv"
+                    console.print(f"[blue]运行 {size} 个蛋白质，{workers} 个并行进程...[/blue]")
+                    started = time.perf_counter()
+                    with _silenced_output():
+                        run_batch_pipeline(
+                            input_dir=str(input_dir),
+                            results_dir=str(run_dir / "results"),
+                            prank_home=str(prank_home),
+                            output_csv=str(output_csv),
+                            max_workers=workers,
+                            scheduler=scheduler,
+                            p2rank_chunk_size=p2rank_chunk_size,
+                            **(batch_options or {}),
+                        )
+                    wall_time = time.perf_counter() - started
+                    times, failed = _read_summary(output_csv)
+
+                    result = BenchResult(
+                        proteins=size,
+                        workers=workers,
+                        wall_time=wall_time,
+                        throughput=size / wall_time,
+                        p50=percentile(times, 50),
+                        p95=percentile(times, 95),
+                        p99=percentile(times, 99),
+                        failed=failed,
+                    )
+                    if baseline is None:
+                        baseline = result
+                        result.efficiency = 1.0
+                    else:
+                        result.efficiency = (result.throughput / baseline.throughput) / (workers / baseline.workers)
+                    results.append(result)
+    return results
+
+
+def print_bench_results(results: List[BenchResult]) -> None:
+    table = Table(title="批量处理吞吐量（模拟 fpocket / prank）")
+    table.add_column("蛋白质数", justify="right")
+    table.add_column("并行进程", justify="right")
+    table.add_column("总耗时 (s)", justify="right")
+    table.add_column("吞吐量 (个/s)", justify="right")
+    table.add_column("p50 (s)", justify="right")
+    table.add_column("p95 (s)", justify="right")
+    table.add_column("p99 (s)", justify="right")
+    table.add_column("扩展效率", justify="right")
+    table.add_column("失败", justify="right")
+    for r in results:
+        table.add_row(
+            str(r.proteins),
+            str(r.workers),
+            f"{r.wall_time:.2f}",
+            f"{r.throughput:.2f}",
+            f"{r.p50:.2f}",
+            f"{r.p95:.2f}",
+            f"{r.p99:.2f}",
+            f"{r.efficiency:.0%}" if r.efficiency is not None else "-",
+            str(r.failed),
+        )
+    console.print(table)
+
+
+def save_bench_results(results: List[BenchResult], profile: SimulationProfile, output_json: str) -> None:
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump({"profile": asdict(profile), "results": [asdict(r) for r in results]}, f, indent=2)
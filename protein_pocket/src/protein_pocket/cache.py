@@ -0,0 +1,181 @@
+"""
+结果缓存模块 - 按结构内容寻址缓存 fpocket / P2Rank 的解析结果
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import asdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .fpocket import open_structure
+from .installer import P2RANK_VERSION
+
+# 缓存内容的格式版本，Pocket 字段或解析逻辑变化时需要递增
+CACHE_SCHEMA_VERSION = 2
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(size: str) -> int:
+    """解析 "500M"、"10G" 这样的大小字符串为字节数"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size.upper())
+    if not match:
+        raise ValueError(f"无法解析的大小: {size}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def format_size(num_bytes: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def file_digest(path: Path) -> str:
+    """流式计算文件内容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=1)
+def tool_fingerprint() -> str:
+    """fpocket 可执行文件内容与 P2Rank 版本的指纹（每个进程只计算一次）"""
+    fpocket_bin = shutil.which("fpocket")
+    fpocket_id = file_digest(Path(fpocket_bin).resolve()) if fpocket_bin else "missing"
+    return f"fpocket:{fpocket_id};p2rank:{P2RANK_VERSION}"
+
+
+def structure_digest(pdb_path: Path) -> str:
+    """结构内容的 SHA-256；gzip 压缩文件按解压后的内容计算，与是否压缩无关"""
+    h = hashlib.sha256()
+    with open_structure(pdb_path) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(pdb_path: Path, params: Optional[Dict[str, Any]] = None) -> str:
+    """由结构内容、工具版本和 pipeline 参数计算缓存键，与文件名、所在目录和是否压缩无关"""
+    h = hashlib.sha256()
+    h.update(structure_digest(pdb_path).encode())
+    h.update(tool_fingerprint().encode())
+    h.update(json.dumps({"schema": CACHE_SCHEMA_VERSION, **(params or {})}, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """本地磁盘上的内容寻址缓存，按最近使用时间（mtime）进行 LRU 淘汰
+
+    每个条目是一个 JSON 文件，写入时先写临时文件再原子重命名，
+    因此可以放在多个进程或节点共享的 scratch 卷上。
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._approx_bytes: Optional[int] = None
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _entries(self) -> List[Tuple[Path, os.stat_result]]:
+        entries = []
+        if not self.root.exists():
+            return entries
+        for path in self.root.glob("*/*.json"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                # 其他进程可能刚刚淘汰了该条目
+                continue
+        return entries
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            # 更新 mtime 作为最近使用时间
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return payload
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+        if self._approx_bytes is None:
+            self._approx_bytes = sum(st.st_size for _, st in self._entries())
+        else:
+            self._approx_bytes += path.stat().st_size
+        if self._approx_bytes > self.max_bytes:
+            self.prune()
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        total = sum(st.st_size for _, st in entries)
+        mtimes = [st.st_mtime for _, st in entries]
+        return {
+            "root": str(self.root),
+            "entries": len(entries),
+            "total_bytes": total,
+            "max_bytes": self.max_bytes,
+            "oldest_access": min(mtimes) if mtimes else None,
+            "newest_access": max(mtimes) if mtimes else None,
+        }
+
+    def prune(self, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        """淘汰最久未使用的条目，直到总大小不超过上限的 90%
+
+        Returns:
+            (删除的条目数, 释放的字节数)
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        target = int(limit * 0.9) if total > limit else total
+        removed = freed = 0
+        for path, st in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            removed += 1
+            freed += st.st_size
+        self._approx_bytes = total
+        return removed, freed
+
+
+def pockets_to_records(pockets: list) -> List[Dict[str, Any]]:
+    return [asdict(p) for p in pockets]
+
+
+def format_timestamp(timestamp: Optional[float]) -> str:
+    if timestamp is None:
+        return "-"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
@@ -1,10 +1,22 @@
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional
 
 import typer
-from rich.console import Console
 
 app = typer.Typer(add_completion=False, help="Protein pocket detection pipeline CLI")
-console = Console()
+cache_app = typer.Typer(add_completion=False, help="Manage the on-disk result cache")
+app.add_typer(cache_app, name="cache")
+
+# run/batch/serve 和 cache 子命令的 --cache-dir 都可以由这个环境变量提供，保证指向同一个目录
+CACHE_DIR_ENV = "PROTEIN_POCKET_CACHE_DIR"
+
+
+@lru_cache(maxsize=1)
+def _console():
+    # rich 只在需要输出时导入，`version` 等命令不承担它的导入开销
+    from rich.console import Console
+
+    return Console()
 
 
 @app.callback()
@@ -22,16 +34,23 @@ def version() -> None:
         v = version("protein-pocket")
     except PackageNotFoundError:
         v = "0.1.0"
-    console.print(f"protein-pocket {v}")
+    typer.echo(f"protein-pocket {v}")
 
 
 @app.command()
 def run(
-    pdb_path: str = typer.Argument(..., help="Path to input PDB file"),
+    pdb_path: str = typer.Argument(..., help="Path to input PDB/CIF file (.pdb.gz / .cif.gz are decompressed on the fly)"),
     workdir: str = typer.Option("runs", help="Working directory for intermediate outputs"),
     topk: int = typer.Option(5, help="Number of top pockets to keep after rescoring"),
     prank_home: Optional[str] = typer.Option(None, help="P2Rank home directory (optional, will auto-install if not found)"),
     enable_cliff_analysis: bool = typer.Option(True, help="Enable cliff analysis for high-confidence pocket identification"),
+    cache_dir: Optional[str] = typer.Option(
+        None, envvar=CACHE_DIR_ENV, help="Result cache directory; structures seen before skip fpocket and P2Rank"
+    ),
+    cache_max_size: str = typer.Option("2G", help="Size limit of the result cache (e.g. 500M, 10G)"),
+    scratch_dir: Optional[str] = typer.Option(None, help="Directory for per-job fpocket scratch space, ideally local disk or tmpfs (default: system temp dir)"),
+    keep: str = typer.Option("all", help="Intermediate outputs to keep in workdir: 'none'/'summary' (delete fpocket and P2Rank outputs), 'essential' (only files needed to re-parse / rescore) or 'all'"),
+    p2rank_heap: Optional[str] = typer.Option(None, help="Maximum JVM heap for P2Rank (e.g. 2G); default: P2Rank's own setting"),
 ) -> None:
     """Run the full pipeline: fpocket -> refine/filter -> P2Rank rescoring -> cliff analysis -> rank.
     
@@ -39,6 +58,7 @@ def run(
     Cliff analysis identifies high-confidence pockets using the 'cliff' algorithm.
     """
     from .pipeline import run_pipeline
+    from .cache import parse_size
 
     run_pipeline(
         pdb_path=pdb_path,
@@ -46,6 +66,11 @@ def run(
         topk=topk,
         prank_home=prank_home,
         enable_cliff_analysis=enable_cliff_analysis,
+        cache_dir=cache_dir,
+        cache_max_bytes=parse_size(cache_max_size),
+        scratch_dir=scratch_dir,
+        keep=keep,
+        p2rank_heap_mb=parse_size(p2rank_heap) // 1024 ** 2 if p2rank_heap else None,
     )
 
 
@@ -56,9 +81,38 @@ def batch(
     topk: int = typer.Option(5, help="Number of top pockets to keep after rescoring"),
     prank_home: Optional[str] = typer.Option(None, help="P2Rank home directory (optional, will auto-install if not found)"),
     output_csv: str = typer.Option("batch_results.csv", help="Output CSV file for batch results"),
-    file_extensions: str = typer.Option("pdb,cif", help="Comma-separated file extensions to process"),
+    file_extensions: str = typer.Option("pdb,cif", help="Comma-separated file extensions to process (gzip-compressed variants such as .pdb.gz are matched too)"),
     max_workers: Optional[int] = typer.Option(None, help="Maximum number of parallel workers (default: min(CPU cores, 8))"),
     enable_cliff_analysis: bool = typer.Option(True, help="Enable cliff analysis for high-confidence pocket identification"),
+    p2rank_chunk_size: int = typer.Option(1, help="Number of proteins rescored by a single P2Rank launch (1 = one launch per protein)"),
+    p2rank_threads: Optional[int] = typer.Option(None, help="Threads for each P2Rank launch (passed as -threads)"),
+    cache_dir: Optional[str] = typer.Option(
+        None, envvar=CACHE_DIR_ENV, help="Result cache directory; structures seen before skip fpocket and P2Rank"
+    ),
+    cache_max_size: str = typer.Option("2G", help="Size limit of the result cache (e.g. 500M, 10G)"),
+    resume: bool = typer.Option(False, help="Resume from the progress journal, skipping proteins that already succeeded"),
+    retry_failed: bool = typer.Option(False, help="With --resume, re-queue proteins that failed in the previous run"),
+    journal: Optional[str] = typer.Option(None, help="Progress journal path (default: <results-dir>/batch_journal.jsonl)"),
+    scheduler: str = typer.Option("pool", help="Scheduling mode: 'pool' (one process per protein), 'staged' (pipelined fpocket / parse / P2Rank stages) or 'async' (one asyncio event loop drives all tool subprocesses)"),
+    fpocket_workers: Optional[int] = typer.Option(None, help="Concurrent fpocket runs in staged / async mode (default: max-workers)"),
+    parse_workers: Optional[int] = typer.Option(None, help="Parse/deduplicate processes in staged mode (default: max-workers / 4)"),
+    p2rank_workers: Optional[int] = typer.Option(None, help="Concurrent P2Rank launches in staged / async mode (default: max-workers / 2)"),
+    stage_queue_size: int = typer.Option(16, help="Capacity of the queues between stages in staged mode"),
+    scratch_dir: Optional[str] = typer.Option(None, help="Directory for per-job fpocket scratch space, ideally local disk or tmpfs (default: system temp dir)"),
+    keep: str = typer.Option("all", help="Per-protein artifacts to keep: 'none', 'summary' (detailed CSV only), 'essential' (plus files needed to re-parse / rescore) or 'all'"),
+    trace_file: Optional[str] = typer.Option(None, help="Write per-stage timing spans as a Chrome trace JSON (open in chrome://tracing or Perfetto)"),
+    p2rank_heap: Optional[str] = typer.Option(None, help="Maximum JVM heap for each P2Rank launch (e.g. 2G); default: P2Rank's own setting"),
+    memory_budget: Optional[str] = typer.Option(None, help="Total memory for concurrent proteins (e.g. 48G); a protein starts only when its estimated peak, from atom count and P2Rank heap, fits"),
+    cpu_budget: Optional[int] = typer.Option(None, help="Total cores shared by all workers; P2Rank -threads and JVM GC threads are sized to cpu-budget / workers"),
+    pin_cpus: bool = typer.Option(False, help="Pin each worker to its own set of cores, following the CPU topology (Linux only)"),
+    order: str = typer.Option("path", help="Submission order: 'path' or 'largest-first' (count atoms first and start the biggest structures first; progress ETA is then atom-weighted)"),
+    fpocket_timeout: Optional[float] = typer.Option(None, help="Kill fpocket (and its process group) after this many seconds per protein"),
+    p2rank_timeout: Optional[float] = typer.Option(None, help="Kill P2Rank and its JVM after this many seconds per protein (multiplied by the chunk size for chunked launches)"),
+    retries: int = typer.Option(2, help="Retries for transient failures such as JVM crashes or processes killed by a signal"),
+    retry_backoff: float = typer.Option(5.0, help="Seconds to wait before the first retry; doubled for each further retry"),
+    shard: Optional[str] = typer.Option(None, help="Process only shard I of N (e.g. 3/16, 0-based); files are assigned by a stable hash of their path relative to INPUT_DIR, and the summary CSV, journal and trace get a .shard-I-of-N suffix"),
+    pocket_table: Optional[str] = typer.Option(None, help="Also write every rescored pocket, not just the top-k (one row per pocket, with fpocket descriptors) to a Parquet (.parquet) or Arrow IPC (.arrow) file; requires pyarrow"),
+    pocket_table_row_group: int = typer.Option(131072, help="Pockets per row group in --pocket-table"),
 ) -> None:
     """Batch process multiple protein structure files in a directory.
     
@@ -67,6 +121,7 @@ def batch(
     Includes cliff analysis results in the output CSV for high-confidence pocket identification.
     """
     from .batch import run_batch_pipeline
+    from .cache import parse_size
 
     run_batch_pipeline(
         input_dir=input_dir,
@@ -76,6 +131,220 @@ def batch(
         output_csv=output_csv,
         file_extensions=file_extensions,
         max_workers=max_workers,
+        enable_cliff_analysis=enable_cliff_analysis,
+        p2rank_chunk_size=p2rank_chunk_size,
+        p2rank_threads=p2rank_threads,
+        cache_dir=cache_dir,
+        cache_max_bytes=parse_size(cache_max_size),
+        resume=resume,
+        retry_failed=retry_failed,
+        journal_path=journal,
+        scheduler=scheduler,
+        fpocket_workers=fpocket_workers,
+        parse_workers=parse_workers,
+        p2rank_workers=p2rank_workers,
+        stage_queue_size=stage_queue_size,
+        scratch_dir=scratch_dir,
+        keep=keep,
+        trace_file=trace_file,
+        p2rank_heap_mb=parse_size(p2rank_heap) // 1024 ** 2 if p2rank_heap else None,
+        memory_budget=parse_size(memory_budget) if memory_budget else None,
+        cpu_budget=cpu_budget,
+        pin_cpus=pin_cpus,
+        order=order,
+        fpocket_timeout=fpocket_timeout,
+        p2rank_timeout=p2rank_timeout,
+        max_retries=retries,
+        retry_backoff=retry_backoff,
+        shard=shard,
+        pocket_table=pocket_table,
+        pocket_table_row_group=pocket_table_row_group,
+    )
+
+
+@app.command()
+def bench(
+    workers: str = typer.Option("1,2,4", help="Comma-separated worker counts to compare"),
+    sizes: str = typer.Option("20", help="Comma-separated numbers of simulated proteins"),
+    scheduler: str = typer.Option("pool", help="Scheduling mode passed to batch: 'pool', 'staged' or 'async'"),
+    p2rank_chunk_size: int = typer.Option(1, help="Proteins per P2Rank launch, as in batch"),
+    pockets: int = typer.Option(20, help="Pockets written by the simulated fpocket per protein"),
+    fpocket_latency: float = typer.Option(0.05, help="Simulated fpocket wait time per protein (seconds)"),
+    fpocket_cpu: float = typer.Option(0.2, help="Simulated fpocket CPU time per protein (seconds)"),
+    fpocket_memory: int = typer.Option(50, help="Simulated fpocket memory (MiB)"),
+    prank_startup: float = typer.Option(1.0, help="Simulated P2Rank startup cost per launch (seconds)"),
+    prank_latency: float = typer.Option(0.05, help="Simulated P2Rank wait time per protein (seconds)"),
+    prank_cpu: float = typer.Option(0.2, help="Simulated P2Rank CPU time per protein (seconds)"),
+    prank_memory: int = typer.Option(500, help="Simulated P2Rank heap (MiB)"),
+    work_dir: Optional[str] = typer.Option(None, help="Directory for temporary inputs and results (default: system temp dir)"),
+    output_json: Optional[str] = typer.Option(None, help="Also write the results as JSON"),
+) -> None:
+    """Measure batch throughput with simulated fpocket and prank executables.
+
+    Runs run_batch_pipeline for every (size, workers) combination and reports
+    throughput, per-protein p50/p95/p99 latency and scaling efficiency.
+    """
+    from .bench import print_bench_results, run_throughput_benchmark, save_bench_results
+    from .simulate import SimulationProfile
+
+    profile = SimulationProfile(
+        fpocket_latency=fpocket_latency,
+        fpocket_cpu=fpocket_cpu,
+        fpocket_memory_mb=fpocket_memory,
+        pockets=pockets,
+        prank_startup=prank_startup,
+        prank_latency=prank_latency,
+        prank_cpu=prank_cpu,
+        prank_memory_mb=prank_memory,
+    )
+    results = run_throughput_benchmark(
+        worker_counts=[int(w) for w in workers.split(",")],
+        input_sizes=[int(s) for s in sizes.split(",")],
+        profile=profile,
+        work_dir=work_dir,
+        scheduler=scheduler,
+        p2rank_chunk_size=p2rank_chunk_size,
+    )
+    print_bench_results(results)
+    if output_json:
+        save_bench_results(results, profile, output_json)
+        _console().print(f"结果已保存到: {output_json}")
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", help="Address to listen on"),
+    port: int = typer.Option(8765, help="Port to listen on (0 picks a free port)"),
+    workers: int = typer.Option(4, help="Jobs processed concurrently (concurrent fpocket runs)"),
+    p2rank_workers: Optional[int] = typer.Option(None, help="Concurrent P2Rank launches (default: workers / 2)"),
+    queue_size: int = typer.Option(64, help="Queued jobs accepted before new submissions get HTTP 429"),
+    work_dir: Optional[str] = typer.Option(None, help="Directory for uploads and per-job files (default: a temporary directory)"),
+    prank_home: Optional[str] = typer.Option(None, help="P2Rank home directory (optional, will auto-install if not found)"),
+    topk: int = typer.Option(5, help="Number of top pockets to keep after rescoring"),
+    cache_dir: Optional[str] = typer.Option(
+        None, envvar=CACHE_DIR_ENV, help="Result cache directory; structures seen before skip fpocket and P2Rank"
+    ),
+    cache_max_size: str = typer.Option("2G", help="Size limit of the result cache (e.g. 500M, 10G)"),
+    p2rank_threads: Optional[int] = typer.Option(None, help="Threads for each P2Rank launch (passed as -threads)"),
+    p2rank_heap: Optional[str] = typer.Option(None, help="Maximum JVM heap for each P2Rank launch (e.g. 2G); default: P2Rank's own setting"),
+    fpocket_timeout: Optional[float] = typer.Option(None, help="Kill fpocket after this many seconds per job"),
+    p2rank_timeout: Optional[float] = typer.Option(None, help="Kill P2Rank and its JVM after this many seconds per job"),
+    retries: int = typer.Option(2, help="Retries for transient failures such as JVM crashes or processes killed by a signal"),
+    retry_backoff: float = typer.Option(5.0, help="Seconds to wait before the first retry; doubled for each further retry"),
+) -> None:
+    """Run a local HTTP job API backed by a warm pipeline.
+
+    POST /jobs with {"path": ...} or an application/octet-stream upload
+    (?name=<file>), then poll GET /jobs/<id> and GET /jobs/<id>/result.
+    Identical structures submitted while a job is pending share that job.
+    """
+    from .cache import parse_size
+    from .pipeline import PipelineConfig
+    from .proc import RetryPolicy
+    from .server import serve as run_server
+
+    config = PipelineConfig(
+        topk=topk,
+        prank_home=prank_home,
+        p2rank_threads=p2rank_threads,
+        p2rank_heap_mb=parse_size(p2rank_heap) // 1024 ** 2 if p2rank_heap else None,
+        cache_dir=cache_dir,
+        cache_max_bytes=parse_size(cache_max_size),
+        keep="none",
+        fpocket_timeout=fpocket_timeout,
+        p2rank_timeout=p2rank_timeout,
+        retry=RetryPolicy(max_retries=retries, backoff=retry_backoff),
     )
+    run_server(
+        config, host=host, port=port, workers=workers, p2rank_workers=p2rank_workers,
+        queue_size=queue_size, work_dir=work_dir,
+    )
+
+
+@app.command()
+def merge(
+    inputs: List[str] = typer.Argument(..., help="Batch summary CSVs to merge, or directories containing them"),
+    output_csv: str = typer.Option("merged_results.csv", help="Merged summary CSV (one row per protein, sorted by path)"),
+    stats_json: Optional[str] = typer.Option(None, help="Also write the cliff-analysis summary stats to this JSON file"),
+    run_rows: int = typer.Option(50000, help="Rows sorted in memory at a time; bounds memory use regardless of input size"),
+    detailed_csv: Optional[str] = typer.Option(
+        None, help="Also concatenate the kept rows' per-protein *_pocket_results.csv files (detailed_csv column) into this CSV"
+    ),
+) -> None:
+    """Stream-merge summary CSVs from sharded or repeated batch runs.
+
+    Proteins that appear more than once (by protein_path) keep their newest
+    successful row, or the newest row if none succeeded. Newer means a later
+    input file by modification time, or a later row in the same file.
+    """
+    from .merge import merge_summaries, print_merge_report
+
+    try:
+        report = merge_summaries(inputs, output_csv, run_rows=run_rows, detailed_output=detailed_csv)
+    except (FileNotFoundError, ValueError) as e:
+        _console().print(f"[red]错误: {e}[/red]")
+        raise typer.Exit(code=1)
+    print_merge_report(report)
+    if stats_json:
+        import json
+        from pathlib import Path
+
+        Path(stats_json).write_text(json.dumps(report.cliff.summary(), indent=2, ensure_ascii=False) + "\n")
+        _console().print(f"断崖分析统计已保存到: {stats_json}")
+
+
+@app.command("install-p2rank")
+def install_p2rank_command(
+    install_dir: Optional[str] = typer.Option(None, help="Installation directory (default: ~/.cache/protein_pocket/tools)"),
+    url: Optional[str] = typer.Option(None, help="Download URL of the P2Rank tarball, e.g. a mirror (env: PROTEIN_POCKET_P2RANK_URL)"),
+    tarball: Optional[str] = typer.Option(None, help="Install from a local tarball without downloading (env: PROTEIN_POCKET_P2RANK_TARBALL)"),
+    sha256: Optional[str] = typer.Option(None, help="Expected SHA-256 of the tarball (env: PROTEIN_POCKET_P2RANK_SHA256)"),
+) -> None:
+    """Download and install P2Rank into the per-user tool directory.
+
+    Interrupted downloads resume where they stopped; concurrent installs wait
+    for each other and share one installation.
+    """
+    from .installer import install_p2rank
+
+    try:
+        p2rank_dir = install_p2rank(install_dir=install_dir, url=url, tarball=tarball, sha256=sha256)
+    except Exception:
+        # 错误信息已由 install_p2rank 打印
+        raise typer.Exit(code=1)
+    _console().print(f"可通过 --prank-home {p2rank_dir} 或 P2RANK_HOME 环境变量指定该安装")
+
+
+@cache_app.command("stats")
+def cache_stats(
+    cache_dir: str = typer.Option(..., envvar=CACHE_DIR_ENV, help="Result cache directory, as passed to run/batch/serve"),
+) -> None:
+    """Show entry count and disk usage of the result cache."""
+    from rich.table import Table
+    from .cache import ResultCache, format_size, format_timestamp
+
+    stats = ResultCache(cache_dir).stats()
+    table = Table(title="结果缓存")
+    table.add_column("统计项", style="cyan")
+    table.add_column("数值", style="magenta")
+    table.add_row("缓存目录", stats["root"])
+    table.add_row("条目数", str(stats["entries"]))
+    table.add_row("占用空间", format_size(stats["total_bytes"]))
+    table.add_row("最早使用", format_timestamp(stats["oldest_access"]))
+    table.add_row("最近使用", format_timestamp(stats["newest_access"]))
+    _console().print(table)
+
+
+@cache_app.command("prune")
+def cache_prune(
+    cache_dir: str = typer.Option(..., envvar=CACHE_DIR_ENV, help="Result cache directory, as passed to run/batch/serve"),
+    max_size: str = typer.Option("2G", help="Evict least recently used entries until the cache fits this size (0 clears it)"),
+) -> None:
+    """Evict least recently used cache entries."""
+    from .cache import ResultCache, format_size, parse_size
+
+    cache = ResultCache(cache_dir, max_bytes=parse_size(max_size))
+    removed, freed = cache.prune()
+    _console().print(f"已删除 {removed} 个缓存条目，释放 {format_size(freed)}")
 
 
@@ -119,6 +119,43 @@ def format_cliff_analysis_result(result: CliffAnalysisResult) -> str:
     return "\n".join(output)
 
 
+class CliffSummaryAccumulator:
+    """断崖分析统计摘要的增量累加器
+
+    逐个 add 结果，内存占用与蛋白质数量无关；summary() 的返回值与 get_cliff_summary_stats 相同。
+    add 只读取 is_top1_dominant、high_confidence_count 和 max_delta 三个属性，
+    CliffAnalysisResult 和 batch.BatchResult 都可以直接传入。
+    """
+
+    def __init__(self):
+        self.total_proteins = 0
+        self.top1_dominant_count = 0
+        self.sum_high_confidence_count = 0
+        self.sum_max_delta = 0.0
+        self.high_confidence_distribution = {}
+
+    def add(self, result) -> None:
+        self.total_proteins += 1
+        self.top1_dominant_count += int(bool(result.is_top1_dominant))
+        self.sum_high_confidence_count += result.high_confidence_count
+        self.sum_max_delta += result.max_delta
+        count = result.high_confidence_count
+        self.high_confidence_distribution[count] = self.high_confidence_distribution.get(count, 0) + 1
+
+    def summary(self) -> dict:
+        total_proteins = self.total_proteins
+        if not total_proteins:
+            return {}
+        return {
+            "total_proteins": total_proteins,
+            "top1_dominant_count": self.top1_dominant_count,
+            "top1_dominant_percentage": (self.top1_dominant_count / total_proteins) * 100,
+            "avg_high_confidence_count": self.sum_high_confidence_count / total_proteins,
+            "avg_max_delta": self.sum_max_delta / total_proteins,
+            "high_confidence_distribution": dict(sorted(self.high_confidence_distribution.items())),
+        }
+
+
 def get_cliff_summary_stats(results: List[CliffAnalysisResult]) -> dict:
     """
     获取多个断崖分析结果的统计摘要
@@ -129,24 +166,7 @@ def get_cliff_summary_stats(results: List[CliffAnalysisResult]) -> dict:
     Returns:
         dict: 统计摘要
     """
-    if not results:
-        return {}
-    
-    total_proteins = len(results)
-    top1_dominant_count = sum(1 for r in results if r.is_top1_dominant)
-    avg_high_confidence_count = sum(r.high_confidence_count for r in results) / total_proteins
-    avg_max_delta = sum(r.max_delta for r in results) / total_proteins
-    
-    high_confidence_distribution = {}
+    accumulator = CliffSummaryAccumulator()
     for result in results:
-        count = result.high_confidence_count
-        high_confidence_distribution[count] = high_confidence_distribution.get(count, 0) + 1
-    
-    return {
-        "total_proteins": total_proteins,
-        "top1_dominant_count": top1_dominant_count,
-        "top1_dominant_percentage": (top1_dominant_count / total_proteins) * 100,
-        "avg_high_confidence_count": avg_high_confidence_count,
-        "avg_max_delta": avg_max_delta,
-        "high_confidence_distribution": high_confidence_distribution
-    }
+        accumulator.add(result)
+    return accumulator.summary()
@@ -0,0 +1,164 @@
+"""
+列式口袋表导出 - 把整个批处理报告的口袋写成一张 Parquet 或 Arrow IPC 表，每个口袋一行
+
+需要可选依赖 pyarrow（pip install "protein-pocket[parquet]"）。结果到达时先缓冲在内存中，
+每满 row_group_size 行写出一个 row group（Arrow IPC 为一个 record batch），内存占用与批处理规模无关；
+分析时只需扫描一个文件，而不必打开每个蛋白质的详细 CSV。
+
+每行包含蛋白质标识（与进度日志相同的相对路径）、最终排名、P2Rank 分数、fpocket 原始分数与排名、
+口袋中心、断崖分析的高置信度标记，以及 POCKET_DESCRIPTORS 中的 fpocket 描述符（缺失时为 null）。
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+DEFAULT_ROW_GROUP_SIZE = 128 * 1024
+
+# fpocket 4 的 *_info.txt 描述符（fpocket.descriptor_key 规范化后的名称）；"score" 即 raw_score，不重复写出
+POCKET_DESCRIPTORS = (
+    "druggability_score",
+    "number_of_alpha_spheres",
+    "total_sasa",
+    "polar_sasa",
+    "apolar_sasa",
+    "volume",
+    "mean_local_hydrophobic_density",
+    "mean_alpha_sphere_radius",
+    "mean_alp_sph_solvent_access",
+    "apolar_alpha_sphere_proportion",
+    "hydrophobicity_score",
+    "volume_score",
+    "polarity_score",
+    "charge_score",
+    "proportion_of_polar_atoms",
+    "alpha_sphere_density",
+    "cent_of_mass_alpha_sphere_max_dist",
+    "flexibility",
+)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("写出列式口袋表需要 pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def table_format(path: str | Path) -> str:
+    """按扩展名确定输出格式："parquet" 或 "arrow" """
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        return "parquet"
+    if suffix in ARROW_SUFFIXES:
+        return "arrow"
+    raise ValueError(
+        f"无法从扩展名确定口袋表格式: {path}（Parquet: {'/'.join(PARQUET_SUFFIXES)}，Arrow IPC: {'/'.join(ARROW_SUFFIXES)}）"
+    )
+
+
+def pocket_table_schema():
+    pa = require_pyarrow()
+    return pa.schema(
+        [
+            ("protein_key", pa.string()),
+            ("protein_name", pa.string()),
+            ("protein_path", pa.string()),
+            ("rank", pa.int32()),
+            ("score", pa.float64()),
+            ("raw_score", pa.float64()),
+            ("fpocket_rank", pa.int32()),
+            ("center_x", pa.float64()),
+            ("center_y", pa.float64()),
+            ("center_z", pa.float64()),
+            ("is_high_confidence", pa.bool_()),
+        ]
+        + [(name, pa.float64()) for name in POCKET_DESCRIPTORS]
+    )
+
+
+class PocketTableWriter:
+    """流式写入口袋表：write() 追加一个蛋白质的口袋，每满 row_group_size 行写出一个 row group
+
+    除最后一个外，每个 row group 恰好 row_group_size 行（一个蛋白质的口袋可能跨两个 row group）。
+    只写成功的蛋白质；close() 写出剩余的行并写入文件尾（Parquet 在 close 之前不可读）。
+    """
+
+    def __init__(self, path: str | Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        if row_group_size < 1:
+            raise ValueError("row_group_size 必须大于等于 1")
+        pa = require_pyarrow()
+        self.path = Path(path)
+        self.format = table_format(self.path)
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self.schema = pocket_table_schema()
+        self._columns: Dict[str, List[Any]] = {name: [] for name in self.schema.names}
+        self._buffered = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(self.path, self.schema)
+
+    def write(self, key: str, result) -> None:
+        """result 为 batch.BatchResult，写出 rescored_pockets 中的全部口袋（字典见 batch.pocket_records）
+
+        没有记录全部口袋的结果（如旧版进度日志中的记录）退回到 top_pockets。
+        """
+        if result.status != "success":
+            return
+        columns = self._columns
+        for pocket in result.rescored_pockets or result.top_pockets:
+            descriptors = pocket.get("descriptors") or {}
+            columns["protein_key"].append(key)
+            columns["protein_name"].append(result.protein_name)
+            columns["protein_path"].append(result.protein_path)
+            columns["rank"].append(pocket["rank"])
+            columns["score"].append(pocket["score"])
+            columns["raw_score"].append(pocket.get("raw_score"))
+            columns["fpocket_rank"].append(pocket.get("fpocket_rank"))
+            columns["center_x"].append(pocket["center_x"])
+            columns["center_y"].append(pocket["center_y"])
+            columns["center_z"].append(pocket["center_z"])
+            columns["is_high_confidence"].append(pocket.get("is_high_confidence"))
+            for name in POCKET_DESCRIPTORS:
+                columns[name].append(descriptors.get(name))
+            self._buffered += 1
+        while self._buffered >= self.row_group_size:
+            self._write_rows(self.row_group_size)
+
+    def flush(self) -> None:
+        """把缓冲中的所有行写出为一个 row group（可能不满 row_group_size 行）"""
+        if self._buffered:
+            self._write_rows(self._buffered)
+
+    def _write_rows(self, count: int) -> None:
+        """把缓冲区最前面的 count 行写出为恰好一个 row group，其余行继续留在缓冲区"""
+        pa = require_pyarrow()
+        table = pa.Table.from_pydict({name: values[:count] for name, values in self._columns.items()}, schema=self.schema)
+        if self.format == "parquet":
+            self._writer.write_table(table, row_group_size=count)
+        else:
+            self._writer.write_table(table, max_chunksize=count)
+        self.rows_written += count
+        self._buffered -= count
+        for values in self._columns.values():
+            del values[:count]
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "PocketTableWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
-from typing import List, Set
+import itertools
+import math
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from .fpocket import Pocket
 
+DEFAULT_CENTER_DISTANCE_THRESHOLD = 5.0
+DEFAULT_RESIDUE_JACCARD_THRESHOLD = 0.75
+
 
 def jaccard_residue_overlap(a: Set[str], b: Set[str]) -> float:
     if not a and not b:
@@ -13,26 +19,95 @@ def jaccard_residue_overlap(a: Set[str], b: Set[str]) -> float:
     return inter / union if union > 0 else 0.0
 
 
+def _distance_neighbors(pockets: List[Pocket], threshold: float) -> Iterator[Tuple[int, int]]:
+    """用网格哈希找出中心距离不超过阈值的口袋对 (i < j)
+
+    网格边长等于阈值，距离不超过阈值的两个中心必然落在相邻（含自身）的 27 个网格中。
+    """
+    if threshold < 0:
+        return
+    centers = [(p.center_x, p.center_y, p.center_z) for p in pockets]
+    if threshold == 0:
+        # 只有中心完全重合的口袋才算重叠
+        cell_of = lambda c: c  # noqa: E731
+        offsets = [(0, 0, 0)]
+    else:
+        cell_of = lambda c: (math.floor(c[0] / threshold), math.floor(c[1] / threshold), math.floor(c[2] / threshold))  # noqa: E731
+        offsets = list(itertools.product((-1, 0, 1), repeat=3))
+
+    grid: Dict[tuple, List[int]] = defaultdict(list)
+    for i, c in enumerate(centers):
+        grid[cell_of(c)].append(i)
+
+    for cell, members in grid.items():
+        for offset in offsets:
+            other = members if offset == (0, 0, 0) else grid.get(
+                (cell[0] + offset[0], cell[1] + offset[1], cell[2] + offset[2])
+            )
+            if not other:
+                continue
+            for i in members:
+                xi, yi, zi = centers[i]
+                for j in other:
+                    if j <= i:
+                        continue
+                    dx = xi - centers[j][0]
+                    dy = yi - centers[j][1]
+                    dz = zi - centers[j][2]
+                    # 与逐对比较时完全相同的表达式，保证边界情况下结果一致
+                    if (dx * dx + dy * dy + dz * dz) ** 0.5 <= threshold:
+                        yield i, j
+
+
+def _residue_neighbors(pockets: List[Pocket], threshold: float) -> Iterator[Tuple[int, int]]:
+    """用残基倒排索引找出残基 Jaccard 不低于阈值的口袋对 (i < j)
+
+    阈值大于 0 时，满足条件的两个口袋至少共享一个残基，因此只需比较倒排索引中共现的口袋；
+    共享残基数直接由倒排表累加得到，相当于稀疏位图的按位与计数。
+    """
+    residue_index: Dict[str, int] = {}
+    residue_ids: List[List[int]] = []
+    postings: Dict[int, List[int]] = defaultdict(list)
+    for i, p in enumerate(pockets):
+        ids = [residue_index.setdefault(residue, len(residue_index)) for residue in set(p.residues)]
+        for rid in ids:
+            postings[rid].append(i)
+        residue_ids.append(ids)
+
+    for i, ids in enumerate(residue_ids):
+        # 倒排表按口袋编号递增，只统计编号大于 i 的口袋
+        shared = Counter(j for rid in ids for j in postings[rid] if j > i)
+        for j, inter in shared.items():
+            if inter / (len(ids) + len(residue_ids[j]) - inter) >= threshold:
+                yield i, j
+
+
 def group_overlapping_pockets(
     pockets: List[Pocket],
-    center_distance_threshold: float = 5.0,
-    residue_jaccard_threshold: float = 0.75,
+    center_distance_threshold: float = DEFAULT_CENTER_DISTANCE_THRESHOLD,
+    residue_jaccard_threshold: float = DEFAULT_RESIDUE_JACCARD_THRESHOLD,
 ) -> list[list[int]]:
+    """把中心距离或残基 Jaccard 重叠的口袋划分为连通分组
+
+    候选对由网格哈希和残基倒排索引给出，避免 O(n²) 的逐对比较；分组及组内顺序与逐对比较的
+    深度优先搜索完全一致（组内第一个成员之后的顺序会影响去重时同分口袋的取舍）。
+    """
+    n = len(pockets)
+    if residue_jaccard_threshold <= 0:
+        # 两个残基集合的 Jaccard 总是 >= 0，所有口袋两两重叠，构成一个组
+        return [[0] + list(range(n - 1, 0, -1))] if n else []
+
+    neighbors: list[list[int]] = [[] for _ in range(n)]
+    for i, j in itertools.chain(
+        _distance_neighbors(pockets, center_distance_threshold),
+        _residue_neighbors(pockets, residue_jaccard_threshold),
+    ):
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+
     groups: list[list[int]] = []
-    visited = [False] * len(pockets)
-
-    def is_overlapped(i: int, j: int) -> bool:
-        pi, pj = pockets[i], pockets[j]
-        dx = pi.center_x - pj.center_x
-        dy = pi.center_y - pj.center_y
-        dz = pi.center_z - pj.center_z
-        dist = (dx * dx + dy * dy + dz * dz) ** 0.5
-        if dist <= center_distance_threshold:
-            return True
-        ja = jaccard_residue_overlap(set(pi.residues), set(pj.residues))
-        return ja >= residue_jaccard_threshold
-
-    for i in range(len(pockets)):
+    visited = [False] * n
+    for i in range(n):
         if visited[i]:
             continue
         stack = [i]
@@ -41,10 +116,9 @@ def group_overlapping_pockets(
         while stack:
             u = stack.pop()
             group.append(u)
-            for v in range(len(pockets)):
-                if visited[v] or v == u:
-                    continue
-                if is_overlapped(u, v):
+            # 两种条件可能给出同一对口袋，去重后按编号升序入栈
+            for v in sorted(set(neighbors[u])):
+                if not visited[v]:
                     visited[v] = True
                     stack.append(v)
         groups.append(group)
@@ -60,3 +134,27 @@ def deduplicate_pockets(pockets: List[Pocket]) -> List[Pocket]:
     return kept
 
 
+def match_pockets_by_center(
+    pockets: List[Pocket],
+    candidates: List[Pocket],
+    max_distance: float = DEFAULT_CENTER_DISTANCE_THRESHOLD,
+) -> List[Optional[int]]:
+    """为每个口袋找中心最近的候选口袋，返回候选下标（超过 max_distance 时为 None）
+
+    按 pockets 的顺序贪心匹配，每个候选只使用一次。用于把 P2Rank 重打分的口袋（只有中心和分数）
+    对应回 fpocket 口袋，取得原始分数和描述符。
+    """
+    used: Set[int] = set()
+    matches: List[Optional[int]] = []
+    for p in pockets:
+        best, best_distance = None, 0.0
+        for j, c in enumerate(candidates):
+            if j in used:
+                continue
+            distance = math.dist((p.center_x, p.center_y, p.center_z), (c.center_x, c.center_y, c.center_z))
+            if distance <= max_distance and (best is None or distance < best_distance):
+                best, best_distance = j, distance
+        if best is not None:
+            used.add(best)
+        matches.append(best)
+    return matches
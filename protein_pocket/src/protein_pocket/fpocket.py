@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+import gzip
 import json
+import os
+import re
+import shutil
 import subprocess
-from dataclasses import dataclass
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .proc import RetryPolicy, call_with_retries, run_command
 
 
 @dataclass
@@ -15,89 +23,234 @@ class Pocket:
     raw_score: float
     score: float
     residues: List[str]
+    descriptors: Dict[str, float] = field(default_factory=dict)  # fpocket 描述符（体积、成药性分数等）
+
+
+@contextmanager
+def job_scratch(scratch_dir: Optional[str | Path] = None) -> Iterator[Path]:
+    """为单个任务创建私有临时目录，结束后自动删除
+
+    scratch_dir 为 None 时使用系统临时目录（TMPDIR），建议指向本地磁盘或 tmpfs。
+    """
+    if scratch_dir is not None:
+        Path(scratch_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="protein_pocket_", dir=scratch_dir) as tmp:
+        yield Path(tmp)
+
+
+def is_compressed(path: str | Path) -> bool:
+    """是否为 gzip 压缩的结构文件（如 1abc.pdb.gz）"""
+    return Path(path).suffix.lower() == ".gz"
+
+
+def structure_stem(path: str | Path) -> str:
+    """结构文件名去掉扩展名，压缩文件同时去掉 .gz，如 1abc.pdb.gz -> 1abc"""
+    path = Path(path)
+    return Path(path.stem).stem if is_compressed(path) else path.stem
+
+
+def open_structure(path: str | Path) -> BinaryIO:
+    """以二进制方式打开结构文件，gzip 压缩文件边读边解压"""
+    return gzip.open(path, "rb") if is_compressed(path) else open(path, "rb")
+
+
+def stage_input(pdb_path: Path, scratch: Path) -> Path:
+    """把输入结构放入临时目录：优先使用符号链接，不支持时复制
+
+    gzip 压缩的输入流式解压到临时目录（fpocket 只能读取未压缩文件），不会在输入目录旁留下解压副本。
+    """
+    if is_compressed(pdb_path):
+        staged = scratch / pdb_path.stem
+        with open_structure(pdb_path) as src, open(staged, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        return staged
 
+    staged = scratch / pdb_path.name
+    try:
+        os.symlink(pdb_path.resolve(), staged)
+    except OSError:
+        shutil.copyfile(pdb_path, staged)
+    return staged
+
+
+def _is_essential_artifact(relative: Path, stem: str) -> bool:
+    """后续步骤需要的 fpocket 输出：口袋信息、口袋原子（解析用）和口袋结构文件（P2Rank 用）"""
+    if relative.parent == Path("pockets"):
+        return relative.name.endswith("_atm.pdb")
+    return relative.name in (f"{stem}_info.txt", f"{stem}_out.pdb", f"{stem}_out.cif")
+
+
+def collect_fpocket_output(out_dir: Path, work_out_dir: Path, stem: str, copy_all: bool = True) -> None:
+    """把临时目录中的 fpocket 输出复制到结果目录"""
+    if work_out_dir.exists():
+        shutil.rmtree(work_out_dir)
+    if copy_all:
+        shutil.move(str(out_dir), str(work_out_dir))
+        return
+    for produced in out_dir.rglob("*"):
+        relative = produced.relative_to(out_dir)
+        if produced.is_file() and _is_essential_artifact(relative, stem):
+            target = work_out_dir / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(produced), str(target))
+
+
+def run_fpocket(
+    pdb_path: str | Path,
+    work_dir: Path,
+    scratch_dir: Optional[str | Path] = None,
+    copy_all: bool = True,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> Path:
+    """在私有临时目录中运行 fpocket，并把输出复制到 work_dir/<stem>_fpocket
 
-def run_fpocket(pdb_path: str | Path, work_dir: Path) -> Path:
+    fpocket 总是把 <stem>_out 写在输入文件旁边。直接在输入目录运行会写入（可能只读或位于 NFS 的）
+    输入树，且同一目录下同名不同扩展名的输入（a.pdb 与 a.cif）会相互覆盖，因此先把输入链接到
+    每个任务独立的临时目录中再运行。copy_all=False 时只复制后续步骤需要的文件。
+
+    超过 timeout 秒时杀死 fpocket 并抛出 subprocess.TimeoutExpired；临时性失败按 retry 重试。
+    """
     pdb_path = Path(pdb_path)
     
     # Check if input file exists
     if not pdb_path.exists():
         raise FileNotFoundError(f"Input file not found: {pdb_path}")
     
-    # fpocket creates output in the same directory as the input PDB
-    # with suffix "_out", so we need to look for that
-    expected_out_dir = pdb_path.parent / (pdb_path.stem + "_out")
-    
-    # Run fpocket
-    cmd = ["fpocket", "-f", str(pdb_path)]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print(f"fpocket stdout: {result.stdout}")
-        if result.stderr:
-            print(f"fpocket stderr: {result.stderr}")
-    except subprocess.CalledProcessError as e:
-        print(f"fpocket failed with return code {e.returncode}")
-        print(f"stdout: {e.stdout}")
-        print(f"stderr: {e.stderr}")
-        raise
+    stem = structure_stem(pdb_path)
+    work_out_dir = work_dir / (stem + "_fpocket")
     
-    # Move the output to our work directory
-    work_out_dir = work_dir / (pdb_path.stem + "_fpocket")
-    if expected_out_dir.exists():
-        import shutil
-        if work_out_dir.exists():
-            shutil.rmtree(work_out_dir)
-        shutil.move(str(expected_out_dir), str(work_out_dir))
-    else:
-        raise FileNotFoundError(f"fpocket output directory not found: {expected_out_dir}")
+    with job_scratch(scratch_dir) as scratch:
+        staged = stage_input(pdb_path, scratch)
+        
+        # fpocket creates output in the same directory as the input PDB
+        # with suffix "_out", so we need to look for that
+        expected_out_dir = scratch / (staged.stem + "_out")
+        
+        # Run fpocket
+        cmd = ["fpocket", "-f", str(staged)]
+
+        def attempt() -> subprocess.CompletedProcess:
+            # 重试前清除上一次失败留下的部分输出
+            shutil.rmtree(expected_out_dir, ignore_errors=True)
+            return run_command(cmd, timeout=timeout, capture_output=True, cwd=scratch)
+
+        try:
+            result = call_with_retries(attempt, retry, f"fpocket {pdb_path.name}")
+            print(f"fpocket stdout: {result.stdout}")
+            if result.stderr:
+                print(f"fpocket stderr: {result.stderr}")
+        except subprocess.TimeoutExpired:
+            print(f"fpocket timed out after {timeout}s, process group killed")
+            raise
+        except subprocess.CalledProcessError as e:
+            print(f"fpocket failed with return code {e.returncode}")
+            print(f"stdout: {e.stdout}")
+            print(f"stderr: {e.stderr}")
+            raise
+        
+        # Copy the output to our work directory
+        if not expected_out_dir.exists():
+            raise FileNotFoundError(f"fpocket output directory not found: {expected_out_dir}")
+        collect_fpocket_output(expected_out_dir, work_out_dir, stem, copy_all=copy_all)
     
     return work_out_dir
 
 
+def descriptor_key(label: str) -> str:
+    """把 fpocket 描述符名称规范化为字段名，如 Druggability Score -> druggability_score"""
+    return re.sub(r"[^0-9a-z]+", "_", label.lower()).strip("_")
+
+
+def parse_fpocket_info(info_file: Path) -> List[Tuple[int, Dict[str, float]]]:
+    """单次遍历 *_info.txt，返回 [(口袋编号, {描述符: 数值}), ...]"""
+    sections: List[Tuple[int, Dict[str, float]]] = []
+    current: Optional[Dict[str, float]] = None
+    keys: Dict[str, str] = {}  # 描述符名称在所有口袋中相同，规范化结果只计算一次
+    with open(info_file, 'r') as f:
+        for line in f:
+            label, sep, value = line.partition(":")
+            if not sep:
+                continue
+            label = label.strip()
+            if label.startswith("Pocket "):
+                number = label[7:].strip()
+                if number.isdigit():
+                    current = {}
+                    sections.append((int(number), current))
+                    continue
+            if current is None:
+                continue
+            try:
+                number_value = float(value)
+            except ValueError:
+                continue
+            key = keys.get(label)
+            if key is None:
+                key = keys[label] = descriptor_key(label)
+            current[key] = number_value
+    return sections
+
+
+def _read_pocket_atoms(pocket_file: Path, residue_ids: Dict[bytes, str]) -> Tuple[Tuple[float, float, float], List[str]]:
+    """单次读取一个口袋原子文件，返回 (原子坐标均值, 残基ID列表)
+
+    residue_ids 在同一输出目录的各口袋间共享：相邻口袋大量共享残基，转换结果可以复用。
+    没有原子的口袋中心为 (0, 0, 0)。
+    """
+    sum_x = sum_y = sum_z = 0.0
+    count = 0
+    raw_residues: Dict[bytes, None] = {}  # 链 + 残基编号 + 插入码，保持首次出现的顺序
+    try:
+        with open(pocket_file, 'rb') as f:
+            for line in f:
+                if line[:4] == b"ATOM":
+                    sum_x += float(line[30:38])
+                    sum_y += float(line[38:46])
+                    sum_z += float(line[46:54])
+                    count += 1
+                    raw_residues[line[21:27]] = None
+    except FileNotFoundError:
+        return (0.0, 0.0, 0.0), []
+
+    residues = []
+    for raw in raw_residues:
+        residue = residue_ids.get(raw)
+        if residue is None:
+            residue = residue_ids[raw] = _residue_id(raw)
+        residues.append(residue)
+    if not count:
+        return (0.0, 0.0, 0.0), residues
+    return (sum_x / count, sum_y / count, sum_z / count), residues
+
+
+def _residue_id(raw: bytes) -> str:
+    """PDB 列 22-27（链、残基编号、插入码）转换为与 P2Rank 一致的 "A_123" 格式"""
+    text = raw.decode("ascii", "replace")
+    chain = text[0].strip()
+    number = text[1:5].strip() + text[5:6].strip()
+    return f"{chain}_{number}" if chain else number
+
+
 def read_fpocket_pockets(fp_out_dir: Path) -> List[Pocket]:
+    """解析 fpocket 输出目录
+
+    *_info.txt 单次遍历得到每个口袋的全部描述符；各 pockets/pocketN_atm.pdb 只读取一次，
+    同时得到口袋中心（原子坐标均值）与口袋残基。
+    """
     # Find the info.txt file
     info_files = list(fp_out_dir.glob("*_info.txt"))
     if not info_files:
         raise FileNotFoundError(f"No fpocket info.txt found in {fp_out_dir}")
     
-    info_file = info_files[0]
+    pockets_dir = fp_out_dir / "pockets"
+    residue_ids: Dict[bytes, str] = {}
     pockets: List[Pocket] = []
-    
-    # Parse the info.txt file
-    with open(info_file, 'r') as f:
-        content = f.read()
-    
-    # Split by pocket sections
-    pocket_sections = content.split("Pocket ")[1:]  # Skip empty first element
-    
-    for i, section in enumerate(pocket_sections, 1):
-        lines = section.strip().split('\n')
-        score = 0.0
-        center_x = center_y = center_z = 0.0
-        residues = []
-        
-        for line in lines:
-            if "Score :" in line:
-                score = float(line.split(":")[1].strip())
-        
-        # Try to get center coordinates from the corresponding pocket PDB file
-        pocket_pdb = fp_out_dir / "pockets" / f"pocket{i}_atm.pdb"
-        if pocket_pdb.exists():
-            # Parse PDB to get center coordinates
-            coords = []
-            with open(pocket_pdb, 'r') as f:
-                for line in f:
-                    if line.startswith("ATOM"):
-                        x = float(line[30:38].strip())
-                        y = float(line[38:46].strip())
-                        z = float(line[46:54].strip())
-                        coords.append((x, y, z))
-            
-            if coords:
-                center_x = sum(c[0] for c in coords) / len(coords)
-                center_y = sum(c[1] for c in coords) / len(coords)
-                center_z = sum(c[2] for c in coords) / len(coords)
-        
+    for number, descriptors in parse_fpocket_info(info_files[0]):
+        (center_x, center_y, center_z), residues = _read_pocket_atoms(
+            pockets_dir / f"pocket{number}_atm.pdb", residue_ids
+        )
+        score = descriptors.get("score", 0.0)
         pockets.append(
             Pocket(
                 center_x=center_x,
@@ -106,9 +259,8 @@ def read_fpocket_pockets(fp_out_dir: Path) -> List[Pocket]:
                 raw_score=score,
                 score=score,
                 residues=residues,
+                descriptors=descriptors,
             )
         )
     
     return pockets
-
-
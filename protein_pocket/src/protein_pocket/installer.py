@@ -1,21 +1,108 @@
 """
 自动安装和配置 P2Rank 的工具模块
+
+`prank --version` 需要启动一次 JVM。验证成功后把 prank 脚本（及 bin/p2rank.jar）的路径、mtime
+和大小记录在用户缓存目录的 stamp 文件中，文件未变化时不再重复验证。
+下载与解压相关的模块（urllib.request、tarfile、rich.progress）只在安装时导入。
+
+P2Rank 默认安装到每个用户的工具目录（~/.cache/protein_pocket/tools），支持镜像地址、
+本地压缩包（离线安装）、SHA-256 校验、断点续传，并用文件锁保证并发的进程只安装一次。
 """
+import json
 import os
 import subprocess
 import shutil
-import tarfile
-import urllib.request
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, List, Optional
 from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
 
 console = Console()
 
 P2RANK_VERSION = "2.5.1"
 P2RANK_URL = f"https://github.com/rdk/p2rank/releases/download/{P2RANK_VERSION}/p2rank_{P2RANK_VERSION}.tar.gz"
+# P2RANK_URL 压缩包的 SHA-256，升级 P2RANK_VERSION 时一并更新。从默认地址下载时必须通过校验；
+# 未固定（None）时需要用 --sha256 / PROTEIN_POCKET_P2RANK_SHA256 指定，否则拒绝安装
+P2RANK_SHA256: Optional[str] = None
 P2RANK_DIR_NAME = f"p2rank_{P2RANK_VERSION}"
+STAMP_FILE_NAME = "p2rank_verified.json"
+DOWNLOAD_ATTEMPTS = 6  # 首次请求加最多 5 次续传
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_TIMEOUT = 60  # 秒，连接与两次读取之间的最长等待
+
+
+def user_cache_dir() -> Path:
+    """每个用户的缓存根目录：$XDG_CACHE_HOME/protein_pocket，默认 ~/.cache/protein_pocket"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "protein_pocket"
+
+
+def default_install_dir() -> Path:
+    """P2Rank 的默认安装目录（每个用户一份）"""
+    return user_cache_dir() / "tools"
+
+
+def _install_fingerprint(prank_script: Path) -> Dict[str, List[int]]:
+    """prank 脚本与 bin/p2rank.jar 的 mtime 和大小，任一变化都需要重新验证"""
+    fingerprint = {}
+    for name, path in (("prank", prank_script), ("jar", prank_script.parent / "bin" / "p2rank.jar")):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        fingerprint[name] = [st.st_mtime_ns, st.st_size]
+    return fingerprint
+
+
+def _load_stamps() -> Dict[str, dict]:
+    try:
+        return json.loads((user_cache_dir() / STAMP_FILE_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def is_verified(prank_script: Path) -> bool:
+    """prank_script 是否已验证过且之后没有变化"""
+    prank_script = prank_script.resolve()
+    stamp = _load_stamps().get(str(prank_script))
+    return bool(stamp) and stamp.get("fingerprint") == _install_fingerprint(prank_script)
+
+
+def record_verified(prank_script: Path, version_output: str) -> None:
+    """记录验证结果；stamp 文件写入失败（如只读的家目录）不影响运行"""
+    prank_script = prank_script.resolve()
+    stamp_file = user_cache_dir() / STAMP_FILE_NAME
+    stamps = _load_stamps()
+    stamps[str(prank_script)] = {
+        "fingerprint": _install_fingerprint(prank_script),
+        "version": version_output.strip(),
+        "verified_at": time.time(),
+    }
+    try:
+        stamp_file.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子重命名，多个进程同时验证时不会写出损坏的文件
+        fd, tmp_name = tempfile.mkstemp(dir=stamp_file.parent, prefix=".stamp_")
+        with os.fdopen(fd, "w") as f:
+            json.dump(stamps, f, indent=2)
+        os.replace(tmp_name, stamp_file)
+    except OSError:
+        pass
+
+
+def verify_prank(prank_script: Path, env: Optional[Dict[str, str]] = None, timeout: float = 60) -> bool:
+    """运行 `prank --version` 验证安装可用；已验证且文件未变化时直接返回 True，不启动 JVM"""
+    if is_verified(prank_script):
+        return True
+    try:
+        result = subprocess.run(
+            [str(prank_script), "--version"], capture_output=True, text=True, env=env, timeout=timeout, check=True
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return False
+    record_verified(prank_script, result.stdout)
+    return True
 
 
 def check_p2rank_installed(prank_home: Optional[str] = None) -> bool:
@@ -35,51 +122,164 @@ def check_p2rank_installed(prank_home: Optional[str] = None) -> bool:
     if prank_path.exists():
         return True
     
-    # 检查 PATH 中是否有 prank 命令
+    # 检查 PATH 中是否有可用的 prank 命令
+    prank_on_path = shutil.which("prank")
+    return prank_on_path is not None and verify_prank(Path(prank_on_path))
+
+
+def _check_sha256(path: Path, expected: Optional[str]) -> None:
+    """校验压缩包的 SHA-256；未指定期望值时只打印实际值，便于固定到配置中"""
+    from .cache import file_digest
+
+    actual = file_digest(path)
+    if not expected:
+        console.print(f"[dim]未指定 SHA-256，跳过校验（{path.name}: {actual}）[/dim]")
+        return
+    if actual != expected.strip().lower():
+        raise ValueError(f"{path} 的 SHA-256 不匹配: 期望 {expected.strip()}，实际 {actual}")
+    console.print("[green]✓ SHA-256 校验通过[/green]")
+
+
+def _content_range_total(header: Optional[str]) -> Optional[int]:
+    """从 "bytes 100-199/200" 中取出文件总大小"""
+    if header and "/" in header:
+        total = header.rsplit("/", 1)[1].strip()
+        if total.isdigit():
+            return int(total)
+    return None
+
+
+def _download_range(url: str, part: Path, progress, task) -> None:
+    """从 part 的当前大小处继续下载到 part；服务器不支持 Range 请求时从头下载"""
+    import urllib.error
+    import urllib.request
+
+    offset = part.stat().st_size if part.exists() else 0
+    request = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
     try:
-        subprocess.run(["prank", "--version"], capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+        response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            # 请求的范围从文件末尾开始：.part 已经是完整文件
+            return
+        raise
+    with response:
+        if offset and getattr(response, "status", None) != 206:
+            offset = 0
+        total = _content_range_total(response.headers.get("Content-Range")) if offset else None
+        length = response.headers.get("Content-Length")
+        if total is None and length and length.isdigit():
+            total = offset + int(length)
+        progress.update(task, completed=offset, total=total)
+        with open(part, "ab" if offset else "wb") as f:
+            for block in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                f.write(block)
+                progress.advance(task, len(block))
+    if total is not None and part.stat().st_size < total:
+        raise ConnectionError(f"连接提前关闭（{part.stat().st_size}/{total} 字节）")
 
 
-def download_p2rank(download_dir: Path) -> Path:
-    """下载 P2Rank"""
-    console.print(f"[blue]正在下载 P2Rank {P2RANK_VERSION}...[/blue]")
-    
+def download_p2rank(download_dir: Path, url: Optional[str] = None, sha256: Optional[str] = None) -> Path:
+    """下载 P2Rank，支持断点续传
+
+    数据先写入 <压缩包>.part，网络中断时按退避自动续传；进程被中断后再次调用也从已下载的位置继续
+    （需要服务器支持 Range 请求）。下载完整且校验通过后才重命名为最终文件名。
+    url 默认读取 PROTEIN_POCKET_P2RANK_URL，未设置时从 GitHub 下载；从 GitHub 下载时 sha256 默认为
+    固定的 P2RANK_SHA256，且必须通过校验。
+    """
+    import http.client
+    import urllib.error
+    from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, DownloadColumn
+
+    url = url or os.environ.get("PROTEIN_POCKET_P2RANK_URL") or P2RANK_URL
+    if url == P2RANK_URL:
+        sha256 = sha256 or P2RANK_SHA256
+        if not sha256:
+            # 在下载之前拒绝，不浪费一次完整下载
+            raise ValueError(
+                f"P2Rank {P2RANK_VERSION} 的默认下载地址没有固定的 SHA-256，无法校验；"
+                "请用 --sha256 或 PROTEIN_POCKET_P2RANK_SHA256 指定"
+            )
     tar_file = download_dir / f"p2rank_{P2RANK_VERSION}.tar.gz"
-    
+    part = tar_file.with_name(tar_file.name + ".part")
+
+    if tar_file.exists():
+        # 上次下载完成但安装未成功
+        try:
+            _check_sha256(tar_file, sha256)
+            console.print(f"[green]✓ 使用已下载的压缩包: {tar_file}[/green]")
+            return tar_file
+        except ValueError as e:
+            console.print(f"[yellow]{e}，重新下载[/yellow]")
+            tar_file.unlink()
+
+    console.print(f"[blue]正在下载 P2Rank {P2RANK_VERSION}: {url}[/blue]")
+    if part.exists():
+        console.print(f"[dim]从已下载的 {part.stat().st_size / 1024 ** 2:.1f} MB 处继续[/dim]")
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         TaskProgressColumn(),
+        DownloadColumn(),
         console=console,
     ) as progress:
         task = progress.add_task("下载中...", total=None)
-        
-        def show_progress(block_num, block_size, total_size):
-            if total_size > 0:
-                downloaded = block_num * block_size
-                progress.update(task, completed=downloaded, total=total_size)
-        
-        urllib.request.urlretrieve(P2RANK_URL, tar_file, reporthook=show_progress)
-    
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                _download_range(url, part, progress, task)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                # 4xx（超时和限流除外）重试也不会成功
+                permanent = isinstance(e, urllib.error.HTTPError) and e.code < 500 and e.code not in (408, 429)
+                if permanent or attempt + 1 == DOWNLOAD_ATTEMPTS:
+                    raise
+                delay = min(30, 2 ** attempt)
+                progress.console.print(
+                    f"[yellow]下载中断（{e}），{delay} 秒后续传 ({attempt + 1}/{DOWNLOAD_ATTEMPTS - 1})[/yellow]"
+                )
+                time.sleep(delay)
+
+    try:
+        _check_sha256(part, sha256)
+    except ValueError:
+        part.unlink()
+        raise
+    os.replace(part, tar_file)
     console.print(f"[green]✓ 下载完成: {tar_file}[/green]")
     return tar_file
 
 
 def extract_p2rank(tar_file: Path, extract_dir: Path) -> Path:
-    """解压 P2Rank"""
+    """解压 P2Rank
+
+    先解压到 extract_dir 下的临时目录，完整解压后再重命名为 p2rank_<版本>，
+    中断的解压不会留下看起来已经安装的目录。
+    """
+    import tarfile
+
     console.print(f"[blue]正在解压 P2Rank...[/blue]")
-    
-    with tarfile.open(tar_file, "r:gz") as tar:
-        tar.extractall(extract_dir)
-    
-    p2rank_dir = extract_dir / P2RANK_DIR_NAME
-    if not p2rank_dir.exists():
-        raise FileNotFoundError(f"解压后未找到 P2Rank 目录: {p2rank_dir}")
-    
+
+    staging = Path(tempfile.mkdtemp(prefix=".extract_", dir=extract_dir))
+    try:
+        with tarfile.open(tar_file, "r:gz") as tar:
+            if hasattr(tarfile, "data_filter"):
+                # 拒绝绝对路径、指向解压目录之外的链接等不安全的成员
+                tar.extractall(staging, filter="data")
+            else:
+                tar.extractall(staging)
+        extracted = staging / P2RANK_DIR_NAME
+        if not extracted.exists():
+            raise FileNotFoundError(f"解压后未找到 P2Rank 目录: {P2RANK_DIR_NAME}")
+        p2rank_dir = extract_dir / P2RANK_DIR_NAME
+        if p2rank_dir.exists():
+            # 之前未通过测试的安装
+            shutil.rmtree(p2rank_dir)
+        os.replace(extracted, p2rank_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
     console.print(f"[green]✓ 解压完成: {p2rank_dir}[/green]")
     return p2rank_dir
 
@@ -117,6 +317,7 @@ def test_p2rank_installation(p2rank_dir: Path) -> bool:
         if result.returncode == 0:
             console.print(f"[green]✓ P2Rank 安装成功! 版本信息:[/green]")
             console.print(f"[dim]{result.stdout.strip()}[/dim]")
+            record_verified(prank_script, result.stdout)
             return True
         else:
             console.print(f"[red]✗ P2Rank 测试失败: {result.stderr}[/red]")
@@ -130,51 +331,76 @@ def test_p2rank_installation(p2rank_dir: Path) -> bool:
         return False
 
 
-def install_p2rank(install_dir: Optional[Path] = None) -> Path:
-    """自动安装 P2Rank"""
-    if install_dir is None:
-        install_dir = Path.cwd()
-    
-    console.print(f"[yellow]开始自动安装 P2Rank {P2RANK_VERSION}...[/yellow]")
-    
-    # 检查是否已安装
-    if check_p2rank_installed():
-        console.print("[green]✓ P2Rank 已安装，跳过下载[/green]")
-        # 返回已安装的路径
-        if "P2RANK_HOME" in os.environ:
-            return Path(os.environ["P2RANK_HOME"])
-        else:
-            return Path.cwd() / P2RANK_DIR_NAME
-    
-    # 创建安装目录
-    install_dir.mkdir(parents=True, exist_ok=True)
-    
+@contextmanager
+def _install_lock(install_dir: Path) -> Iterator[None]:
+    """持有 install_dir 上的排他文件锁；多个进程同时安装时依次进行（没有 fcntl 的平台上不加锁）"""
     try:
-        # 下载
-        tar_file = download_p2rank(install_dir)
-        
-        # 解压
-        p2rank_dir = extract_p2rank(tar_file, install_dir)
-        
-        # 设置权限
-        make_prank_executable(p2rank_dir)
-        
-        # 测试安装
-        if test_p2rank_installation(p2rank_dir):
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(install_dir / ".install.lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            console.print("[yellow]另一个进程正在安装 P2Rank，等待其完成...[/yellow]")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield  # 关闭文件时释放锁
+
+
+def install_p2rank(
+    install_dir: Optional[Path] = None,
+    url: Optional[str] = None,
+    tarball: Optional[str] = None,
+    sha256: Optional[str] = None,
+) -> Path:
+    """自动安装 P2Rank
+
+    默认安装到每个用户的工具目录（default_install_dir()），从任何工作目录启动的批处理共用同一份安装。
+    url 指定镜像地址；tarball 指定本地压缩包（离线安装，不下载）；sha256 用于校验压缩包。
+    三者未指定时分别读取 PROTEIN_POCKET_P2RANK_URL、PROTEIN_POCKET_P2RANK_TARBALL、
+    PROTEIN_POCKET_P2RANK_SHA256。安装期间持有文件锁，并发的进程等待第一个进程完成后复用其安装。
+    """
+    install_dir = Path(install_dir) if install_dir else default_install_dir()
+    tarball = tarball or os.environ.get("PROTEIN_POCKET_P2RANK_TARBALL")
+    sha256 = sha256 or os.environ.get("PROTEIN_POCKET_P2RANK_SHA256")
+    p2rank_dir = install_dir / P2RANK_DIR_NAME
+
+    install_dir.mkdir(parents=True, exist_ok=True)
+    with _install_lock(install_dir):
+        # 等待锁期间其他进程可能已经完成安装
+        if (p2rank_dir / "prank").exists() and verify_prank(p2rank_dir / "prank"):
+            console.print(f"[green]✓ P2Rank 已安装，跳过下载: {p2rank_dir}[/green]")
+            return p2rank_dir
+
+        console.print(f"[yellow]开始自动安装 P2Rank {P2RANK_VERSION}...[/yellow]")
+        try:
+            if tarball:
+                tar_file = Path(tarball)
+                console.print(f"[blue]使用本地压缩包: {tar_file}[/blue]")
+                _check_sha256(tar_file, sha256)
+            else:
+                tar_file = download_p2rank(install_dir, url=url, sha256=sha256)
+
+            p2rank_dir = extract_p2rank(tar_file, install_dir)
+            make_prank_executable(p2rank_dir)
+
+            if not test_p2rank_installation(p2rank_dir):
+                # 删除无法运行的安装，下次重新解压（压缩包保留，不重新下载）
+                shutil.rmtree(p2rank_dir, ignore_errors=True)
+                raise RuntimeError("P2Rank 安装测试失败")
+
             console.print(f"[green]🎉 P2Rank {P2RANK_VERSION} 安装成功![/green]")
             console.print(f"[dim]安装路径: {p2rank_dir}[/dim]")
-            
-            # 清理下载的压缩包
-            tar_file.unlink()
-            console.print("[dim]已清理下载文件[/dim]")
-            
+            if not tarball:
+                # 清理下载的压缩包（用户提供的本地压缩包保留）
+                tar_file.unlink()
+                console.print("[dim]已清理下载文件[/dim]")
             return p2rank_dir
-        else:
-            raise RuntimeError("P2Rank 安装测试失败")
-            
-    except Exception as e:
-        console.print(f"[red]✗ P2Rank 安装失败: {e}[/red]")
-        raise
+
+        except Exception as e:
+            console.print(f"[red]✗ P2Rank 安装失败: {e}[/red]")
+            raise
 
 
 def get_p2rank_home() -> Optional[Path]:
@@ -196,6 +422,11 @@ def get_p2rank_home() -> Optional[Path]:
     p2rank_dir = parent_dir / P2RANK_DIR_NAME
     if p2rank_dir.exists():
         return p2rank_dir
+
+    # 检查每个用户的默认安装目录
+    p2rank_dir = default_install_dir() / P2RANK_DIR_NAME
+    if p2rank_dir.exists():
+        return p2rank_dir
     
     return None
 
@@ -0,0 +1,79 @@
+"""
+批量处理进度日志模块 - 追加写入、可在崩溃后恢复的 JSON Lines 日志
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+JOURNAL_FILE_NAME = "batch_journal.jsonl"
+
+
+class BatchJournal:
+    """批量处理的追加写入日志
+
+    每个蛋白质处理完成后立即写入一行 JSON 并 fsync，进程被杀死时最多丢失正在写入的那一行。
+    """
+
+    def __init__(self, path: str | Path, append: bool = True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        needs_newline = append and _ends_without_newline(self.path)
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+        if needs_newline:
+            # 上次崩溃留下了写了一半的行，先换行，避免新记录与其拼接在一起
+            self._file.write("\n")
+
+    def append(self, key: str, result: Dict[str, Any]) -> None:
+        record = {"key": key, "finished_at": time.time(), "result": result}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self) -> "BatchJournal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _ends_without_newline(path: Path) -> bool:
+    if not path.exists() or path.stat().st_size == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def load_journal(path: str | Path) -> Dict[str, Dict[str, Any]]:
+    """读取日志，返回每个蛋白质最新的一条记录（按 key 索引）
+
+    崩溃时可能留下写了一半的最后一行，这样的行会被忽略。
+    """
+    records: Dict[str, Dict[str, Any]] = {}
+    journal_path = Path(path)
+    if not journal_path.exists():
+        return records
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["key"]] = record
+    return records
+
+
+def journal_path_for(results_dir: str | Path, journal_path: Optional[str] = None) -> Path:
+    return Path(journal_path) if journal_path else Path(results_dir) / JOURNAL_FILE_NAME
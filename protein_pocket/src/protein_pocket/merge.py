@@ -0,0 +1,296 @@
+"""
+批量处理摘要合并模块 - 流式合并多个分片或多次运行的摘要 CSV
+
+同一个蛋白质（按 protein_path 识别）出现多次时，保留最新的成功记录；没有成功记录时保留最新的一条。
+每行的 detailed_csv 列指向该记录的详细结果 CSV，各节点使用不同结果目录时，合并后的摘要仍能找到
+胜出记录对应的详细结果；指定 detailed_output 时还会把胜出记录的口袋行拼接为一个 CSV。
+"最新"按输入文件的修改时间和文件内的行号确定：同一文件中靠后的行更新（--resume 时
+之前的结果先写入摘要，新结果追加在后面）。
+
+合并使用外部排序：每次读入 run_rows 行，按 (protein_path, 文件次序, 行号) 排序后写入临时的有序段，
+再用 heapq.merge 逐行归并。内存占用由 run_rows 和同时归并的段数决定，与蛋白质数量无关。
+断崖分析统计由 cliff_analysis.CliffSummaryAccumulator 在写出时增量计算。
+"""
+from __future__ import annotations
+
+import csv
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from rich.console import Console
+from rich.table import Table
+
+from .batch import BatchResult, BatchStats, summary_header
+from .cliff_analysis import CliffSummaryAccumulator
+
+console = Console()
+
+RUN_ROWS = 50_000  # 每个有序段在内存中排序的行数
+MAX_FAN_IN = 64  # 一次归并同时打开的有序段数，超出时先分组归并
+REQUIRED_COLUMNS = ("protein_name", "protein_path", "status")
+_TOPK_COLUMN = re.compile(r"top_pocket_(\d+)_score$")
+
+
+@dataclass
+class MergeReport:
+    """合并结果的统计"""
+    output_csv: Path
+    files: int = 0
+    rows_read: int = 0
+    proteins: int = 0
+    duplicates: int = 0  # 被丢弃的重复记录数
+    detailed_output: Optional[Path] = None
+    detailed_proteins: int = 0  # 拼接进 detailed_output 的蛋白质数
+    detailed_missing: int = 0  # 胜出记录为成功但找不到详细结果 CSV 的蛋白质数
+    stats: BatchStats = field(default_factory=BatchStats)
+    cliff: CliffSummaryAccumulator = field(default_factory=CliffSummaryAccumulator)
+
+
+def _read_header(path: Path) -> Optional[List[str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
+
+
+def is_summary_header(header: Optional[List[str]]) -> bool:
+    return bool(header) and all(column in header for column in REQUIRED_COLUMNS)
+
+
+def summary_topk(header: List[str]) -> int:
+    """摘要 CSV 中口袋列对应的 topk"""
+    return max((int(m.group(1)) for m in map(_TOPK_COLUMN.match, header) if m), default=0)
+
+
+def find_summary_files(inputs: Iterable[str | Path], exclude: Optional[Path] = None) -> List[Path]:
+    """展开输入：文件必须是摘要 CSV；目录中取表头符合摘要格式的 *.csv（不递归）"""
+    exclude = exclude.resolve() if exclude is not None else None
+    files: List[Path] = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = [p for p in sorted(path.glob("*.csv")) if is_summary_header(_read_header(p))]
+        elif path.is_file():
+            if not is_summary_header(_read_header(path)):
+                raise ValueError(f"不是批量处理摘要 CSV（缺少 {', '.join(REQUIRED_COLUMNS)} 列）: {path}")
+            candidates = [path]
+        else:
+            raise FileNotFoundError(f"输入不存在: {path}")
+        files.extend(p for p in candidates if p.resolve() != exclude)
+    # 去重，按修改时间从旧到新排列（决定重复记录的新旧）
+    unique = {p.resolve(): p for p in files}
+    return sorted(unique.values(), key=lambda p: (p.stat().st_mtime, str(p)))
+
+
+def _sort_key(record: list):
+    return record[0], record[1], record[2]
+
+
+def _write_run(records: List[list], tmp_dir: Path) -> Path:
+    records.sort(key=_sort_key)
+    fd, name = tempfile.mkstemp(prefix="run_", suffix=".jsonl", dir=tmp_dir)
+    with open(fd, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return Path(name)
+
+
+def _read_run(path: Path) -> Iterator[list]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _sorted_runs(files: Sequence[Path], header: List[str], tmp_dir: Path, run_rows: int, report: MergeReport) -> List[Path]:
+    """把所有输入行切分为有序段；每条记录为 [protein_path, 文件次序, 行号, 按 header 排列的值]"""
+    runs: List[Path] = []
+    records: List[list] = []
+    for rank, path in enumerate(files):
+        with open(path, newline="", encoding="utf-8") as f:
+            for index, row in enumerate(csv.DictReader(f)):
+                if not row.get("protein_path"):
+                    continue
+                records.append([row["protein_path"], rank, index, [row.get(column) or "" for column in header]])
+                report.rows_read += 1
+                if len(records) >= run_rows:
+                    runs.append(_write_run(records, tmp_dir))
+                    records = []
+    if records:
+        runs.append(_write_run(records, tmp_dir))
+    return runs
+
+
+def _merged(runs: List[Path], tmp_dir: Path, fan_in: int) -> Iterator[list]:
+    """归并所有有序段；段数超过 fan_in 时先分组归并为更少的段，避免同时打开过多文件"""
+    while len(runs) > fan_in:
+        next_runs = []
+        for i in range(0, len(runs), fan_in):
+            group = runs[i:i + fan_in]
+            fd, name = tempfile.mkstemp(prefix="run_", suffix=".jsonl", dir=tmp_dir)
+            with open(fd, "w", encoding="utf-8") as f:
+                for record in heapq.merge(*map(_read_run, group), key=_sort_key):
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for run in group:
+                run.unlink()
+            next_runs.append(Path(name))
+        runs = next_runs
+    return heapq.merge(*map(_read_run, runs), key=_sort_key)
+
+
+def _float(value: Optional[str]) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def row_to_batch_result(row: Dict[str, str]) -> BatchResult:
+    """摘要 CSV 的一行转为 BatchResult（只包含统计所需的字段，不含口袋详情）"""
+    return BatchResult(
+        protein_name=row["protein_name"],
+        protein_path=row["protein_path"],
+        status=row["status"],
+        error_message=row.get("error_message") or None,
+        processing_time=_float(row.get("processing_time")),
+        high_confidence_count=int(_float(row.get("high_confidence_count"))),
+        is_top1_dominant=row.get("is_top1_dominant") == "True",
+        max_delta=_float(row.get("max_delta")),
+        cliff_index=int(_float(row.get("cliff_index"))),
+        failure_class=row.get("failure_class") or None,
+        detailed_csv=row.get("detailed_csv") or None,
+    )
+
+
+def _detailed_pocket_rows(path: Path) -> Iterator[List[str]]:
+    """读取详细结果 CSV 的口袋表（表头和口袋行），遇到空行即停止，不含后面的断崖分析摘要"""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not any(row):
+                return
+            yield row
+
+
+class _DetailedConcatenator:
+    """把胜出记录的详细结果 CSV 逐个追加到一个文件，每行前加上 protein_name 和 protein_path"""
+
+    def __init__(self, f, report: MergeReport):
+        self._writer = csv.writer(f)
+        self._report = report
+        self._header: Optional[List[str]] = None
+
+    def add(self, result: BatchResult) -> None:
+        if result.status != "success":
+            return
+        if not result.detailed_csv or not Path(result.detailed_csv).is_file():
+            self._report.detailed_missing += 1
+            return
+        rows = _detailed_pocket_rows(Path(result.detailed_csv))
+        header = next(rows, None)
+        if header is None:
+            self._report.detailed_missing += 1
+            return
+        if self._header is None:
+            self._header = header
+            self._writer.writerow(["protein_name", "protein_path", *header])
+        elif header != self._header:
+            raise ValueError(f"详细结果 CSV 的列与之前的文件不一致: {result.detailed_csv}")
+        for row in rows:
+            self._writer.writerow([result.protein_name, result.protein_path, *row])
+        self._report.detailed_proteins += 1
+
+
+def merge_summaries(
+    inputs: Iterable[str | Path],
+    output_csv: str | Path,
+    run_rows: int = RUN_ROWS,
+    fan_in: int = MAX_FAN_IN,
+    tmp_dir: Optional[str | Path] = None,
+    detailed_output: Optional[str | Path] = None,
+) -> MergeReport:
+    """合并摘要 CSV，按 protein_path 排序写出，每个蛋白质一行
+
+    输入的 topk 不同时，输出的口袋列按最大的 topk 生成，较小 topk 的行留空。
+    临时有序段默认写在输出文件所在目录；输出先写入临时文件，完成后再替换。
+    指定 detailed_output 时，按同样的顺序把成功的胜出记录的详细结果 CSV（detailed_csv 列）
+    拼接到该文件，找不到的计入 report.detailed_missing。
+    """
+    if run_rows < 1 or fan_in < 2:
+        raise ValueError("run_rows 必须大于等于 1，fan_in 必须大于等于 2")
+    output_path = Path(output_csv)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    files = find_summary_files(inputs, exclude=output_path)
+    if not files:
+        raise ValueError("没有找到可合并的摘要 CSV")
+
+    header = summary_header(max(summary_topk(_read_header(p)) for p in files))
+    status_column = header.index("status")
+    report = MergeReport(output_csv=output_path, files=len(files))
+    partial = output_path.with_name(output_path.name + ".partial")
+    detailed_partial = None
+    if detailed_output is not None:
+        report.detailed_output = Path(detailed_output)
+        report.detailed_output.parent.mkdir(parents=True, exist_ok=True)
+        detailed_partial = report.detailed_output.with_name(report.detailed_output.name + ".partial")
+    with tempfile.TemporaryDirectory(prefix=".merge_", dir=tmp_dir or output_path.parent) as tmp:
+        runs = _sorted_runs(files, header, Path(tmp), run_rows, report)
+        with open(partial, "w", newline="", encoding="utf-8") as f, (
+            open(detailed_partial, "w", newline="", encoding="utf-8") if detailed_partial else nullcontext()
+        ) as detailed_file:
+            detailed = _DetailedConcatenator(detailed_file, report) if detailed_file else None
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for _, group in itertools.groupby(_merged(runs, Path(tmp), fan_in), key=lambda record: record[0]):
+                # 组内按从旧到新排列：成功记录覆盖一切，失败记录只覆盖非成功记录
+                winner = None
+                seen = 0
+                for record in group:
+                    seen += 1
+                    values = record[3]
+                    if winner is None or values[status_column] == "success" or winner[status_column] != "success":
+                        winner = values
+                writer.writerow(winner)
+                report.proteins += 1
+                report.duplicates += seen - 1
+                result = row_to_batch_result(dict(zip(header, winner)))
+                report.stats.add(result)
+                if result.status == "success":
+                    report.cliff.add(result)
+                if detailed:
+                    detailed.add(result)
+    os.replace(partial, output_path)
+    if detailed_partial:
+        os.replace(detailed_partial, report.detailed_output)
+    return report
+
+
+def print_merge_report(report: MergeReport) -> None:
+    """打印合并统计、批量处理摘要和断崖分析分布"""
+    from .batch import print_batch_stats
+
+    console.print(
+        f"✓ 合并了 {report.files} 个摘要 CSV（{report.rows_read} 行），{report.proteins} 个蛋白质，"
+        f"丢弃 {report.duplicates} 条重复记录: {report.output_csv}"
+    )
+    if report.detailed_output is not None:
+        console.print(f"✓ 拼接了 {report.detailed_proteins} 个蛋白质的详细结果: {report.detailed_output}")
+        if report.detailed_missing:
+            console.print(
+                f"[yellow]{report.detailed_missing} 个成功的蛋白质找不到详细结果 CSV"
+                f"（未保存，或不在本机的 detailed_csv 路径下）[/yellow]"
+            )
+    print_batch_stats(report.stats)
+
+    distribution = report.cliff.summary().get("high_confidence_distribution")
+    if distribution:
+        table = Table(title="高置信度口袋数分布")
+        table.add_column("高置信度口袋数", style="cyan")
+        table.add_column("蛋白质数", style="magenta")
+        for count, proteins in sorted(distribution.items()):
+            table.add_row(str(count), str(proteins))
+        console.print(table)
@@ -2,13 +2,15 @@ from __future__ import annotations
 
 import csv
 import os
+import shutil
 import subprocess
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
-from .fpocket import Pocket
+from .fpocket import Pocket, structure_stem
 from .installer import ensure_p2rank_installed
+from .proc import RetryPolicy, call_with_retries, run_command
 
 
 @dataclass
@@ -16,6 +18,13 @@ class ScoredPocket(Pocket):
     score: float
 
 
+@dataclass
+class RescoreJob:
+    """批量重打分中的单个蛋白质"""
+    pdb_path: Path
+    work_dir: Path
+
+
 def export_pockets_to_prank_csv(pockets: Iterable[Pocket], out_csv: Path) -> None:
     with out_csv.open("w", newline="") as f:
         w = csv.writer(f)
@@ -24,47 +33,72 @@ def export_pockets_to_prank_csv(pockets: Iterable[Pocket], out_csv: Path) -> Non
             w.writerow([f"{p.center_x:.3f}", f"{p.center_y:.3f}", f"{p.center_z:.3f}"])
 
 
-def rescore_with_p2rank(
-    pockets: List[Pocket], pdb_path: Path, work_dir: Path, prank_home: Optional[str] = None
-) -> List[ScoredPocket]:
-    out_dir = work_dir / "p2rank_out"
-    out_dir.mkdir(parents=True, exist_ok=True)
-
+def resolve_p2rank_home(prank_home: Optional[str] = None) -> Path:
     # 使用提供的P2Rank路径（如果已预先检查）或进行检查
     if prank_home and Path(prank_home).exists():
         # 如果提供了路径且存在，直接使用（避免重复检查）
-        p2rank_path = Path(prank_home)
-    else:
-        # 否则进行完整的安装检查
-        p2rank_path = ensure_p2rank_installed(prank_home)
+        return Path(prank_home)
+    # 否则进行完整的安装检查
+    return ensure_p2rank_installed(prank_home)
+
+
+def find_fpocket_output_file(work_dir: Path, pdb_path: Path) -> Path:
+    """查找 fpocket 输出的口袋结构文件（可能是 .pdb 或 .cif）"""
+    stem = structure_stem(pdb_path)
+    fpocket_dir = work_dir / f"{stem}_fpocket"
+    fpocket_out_pdb = fpocket_dir / f"{stem}_out.pdb"
+    fpocket_out_cif = fpocket_dir / f"{stem}_out.cif"
 
-    # Create a dataset file for P2Rank rescore
-    dataset_file = out_dir / "fpocket_dataset.ds"
-    
-    # Find the actual fpocket output file (could be .pdb or .cif)
-    fpocket_dir = work_dir / f"{pdb_path.stem}_fpocket"
-    fpocket_out_pdb = fpocket_dir / f"{pdb_path.stem}_out.pdb"
-    fpocket_out_cif = fpocket_dir / f"{pdb_path.stem}_out.cif"
-    
     # Use the file that actually exists
     if fpocket_out_pdb.exists():
-        fpocket_output_file = fpocket_out_pdb
-    elif fpocket_out_cif.exists():
-        fpocket_output_file = fpocket_out_cif
-    else:
-        raise FileNotFoundError(f"fpocket output file not found. Expected either {fpocket_out_pdb} or {fpocket_out_cif}")
-    
-    # Use absolute paths for P2Rank
-    abs_fpocket_pdb = fpocket_output_file.resolve()
-    abs_pdb_path = pdb_path.resolve()
-    
+        return fpocket_out_pdb
+    if fpocket_out_cif.exists():
+        return fpocket_out_cif
+    raise FileNotFoundError(f"fpocket output file not found. Expected either {fpocket_out_pdb} or {fpocket_out_cif}")
+
+
+def write_rescore_dataset(dataset_file: Path, jobs: Sequence[RescoreJob]) -> None:
+    """写入 P2Rank rescore 数据集文件，每行一个 fpocket 输出 / 蛋白质 对"""
     with open(dataset_file, 'w') as f:
         f.write("PARAM.PREDICTION_METHOD=fpocket\n")
         f.write("HEADER: prediction protein\n")
-        f.write(f"{abs_fpocket_pdb}  {abs_pdb_path}\n")
+        for job in jobs:
+            # Use absolute paths for P2Rank
+            abs_fpocket_pdb = find_fpocket_output_file(job.work_dir, job.pdb_path).resolve()
+            f.write(f"{abs_fpocket_pdb}  {job.pdb_path.resolve()}\n")
+
 
+def java_options(heap_mb: Optional[int] = None, threads: Optional[int] = None, existing: str = "") -> str:
+    """在已有的 _JAVA_OPTIONS 后追加堆上限与线程相关的 JVM 参数（同一参数以最后出现的为准）
+
+    threads 同时限制 JVM 看到的处理器数和 GC 线程数；否则每个 JVM 都按整台机器的核数创建
+    GC 与编译线程，多个 worker 同时运行时严重超额订阅 CPU。
+    """
+    options = [existing] if existing else []
+    if heap_mb:
+        options.append(f"-Xmx{heap_mb}m")
+    if threads:
+        options += [
+            f"-XX:ActiveProcessorCount={threads}",
+            f"-XX:ParallelGCThreads={threads}",
+            f"-XX:ConcGCThreads={max(1, threads // 4)}",
+        ]
+    return " ".join(options)
+
+
+def prank_command(
+    dataset_file: Path,
+    out_dir: Path,
+    p2rank_path: Path,
+    threads: Optional[int] = None,
+    heap_mb: Optional[int] = None,
+) -> Tuple[List[str], Dict[str, str]]:
+    """prank rescore 的命令行与环境变量"""
     env = os.environ.copy()
     env["P2RANK_HOME"] = str(p2rank_path)
+    if heap_mb or threads:
+        # prank 启动脚本会设置自己的 -Xmx，_JAVA_OPTIONS 由 JVM 最后解析，可以覆盖脚本中的值
+        env["_JAVA_OPTIONS"] = java_options(heap_mb, threads, env.get("_JAVA_OPTIONS", ""))
 
     # Use the prank script from P2RANK_HOME with rescore command
     prank_script = p2rank_path / "prank"
@@ -75,18 +109,37 @@ def rescore_with_p2rank(
         "-o",
         str(out_dir),
     ]
-    subprocess.run(cmd, check=True, env=env)
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    return cmd, env
 
-    # Read P2Rank rescore results
-    # The output files are directly in out_dir with full filename
+
+def run_prank_rescore(
+    dataset_file: Path,
+    out_dir: Path,
+    p2rank_path: Path,
+    threads: Optional[int] = None,
+    heap_mb: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> None:
+    """运行 prank rescore；超过 timeout 秒时杀死 prank 及其 JVM，临时性失败（如 JVM 崩溃）按 retry 重试"""
+    cmd, env = prank_command(dataset_file, out_dir, p2rank_path, threads=threads, heap_mb=heap_mb)
+    call_with_retries(lambda: run_command(cmd, timeout=timeout, env=env), retry, f"P2Rank {dataset_file.name}")
+
+
+def find_predictions_csv(out_dir: Path, pdb_path: Path) -> Path:
+    """单个蛋白质的 rescore 输出：<文件名>_predictions.csv，旧版本的 P2Rank 写出 predictions.csv"""
     scores_csv = out_dir / f"{pdb_path.name}_predictions.csv"
-    
     if not scores_csv.exists():
         # Try alternative naming
         scores_csv = out_dir / "predictions.csv"
         if not scores_csv.exists():
             raise FileNotFoundError(f"P2Rank rescore predictions CSV not found in {out_dir}")
+    return scores_csv
+
 
+def read_p2rank_predictions(scores_csv: Path) -> List[ScoredPocket]:
     rescored: list[ScoredPocket] = []
     with scores_csv.open() as f:
         r = csv.DictReader(f)
@@ -94,12 +147,12 @@ def rescore_with_p2rank(
             # P2Rank rescore output has center_x, center_y, center_z columns with spaces
             # Clean up the keys and values to handle extra spaces
             clean_row = {k.strip(): v.strip() for k, v in row.items()}
-            
+
             x = float(clean_row.get("center_x", "0.0"))
             y = float(clean_row.get("center_y", "0.0"))
             z = float(clean_row.get("center_z", "0.0"))
             score = float(clean_row.get("score", "0.0"))
-            
+
             # Use the P2Rank coordinates directly instead of matching
             rescored.append(
                 ScoredPocket(
@@ -111,7 +164,139 @@ def rescore_with_p2rank(
                     residues=[],  # We don't have residue info in the CSV
                 )
             )
-
     return rescored
 
 
+def rescore_with_p2rank(
+    pockets: List[Pocket],
+    pdb_path: Path,
+    work_dir: Path,
+    prank_home: Optional[str] = None,
+    threads: Optional[int] = None,
+    heap_mb: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[ScoredPocket]:
+    out_dir = work_dir / "p2rank_out"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    p2rank_path = resolve_p2rank_home(prank_home)
+
+    # Create a dataset file for P2Rank rescore
+    dataset_file = out_dir / "fpocket_dataset.ds"
+    write_rescore_dataset(dataset_file, [RescoreJob(pdb_path=pdb_path, work_dir=work_dir)])
+
+    run_prank_rescore(
+        dataset_file, out_dir, p2rank_path, threads=threads, heap_mb=heap_mb, timeout=timeout, retry=retry
+    )
+
+    # Read P2Rank rescore results
+    # The output files are directly in out_dir with full filename
+    return read_p2rank_predictions(find_predictions_csv(out_dir, pdb_path))
+
+
+def _collect_chunk_predictions(job: RescoreJob, chunk_out_dir: Path) -> List[ScoredPocket]:
+    """把批量输出中属于该蛋白质的文件移回它自己的 p2rank_out 目录并读取结果"""
+    name = job.pdb_path.name
+    scores_csv = chunk_out_dir / f"{name}_predictions.csv"
+    if not scores_csv.exists():
+        raise FileNotFoundError(f"P2Rank rescore predictions CSV not found for {name} in {chunk_out_dir}")
+
+    protein_out_dir = job.work_dir / "p2rank_out"
+    protein_out_dir.mkdir(parents=True, exist_ok=True)
+    produced_files = set(chunk_out_dir.rglob(f"{name}_*")) | set(chunk_out_dir.rglob(f"{name}.*"))
+    for produced in sorted(produced_files):
+        if produced.is_file():
+            target = protein_out_dir / produced.relative_to(chunk_out_dir)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(produced), str(target))
+
+    return read_p2rank_predictions(protein_out_dir / scores_csv.name)
+
+
+def _rescore_chunk(
+    jobs: List[RescoreJob],
+    chunk_out_dir: Path,
+    p2rank_path: Path,
+    threads: Optional[int],
+    heap_mb: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[Union[List[ScoredPocket], Exception]]:
+    """对一组文件名互不相同的蛋白质运行一次 prank；失败或超时时二分隔离出错的蛋白质
+
+    timeout 是每个蛋白质的时间，一次启动的超时为 timeout * 蛋白质数。
+    """
+    if chunk_out_dir.exists():
+        shutil.rmtree(chunk_out_dir)
+    chunk_out_dir.mkdir(parents=True)
+
+    try:
+        dataset_file = chunk_out_dir / "fpocket_dataset.ds"
+        write_rescore_dataset(dataset_file, jobs)
+        run_prank_rescore(
+            dataset_file, chunk_out_dir, p2rank_path, threads=threads, heap_mb=heap_mb,
+            timeout=timeout * len(jobs) if timeout else None, retry=retry,
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+        if len(jobs) == 1:
+            return [e]
+        # 整个数据集失败时无法判断是哪个蛋白质导致的，拆成两半分别重跑
+        mid = len(jobs) // 2
+        return (
+            _rescore_chunk(jobs[:mid], chunk_out_dir / "a", p2rank_path, threads, heap_mb, timeout, retry)
+            + _rescore_chunk(jobs[mid:], chunk_out_dir / "b", p2rank_path, threads, heap_mb, timeout, retry)
+        )
+
+    outcomes: List[Union[List[ScoredPocket], Exception]] = []
+    for job in jobs:
+        try:
+            outcomes.append(_collect_chunk_predictions(job, chunk_out_dir))
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+def rescore_batch_with_p2rank(
+    jobs: Sequence[RescoreJob],
+    out_dir: Path,
+    prank_home: Optional[str] = None,
+    threads: Optional[int] = None,
+    heap_mb: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[Union[List[ScoredPocket], Exception]]:
+    """用一次 prank 启动为多个蛋白质重打分
+
+    所有 fpocket 输出写入同一个数据集文件，P2Rank 的 JVM 与模型只加载一次。
+    返回值与 jobs 一一对应：成功时为该蛋白质的 ScoredPocket 列表，失败时为对应的异常，
+    单个蛋白质失败不会影响同一批次中的其他蛋白质。
+    heap_mb 为每次 prank 启动的 JVM 堆上限（MiB），None 表示使用 prank 脚本的默认值。
+    timeout 为每个蛋白质的超时（秒），一次启动的超时按其中的蛋白质数累加。
+    """
+    p2rank_path = resolve_p2rank_home(prank_home)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # P2Rank 以蛋白质文件名命名输出，同名文件需要放到不同的 prank 调用中
+    rounds: list[list[int]] = []
+    for idx, job in enumerate(jobs):
+        for round_indices in rounds:
+            if all(jobs[i].pdb_path.name != job.pdb_path.name for i in round_indices):
+                round_indices.append(idx)
+                break
+        else:
+            rounds.append([idx])
+
+    outcomes: List[Union[List[ScoredPocket], Exception]] = [None] * len(jobs)  # type: ignore[list-item]
+    try:
+        for round_no, round_indices in enumerate(rounds):
+            round_jobs = [jobs[i] for i in round_indices]
+            round_outcomes = _rescore_chunk(
+                round_jobs, out_dir / f"round_{round_no}", p2rank_path, threads, heap_mb, timeout, retry
+            )
+            for i, outcome in zip(round_indices, round_outcomes):
+                outcomes[i] = outcome
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    return outcomes
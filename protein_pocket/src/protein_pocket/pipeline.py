@@ -1,13 +1,24 @@
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, NamedTuple
-from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, NamedTuple, Union
+from dataclasses import dataclass, field, replace
 
 from rich.console import Console
 
-from .fpocket import run_fpocket, read_fpocket_pockets
-from .filtering import deduplicate_pockets
-from .p2rank import rescore_with_p2rank
+from .fpocket import Pocket, run_fpocket, read_fpocket_pockets, structure_stem
+from .filtering import (
+    deduplicate_pockets,
+    DEFAULT_CENTER_DISTANCE_THRESHOLD,
+    DEFAULT_RESIDUE_JACCARD_THRESHOLD,
+)
+from .p2rank import ScoredPocket, rescore_with_p2rank, resolve_p2rank_home
+from .proc import RetryPolicy, classify_failure
+from .cache import ResultCache, cache_key, pockets_to_records, DEFAULT_CACHE_MAX_BYTES
 from .cliff_analysis import analyze_cliff_pattern, CliffAnalysisResult
+from .retention import KEEP_ALL, apply_retention, copies_all_fpocket_output, validate_keep
+from .timing import format_stage_totals, spans_to_records, stage_span, stage_totals
 
 
 console = Console()
@@ -22,62 +33,364 @@ class PipelineResult:
     all_pockets: list  # 所有检测到的口袋（用于排名变化计算）
     filtered_pockets: list  # 过滤后的口袋（用于排名变化计算）
     cliff_analysis: Optional[CliffAnalysisResult] = None  # 断崖分析结果
+    stage_spans: list = field(default_factory=list)  # 各阶段耗时（timing.StageSpan）
+    pdb_path: Optional[Path] = None  # 输入结构文件
+    rescored_pockets: list = field(default_factory=list)  # 按分数排序的全部重打分口袋，top_pockets 是其前 topk 个
 
 
-def run_pipeline(
+class PipelineError(Exception):
+    """PocketPipeline.run_many 中单个结构处理失败；原始异常见 __cause__"""
+
+    def __init__(self, pdb_path: Path, error: BaseException):
+        super().__init__(f"{pdb_path}: {error}")
+        self.pdb_path = pdb_path
+        self.failure_class = classify_failure(error)
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """单个蛋白质 pipeline 的运行参数（可在进程间传递）"""
+    topk: int = 5
+    prank_home: Optional[str] = None
+    enable_cliff_analysis: bool = True
+    p2rank_threads: Optional[int] = None  # 传给 prank 的 -threads，None 表示使用 P2Rank 默认值
+    p2rank_heap_mb: Optional[int] = None  # 每次 prank 启动的 JVM 堆上限（MiB），None 表示使用默认值
+    cache_dir: Optional[str] = None  # 结果缓存目录，None 表示不使用缓存
+    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+    scratch_dir: Optional[str] = None  # fpocket 的临时工作目录，None 表示系统临时目录
+    keep: str = KEEP_ALL  # 中间产物保留策略，见 retention 模块
+    fpocket_timeout: Optional[float] = None  # 单次 fpocket 的超时（秒），None 表示不限制
+    p2rank_timeout: Optional[float] = None  # 每个蛋白质的 P2Rank 超时（秒），批量重打分时按组内蛋白质数累加
+    retry: RetryPolicy = field(default_factory=RetryPolicy)  # 临时性失败的重试策略
+    record_all_pockets: bool = False  # 批处理结果中保留全部重打分口袋（列式口袋表需要），而不只是前 topk 个
+
+
+@dataclass
+class DetectedPockets:
+    """fpocket 检测与去重阶段的中间结果（P2Rank 重打分之前）"""
+    pdb_path: Path
+    work_dir: Path
+    fpocket_dir: Optional[Path]
+    pockets: list
+    pockets_filtered: list
+    cache_key: Optional[str] = None  # 启用缓存时的缓存键
+    spans: list = field(default_factory=list)  # 到目前为止各阶段的耗时（timing.StageSpan）
+
+
+# 影响缓存内容的 pipeline 参数
+CACHE_PARAMS = {
+    "center_distance_threshold": DEFAULT_CENTER_DISTANCE_THRESHOLD,
+    "residue_jaccard_threshold": DEFAULT_RESIDUE_JACCARD_THRESHOLD,
+}
+
+
+@lru_cache(maxsize=None)
+def open_result_cache(cache_dir: Optional[str], cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> Optional[ResultCache]:
+    """每个进程对同一缓存目录只打开一次，缓存总大小只在第一次写入时扫描"""
+    if not cache_dir:
+        return None
+    return ResultCache(cache_dir, max_bytes=cache_max_bytes)
+
+
+def load_cached_pockets(
+    cache: ResultCache, pdb_path: str, workdir: str
+) -> tuple[Optional[tuple[DetectedPockets, list]], str]:
+    """查询缓存；命中时返回 (检测结果, 重打分结果)，未命中时返回 None。同时返回缓存键"""
+    key = cache_key(Path(pdb_path), CACHE_PARAMS)
+    payload = cache.get(key)
+    if payload is None:
+        return None, key
+
+    work_dir = Path(workdir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    detected = DetectedPockets(
+        pdb_path=Path(pdb_path),
+        work_dir=work_dir,
+        fpocket_dir=None,  # 命中缓存时不会生成 fpocket 输出
+        pockets=[Pocket(**r) for r in payload["all_pockets"]],
+        pockets_filtered=[Pocket(**r) for r in payload["filtered_pockets"]],
+        cache_key=key,
+    )
+    rescored = [ScoredPocket(**r) for r in payload["rescored"]]
+    return (detected, rescored), key
+
+
+def store_cached_pockets(cache: ResultCache, detected: DetectedPockets, rescored: list) -> None:
+    key = detected.cache_key or cache_key(detected.pdb_path, CACHE_PARAMS)
+    cache.put(key, {
+        "protein": detected.pdb_path.name,
+        "all_pockets": pockets_to_records(detected.pockets),
+        "filtered_pockets": pockets_to_records(detected.pockets_filtered),
+        "rescored": pockets_to_records(rescored),
+    })
+
+
+def detect_pockets(
     pdb_path: str,
     workdir: str,
-    topk: int,
-    prank_home: Optional[str] = None,
-    return_results: bool = False,
-    enable_cliff_analysis: bool = True,
-) -> Optional[PipelineResult]:
+    quiet: bool = True,
+    scratch_dir: Optional[str] = None,
+    copy_all: bool = True,
+    timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+    spans: Optional[list] = None,
+) -> DetectedPockets:
+    """运行 fpocket 并完成解析与去重；copy_all=False 时只把必要的 fpocket 输出复制到工作目录
+
+    spans 为调用方持有的耗时列表（成为 DetectedPockets.spans）：出错时其中仍保留已执行阶段的耗时，
+    包括出错（如超时被杀死）的那个阶段。
+    """
     work_dir = Path(workdir)
     work_dir.mkdir(parents=True, exist_ok=True)
 
-    if not return_results:
+    if not quiet:
         console.rule("fpocket")
-    fp_out = run_fpocket(pdb_path, work_dir)
-    pockets = read_fpocket_pockets(fp_out)
+    spans = [] if spans is None else spans
+    with stage_span(spans, "fpocket"):
+        fp_out = run_fpocket(
+            pdb_path, work_dir, scratch_dir=scratch_dir, copy_all=copy_all, timeout=timeout, retry=retry
+        )
+    return parse_detected_pockets(pdb_path, work_dir, fp_out, quiet=quiet, spans=spans)
+
 
-    if not return_results:
+def parse_detected_pockets(
+    pdb_path: str, work_dir: Path, fp_out: Path, quiet: bool = True, spans: Optional[list] = None
+) -> DetectedPockets:
+    """解析 fpocket 输出目录并去重；spans 的含义同 detect_pockets"""
+    spans = [] if spans is None else spans
+    with stage_span(spans, "parse"):
+        pockets = read_fpocket_pockets(fp_out)
+
+    if not quiet:
         console.rule("filter & deduplicate")
-    pockets_filtered = deduplicate_pockets(pockets)
+    with stage_span(spans, "dedup"):
+        pockets_filtered = deduplicate_pockets(pockets)
+
+    return DetectedPockets(
+        pdb_path=Path(pdb_path),
+        work_dir=Path(work_dir),
+        fpocket_dir=fp_out,
+        pockets=pockets,
+        pockets_filtered=pockets_filtered,
+        spans=spans,
+    )
 
-    if not return_results:
-        console.rule("P2Rank rescoring")
-    rescored = rescore_with_p2rank(pockets_filtered, Path(pdb_path), work_dir, prank_home)
 
-    if not return_results:
+def finalize_pipeline_result(
+    detected: DetectedPockets,
+    rescored: list,
+    topk: int,
+    enable_cliff_analysis: bool = True,
+    quiet: bool = True,
+) -> PipelineResult:
+    """对重打分结果排序并执行断崖分析"""
+    if not quiet:
         console.rule("final ranking")
-    rescored_sorted = sorted(rescored, key=lambda x: x.score, reverse=True)[:topk]
-    
+    rescored_ranked = sorted(rescored, key=lambda x: x.score, reverse=True)
+    rescored_sorted = rescored_ranked[:topk]
+
     # 执行断崖分析
     cliff_analysis_result = None
     if enable_cliff_analysis and rescored:
-        if not return_results:
+        if not quiet:
             console.rule("断崖分析")
-        
-        protein_id = Path(pdb_path).stem
-        cliff_analysis_result = analyze_cliff_pattern(rescored, protein_id)
-        
-        if not return_results:
+
+        protein_id = structure_stem(detected.pdb_path)
+        with stage_span(detected.spans, "cliff"):
+            cliff_analysis_result = analyze_cliff_pattern(rescored, protein_id)
+
+        if not quiet:
             console.print(f"高置信度口袋数量: {cliff_analysis_result.high_confidence_count}")
             console.print(f"最大分数差: {cliff_analysis_result.max_delta:.4f}")
             console.print(f"是否为Top1主导: {cliff_analysis_result.is_top1_dominant}")
-    
-    if not return_results:
+
+    if not quiet:
         for i, p in enumerate(rescored_sorted, start=1):
             console.print(f"Top {i}: score={p.score:.4f} center=({p.center_x:.2f},{p.center_y:.2f},{p.center_z:.2f})")
-    
-    if return_results:
-        return PipelineResult(
-            top_pockets=rescored_sorted,
-            num_pockets_detected=len(pockets),
-            num_pockets_filtered=len(pockets_filtered),
-            all_pockets=pockets,
-            filtered_pockets=pockets_filtered,
-            cliff_analysis=cliff_analysis_result
+
+    return PipelineResult(
+        top_pockets=rescored_sorted,
+        num_pockets_detected=len(detected.pockets),
+        num_pockets_filtered=len(detected.pockets_filtered),
+        all_pockets=detected.pockets,
+        filtered_pockets=detected.pockets_filtered,
+        cliff_analysis=cliff_analysis_result,
+        stage_spans=list(detected.spans),
+        pdb_path=detected.pdb_path,
+        rescored_pockets=rescored_ranked,
+    )
+
+
+def run_pipeline_with_config(
+    pdb_path: str,
+    workdir: str,
+    config: PipelineConfig,
+    cache: Optional[ResultCache] = None,
+    quiet: bool = True,
+    spans: Optional[list] = None,
+) -> PipelineResult:
+    """按 config 处理单个结构；cache 为已打开的结果缓存（None 表示不使用缓存）
+
+    spans 为调用方持有的耗时列表：处理失败时调用方仍可从中取得已执行阶段（包括出错阶段）的耗时。
+    """
+    cached = None
+    spans = [] if spans is None else spans
+    if cache is not None:
+        with stage_span(spans, "cache"):
+            cached, key = load_cached_pockets(cache, pdb_path, workdir)
+
+    if cached is not None:
+        detected, rescored = cached
+        detected.spans = spans
+        if not quiet:
+            console.print(f"[green]✓ 命中结果缓存，跳过 fpocket 和 P2Rank: {detected.cache_key[:12]}[/green]")
+    else:
+        detected = detect_pockets(
+            pdb_path, workdir, quiet=quiet, scratch_dir=config.scratch_dir,
+            copy_all=copies_all_fpocket_output(config.keep), timeout=config.fpocket_timeout, retry=config.retry,
+            spans=spans,
         )
+        if cache is not None:
+            detected.cache_key = key
+
+        if not quiet:
+            console.rule("P2Rank rescoring")
+        with stage_span(detected.spans, "p2rank"):
+            rescored = rescore_with_p2rank(
+                detected.pockets_filtered, detected.pdb_path, detected.work_dir, config.prank_home,
+                threads=config.p2rank_threads, heap_mb=config.p2rank_heap_mb,
+                timeout=config.p2rank_timeout, retry=config.retry,
+            )
+        if cache is not None:
+            with stage_span(detected.spans, "cache"):
+                store_cached_pockets(cache, detected, rescored)
+
+    result = finalize_pipeline_result(
+        detected, rescored, config.topk, enable_cliff_analysis=config.enable_cliff_analysis, quiet=quiet
+    )
+    apply_retention(detected.work_dir, detected.pdb_path, config.keep)
+    if not quiet:
+        console.print(f"各阶段耗时: {format_stage_totals(stage_totals(spans_to_records(result.stage_spans)))}")
+    return result
+
+
+def run_pipeline(
+    pdb_path: str,
+    workdir: str,
+    topk: int,
+    prank_home: Optional[str] = None,
+    return_results: bool = False,
+    enable_cliff_analysis: bool = True,
+    p2rank_threads: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    scratch_dir: Optional[str] = None,
+    keep: str = KEEP_ALL,
+    p2rank_heap_mb: Optional[int] = None,
+    fpocket_timeout: Optional[float] = None,
+    p2rank_timeout: Optional[float] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> Optional[PipelineResult]:
+    validate_keep(keep)
+    config = PipelineConfig(
+        topk=topk,
+        prank_home=prank_home,
+        enable_cliff_analysis=enable_cliff_analysis,
+        p2rank_threads=p2rank_threads,
+        p2rank_heap_mb=p2rank_heap_mb,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        scratch_dir=scratch_dir,
+        keep=keep,
+        fpocket_timeout=fpocket_timeout,
+        p2rank_timeout=p2rank_timeout,
+        retry=retry or RetryPolicy(),
+    )
+    result = run_pipeline_with_config(
+        pdb_path, workdir, config, cache=open_result_cache(cache_dir, cache_max_bytes), quiet=return_results
+    )
+    if return_results:
+        return result
+
+
+def unique_work_dir_name(pdb_path: Union[str, Path]) -> str:
+    """<结构名>_<绝对路径的短哈希>：不同目录中的同名结构、a.pdb 与 a.cif 得到不同的工作目录"""
+    resolved = str(Path(pdb_path).resolve())
+    digest = hashlib.blake2b(resolved.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{structure_stem(pdb_path)}_{digest}"
+
+
+class PocketPipeline:
+    """可复用的 pipeline 对象，供长期运行的 Python 服务嵌入使用
+
+    构造时解析一次 P2Rank 安装路径、校验配置并打开结果缓存，之后每次调用只处理结构本身；
+    不打印进度，也不写汇总 CSV。run() 的中间文件默认写在 workdir/<结构名> 下，run_many() 的写在
+    workdir/<结构名>_<路径哈希> 下（见 unique_work_dir_name），按 config.keep 清理。
+
+    用法:
+        pipeline = PocketPipeline(PipelineConfig(topk=3, cache_dir="~/.cache/pp"), workdir="runs")
+        result = pipeline.run("1abc.pdb")
+        for result in pipeline.run_many(paths, concurrency=4):
+            ...
+    """
+
+    def __init__(self, config: Optional[PipelineConfig] = None, workdir: Union[str, Path] = "runs"):
+        config = config or PipelineConfig()
+        validate_keep(config.keep)
+        self.config = replace(config, prank_home=str(resolve_p2rank_home(config.prank_home)))
+        self.workdir = Path(workdir)
+        self._cache = open_result_cache(config.cache_dir, config.cache_max_bytes)
+
+    def work_dir_for(self, pdb_path: Union[str, Path]) -> Path:
+        return self.workdir / structure_stem(Path(pdb_path))
+
+    def unique_work_dir_for(self, pdb_path: Union[str, Path]) -> Path:
+        return self.workdir / unique_work_dir_name(pdb_path)
+
+    def run(self, pdb_path: Union[str, Path], work_dir: Optional[Union[str, Path]] = None) -> PipelineResult:
+        """处理单个结构；失败时直接抛出原始异常
+
+        同名（不同目录）的结构默认使用同一个工作目录，并发处理它们时需要通过 work_dir 区分。
+        """
+        work_dir = work_dir or self.work_dir_for(pdb_path)
+        return run_pipeline_with_config(str(pdb_path), str(work_dir), self.config, cache=self._cache)
 
+    def run_many(
+        self,
+        pdb_paths: Iterable[Union[str, Path]],
+        concurrency: int = 4,
+        return_exceptions: bool = False,
+    ) -> Iterator[Union[PipelineResult, PipelineError]]:
+        """并发处理多个结构，按完成顺序逐个产出 PipelineResult（result.pdb_path 标明对应的输入）
 
+        pdb_paths 按需读取，同时处理的结构不超过 concurrency 个，可以传入很长的生成器。
+        每个输入使用按其绝对路径区分的工作目录（unique_work_dir_for），同名结构并发处理时互不覆盖。
+        某个结构失败时抛出 PipelineError（已在处理中的结构会先完成）；return_exceptions=True 时
+        改为把 PipelineError 作为结果产出并继续处理。调用方提前停止迭代时不再启动新的结构。
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于等于 1")
+        paths = iter(pdb_paths)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pocket-pipeline")
+        running = {}
+        try:
+            while True:
+                for pdb_path in paths:
+                    running[executor.submit(self.run, pdb_path, self.unique_work_dir_for(pdb_path))] = Path(pdb_path)
+                    if len(running) >= concurrency:
+                        break
+                if not running:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pdb_path = running.pop(future)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        error = PipelineError(pdb_path, e)
+                        error.__cause__ = e
+                        if not return_exceptions:
+                            raise error
+                        yield error
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
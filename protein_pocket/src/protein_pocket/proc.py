@@ -0,0 +1,117 @@
+"""
+外部进程管理模块 - 带超时的子进程调用、失败分类与有限次重试
+
+fpocket 和 prank 都在独立的会话（进程组）中启动，超时或被中断时杀死整个进程组：
+prank 是启动 JVM 的 shell 脚本，只杀死脚本本身会留下仍在运行的 java 进程。
+"""
+from __future__ import annotations
+
+import errno
+import os
+import signal
+import subprocess
+import time
+from concurrent.futures import BrokenExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence, TypeVar
+
+# BatchResult.failure_class 的取值
+FAILURE_TIMEOUT = "timeout"  # 超过阶段超时被杀死
+FAILURE_TRANSIENT = "transient"  # 进程被信号杀死、JVM 崩溃、系统资源暂时不足等，重试可能成功
+FAILURE_TOOL = "tool_error"  # 外部工具正常退出但返回错误，或没有产生预期的输出
+FAILURE_INPUT = "input_error"  # 输入文件无法读取或解析
+FAILURE_INTERNAL = "internal_error"  # 其他异常
+
+# shell 包装脚本把子进程被信号杀死报告为 128 + 信号值：SIGABRT（JVM 崩溃）、SIGKILL（OOM killer）、SIGSEGV
+_TRANSIENT_EXIT_CODES = {128 + signal.SIGABRT, 128 + signal.SIGKILL, 128 + signal.SIGSEGV}
+_TRANSIENT_ERRNOS = {errno.EAGAIN, errno.ENOMEM, errno.EMFILE, errno.ENFILE}
+
+T = TypeVar("T")
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    try:
+        if hasattr(os, "killpg"):
+            # start_new_session=True 时子进程是新进程组的组长，组 ID 等于其 PID
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def run_command(
+    cmd: Sequence[str],
+    timeout: Optional[float] = None,
+    capture_output: bool = False,
+    cwd: Optional[str | os.PathLike] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> subprocess.CompletedProcess:
+    """与 subprocess.run(check=True, text=True) 相同，但超时或被中断时杀死子进程所在的整个进程组
+
+    超时抛出 subprocess.TimeoutExpired，非零退出码抛出 subprocess.CalledProcessError。
+    """
+    pipe = subprocess.PIPE if capture_output else None
+    proc = subprocess.Popen(
+        list(cmd), stdout=pipe, stderr=pipe, text=True, cwd=cwd, env=env, start_new_session=True
+    )
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(proc)
+        stdout, stderr = proc.communicate()
+        raise subprocess.TimeoutExpired(proc.args, timeout, output=stdout, stderr=stderr) from None
+    except BaseException:
+        _kill_process_group(proc)
+        proc.wait()
+        raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+
+
+def classify_failure(error: BaseException) -> str:
+    """把处理蛋白质时的异常归为 FAILURE_* 之一"""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return FAILURE_TIMEOUT
+    if isinstance(error, subprocess.CalledProcessError):
+        if error.returncode < 0 or error.returncode in _TRANSIENT_EXIT_CODES:
+            return FAILURE_TRANSIENT
+        return FAILURE_TOOL
+    if isinstance(error, BrokenExecutor):
+        # 工作进程被杀死（通常是 OOM killer）
+        return FAILURE_TRANSIENT
+    if isinstance(error, FileNotFoundError):
+        return FAILURE_TOOL
+    if isinstance(error, OSError) and error.errno in _TRANSIENT_ERRNOS:
+        return FAILURE_TRANSIENT
+    if isinstance(error, (ValueError, EOFError, UnicodeDecodeError, OSError)):
+        # gzip.BadGzipFile 是 OSError 的子类
+        return FAILURE_INPUT
+    return FAILURE_INTERNAL
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """临时性失败（FAILURE_TRANSIENT）的重试策略；超时和其他失败不重试"""
+    max_retries: int = 0
+    backoff: float = 5.0  # 第 n 次重试前等待 backoff * 2^(n-1) 秒
+    max_backoff: float = 300.0
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+
+def call_with_retries(fn: Callable[[], T], retry: Optional[RetryPolicy], what: str) -> T:
+    """调用 fn，遇到临时性失败时按 retry 退避后重试"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if retry is None or attempt >= retry.max_retries or classify_failure(e) != FAILURE_TRANSIENT:
+                raise
+            delay = retry.delay(attempt)
+            attempt += 1
+            print(f"{what} 临时性失败（{e}），{delay:.1f} 秒后重试 ({attempt}/{retry.max_retries})")
+            time.sleep(delay)
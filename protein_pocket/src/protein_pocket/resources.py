@@ -0,0 +1,144 @@
+"""
+资源估算模块 - 内存预算与 CPU 核分配
+
+内存：根据原子数估算每个蛋白质的内存占用，并按内存预算控制同时处理的蛋白质数量。
+估算是保守的经验值：fpocket 的内存随原子数线性增长；P2Rank 的 JVM 在设置了堆上限时
+最多占用 堆上限 + JVM 自身开销，未设置时按原子数估算实际需要的堆。
+
+CPU：把总核数预算分给各个 worker，并可按 CPU 拓扑把 worker 绑定到互不相交的核集合。
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from .fpocket import open_structure
+
+# 以下常量单位均为 MiB
+FPOCKET_BASE_MB = 50
+FPOCKET_MB_PER_KATOM = 4.0
+JVM_OVERHEAD_MB = 300  # 元空间、代码缓存、线程栈等堆外内存
+P2RANK_BASE_HEAP_MB = 512  # 模型加载后的常驻堆
+P2RANK_HEAP_MB_PER_KATOM = 20.0
+
+_ATOM_RECORDS = (b"ATOM", b"HETATM")
+
+
+def count_atoms(path: str | Path) -> int:
+    """流式统计结构文件中的原子数
+
+    PDB 统计 ATOM/HETATM 记录；mmCIF 的 _atom_site 数据行同样以 ATOM/HETATM 开头。
+    支持 .gz 压缩文件，不把整个文件读入内存。
+    """
+    with open_structure(Path(path)) as f:
+        return sum(1 for line in f if line.startswith(_ATOM_RECORDS))
+
+
+def estimate_fpocket_mb(atoms: int) -> float:
+    return FPOCKET_BASE_MB + FPOCKET_MB_PER_KATOM * atoms / 1000
+
+
+def estimate_p2rank_mb(atoms: Sequence[int], heap_mb: Optional[int] = None) -> float:
+    """一次 prank 启动（为 atoms 中的所有蛋白质重打分）的内存估算"""
+    if heap_mb:
+        return JVM_OVERHEAD_MB + heap_mb
+    # P2Rank 逐个处理数据集中的蛋白质，堆需求取决于最大的那个
+    return JVM_OVERHEAD_MB + P2RANK_BASE_HEAP_MB + P2RANK_HEAP_MB_PER_KATOM * max(atoms, default=0) / 1000
+
+
+def estimate_task_mb(atoms: Sequence[int], heap_mb: Optional[int] = None) -> float:
+    """一个批处理任务（一个蛋白质或共享一次 P2Rank 启动的一组蛋白质）的峰值内存估算
+
+    同一任务中 fpocket 与 P2Rank 依次运行，峰值取两者中较大的一个。
+    """
+    fpocket_mb = max((estimate_fpocket_mb(a) for a in atoms), default=0.0)
+    return max(fpocket_mb, estimate_p2rank_mb(atoms, heap_mb))
+
+
+class MemoryBudget:
+    """线程安全的内存预算：任务开始前预留估算的内存，结束后归还
+
+    预算为空闲状态时总是允许一个任务进入，即使它的估算超过整个预算，
+    保证超大的蛋白质也能（单独）运行而不是永远等待。
+    """
+
+    def __init__(self, total_mb: float):
+        self.total_mb = total_mb
+        self.used_mb = 0.0
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def fits(self, mb: float) -> bool:
+        with self._cond:
+            return self.active == 0 or self.used_mb + mb <= self.total_mb
+
+    def try_acquire(self, mb: float) -> bool:
+        with self._cond:
+            if self.active and self.used_mb + mb > self.total_mb:
+                return False
+            self.used_mb += mb
+            self.active += 1
+            return True
+
+    def acquire(self, mb: float, stop: Optional[threading.Event] = None, poll: float = 0.5) -> bool:
+        """阻塞直到预算足够；stop 被设置时放弃并返回 False"""
+        with self._cond:
+            while self.active and self.used_mb + mb > self.total_mb:
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(poll)
+            self.used_mb += mb
+            self.active += 1
+            return True
+
+    def release(self, mb: float) -> None:
+        with self._cond:
+            self.used_mb = max(0.0, self.used_mb - mb)
+            self.active -= 1
+            self._cond.notify_all()
+
+
+def available_cpus() -> List[int]:
+    """当前进程允许使用的 CPU 编号（已考虑 taskset / cgroup cpuset 的限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _cpu_topology_key(cpu: int) -> tuple:
+    topology = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology")
+    try:
+        package = int((topology / "physical_package_id").read_text())
+        core = int((topology / "core_id").read_text())
+    except (OSError, ValueError):
+        return (0, cpu, cpu)
+    return (package, core, cpu)
+
+
+def topology_order(cpus: Sequence[int]) -> List[int]:
+    """按 (插槽, 物理核, 编号) 排序，使同一物理核的超线程和同一插槽的核相邻
+
+    按此顺序连续切分出的核集合尽量不跨插槽，也尽量不让两个 worker 共享同一个物理核。
+    读取不到 sysfs 拓扑信息（非 Linux）时保持编号顺序。
+    """
+    return sorted(cpus, key=_cpu_topology_key)
+
+
+def split_cpus(cpus: Sequence[int], sizes: Sequence[int]) -> Optional[List[List[int]]]:
+    """按 sizes 把 cpus（按拓扑排序后）连续切分为互不相交的集合；核数不够时返回 None"""
+    if sum(sizes) > len(cpus):
+        return None
+    ordered = topology_order(cpus)
+    sets, start = [], 0
+    for size in sizes:
+        sets.append(ordered[start:start + size])
+        start += size
+    return sets
+
+
+def pin_to_cpus(cpus: Optional[Sequence[int]]) -> None:
+    """把调用线程（及其之后启动的子进程）绑定到 cpus；平台不支持时忽略"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
@@ -0,0 +1,69 @@
+"""
+中间产物保留策略 - 控制每个蛋白质在工作目录中留下哪些 fpocket / P2Rank 文件
+
+- all: 保留 fpocket 与 P2Rank 的全部输出（默认，与之前的行为一致）
+- essential: 只保留口袋信息、口袋原子、口袋结构文件和 P2Rank 预测 CSV
+- summary: 删除 fpocket 与 P2Rank 输出，只保留每个蛋白质的详细结果 CSV
+- none: 不保留任何逐蛋白质文件，批量模式下只有汇总 CSV 和进度日志
+"""
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+from .fpocket import structure_stem
+
+KEEP_ALL = "all"
+KEEP_ESSENTIAL = "essential"
+KEEP_SUMMARY = "summary"
+KEEP_NONE = "none"
+KEEP_POLICIES = (KEEP_NONE, KEEP_SUMMARY, KEEP_ESSENTIAL, KEEP_ALL)
+
+
+def validate_keep(keep: str) -> str:
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f"未知的保留策略 {keep}（可选: {', '.join(KEEP_POLICIES)}）")
+    return keep
+
+
+def copies_all_fpocket_output(keep: str) -> bool:
+    """是否把 fpocket 的全部输出复制到工作目录；其他策略只复制后续步骤需要的文件"""
+    return keep == KEEP_ALL
+
+
+def keeps_detailed_results(keep: str) -> bool:
+    """是否写入每个蛋白质的详细结果 CSV"""
+    return keep != KEEP_NONE
+
+
+def _is_essential_p2rank_artifact(path: Path, name: str) -> bool:
+    return path.name in (f"{name}_predictions.csv", f"{name}_residues.csv")
+
+
+def apply_retention(work_dir: Path, pdb_path: Path, keep: str) -> None:
+    """fpocket 输出与 P2Rank 预测都已读取后，按保留策略清理该蛋白质的中间产物"""
+    if keep == KEEP_ALL:
+        return
+
+    fpocket_dir = work_dir / f"{structure_stem(pdb_path)}_fpocket"
+    p2rank_dir = work_dir / "p2rank_out"
+    if keep == KEEP_ESSENTIAL:
+        # fpocket 输出在复制时已经只保留了必要文件，这里只需精简 P2Rank 输出
+        if p2rank_dir.exists():
+            for produced in sorted(p2rank_dir.rglob("*"), reverse=True):
+                if produced.is_file() and not _is_essential_p2rank_artifact(produced, pdb_path.name):
+                    produced.unlink()
+                elif produced.is_dir() and not any(produced.iterdir()):
+                    produced.rmdir()
+        return
+
+    shutil.rmtree(fpocket_dir, ignore_errors=True)
+    shutil.rmtree(p2rank_dir, ignore_errors=True)
+
+
+def remove_if_empty(directory: Path) -> None:
+    """删除空目录；目录不存在或非空时什么也不做"""
+    try:
+        directory.rmdir()
+    except OSError:
+        pass
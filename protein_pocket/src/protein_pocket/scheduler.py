@@ -0,0 +1,328 @@
+"""
+分阶段流水线调度模块 - fpocket、解析去重、P2Rank 三个阶段各自独立并发，通过有界队列衔接
+
+每个工作进程串行执行 fpocket -> 解析 -> P2Rank 时，CPU 在单线程的 fpocket 和多线程、
+占内存的 JVM 之间来回切换。流水线调度让蛋白质 N+1 的 fpocket 与蛋白质 N 的 P2Rank 同时运行。
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from .batch import BatchResult, _failed_batch_result, _protein_result_dir, _success_batch_result
+from .fpocket import run_fpocket, structure_stem
+from .p2rank import RescoreJob, rescore_batch_with_p2rank, rescore_with_p2rank
+from .resources import MemoryBudget, pin_to_cpus
+from .retention import apply_retention, copies_all_fpocket_output
+from .timing import stage_span
+from .pipeline import (
+    DetectedPockets,
+    PipelineConfig,
+    finalize_pipeline_result,
+    load_cached_pockets,
+    open_result_cache,
+    parse_detected_pockets,
+    store_cached_pockets,
+)
+
+# 阶段结束标记
+_DONE = object()
+
+
+@dataclass
+class _StageItem:
+    """在阶段之间传递的单个蛋白质"""
+    protein_path: Path
+    result_subdir: Optional[Path] = None
+    fpocket_dir: Optional[Path] = None
+    detected: Optional[DetectedPockets] = None
+    cache_key: Optional[str] = None
+    elapsed: float = 0.0  # 各阶段实际处理耗时之和（不含排队等待）
+    spans: list = field(default_factory=list)  # 进入解析阶段之前的各阶段耗时（timing.StageSpan）
+
+
+@dataclass
+class StageConfig:
+    """各阶段的并发度与队列容量"""
+    fpocket_workers: int = 4
+    parse_workers: int = 1
+    p2rank_workers: int = 2
+    queue_size: int = 16
+    p2rank_chunk_size: int = 1
+    # 每个 fpocket / P2Rank 线程绑定的核集合（resources.split_cpus 的结果），None 表示不绑定
+    fpocket_cpus: Optional[List[List[int]]] = None
+    p2rank_cpus: Optional[List[List[int]]] = None
+
+
+class StagedScheduler:
+    """三阶段流水线调度器
+
+    - fpocket 阶段：fpocket_workers 个线程，每个线程同时运行一个 fpocket 子进程
+    - 解析/去重阶段：parse_workers 个进程的进程池（纯 Python 计算，不受 GIL 限制）
+    - P2Rank 阶段：p2rank_workers 个线程，每个线程运行一个 prank；
+      p2rank_chunk_size > 1 时从队列中取出最多该数量的蛋白质合并为一次 prank 启动
+
+    阶段之间是容量为 queue_size 的有界队列：下游跟不上时上游会阻塞，中间结果不会无限堆积。
+
+    指定 budget 时，蛋白质进入 fpocket 阶段前按 protein_mb 中的估算预留内存，产出结果后归还。
+    """
+
+    def __init__(
+        self,
+        input_dir: Path,
+        results_dir: Path,
+        config: PipelineConfig,
+        stages: StageConfig,
+        budget: Optional[MemoryBudget] = None,
+        protein_mb: Optional[Dict[Path, float]] = None,
+    ):
+        self.input_dir = input_dir
+        self.results_dir = results_dir
+        self.config = config
+        self.stages = stages
+        self.budget = budget
+        self.protein_mb = protein_mb or {}
+        self._stop = threading.Event()
+        self._cache = open_result_cache(config.cache_dir, config.cache_max_bytes)
+
+    def run(self, protein_paths: Iterable[Path]) -> Iterator[BatchResult]:
+        """按完成顺序逐个产出 BatchResult"""
+        stages = self.stages
+        fpocket_queue: queue.Queue = queue.Queue(maxsize=stages.queue_size)
+        parse_queue: queue.Queue = queue.Queue(maxsize=stages.queue_size)
+        p2rank_queue: queue.Queue = queue.Queue(maxsize=stages.queue_size)
+        results_queue: queue.Queue = queue.Queue()
+
+        # 调度线程已经在运行，使用 spawn 启动解析进程，避免在多线程进程中 fork
+        parse_pool = ProcessPoolExecutor(max_workers=stages.parse_workers, mp_context=mp.get_context("spawn"))
+        threads: List[threading.Thread] = []
+
+        reserved: Dict[str, float] = {}
+
+        def feed() -> None:
+            for protein_path in protein_paths:
+                if self.budget is not None:
+                    mb = self.protein_mb.get(protein_path, 0.0)
+                    if not self.budget.acquire(mb, self._stop):
+                        break
+                    reserved[str(protein_path)] = mb
+                if not self._put(fpocket_queue, _StageItem(protein_path=protein_path)):
+                    break
+            for _ in range(stages.fpocket_workers):
+                fpocket_queue.put(_DONE)
+
+        threads.append(threading.Thread(target=feed, name="stage-feed", daemon=True))
+        threads += self._start_stage(
+            "fpocket", stages.fpocket_workers, fpocket_queue, parse_queue, stages.parse_workers,
+            lambda item: self._fpocket_stage(item, parse_queue, results_queue),
+            cpu_sets=stages.fpocket_cpus,
+        )
+        threads += self._start_stage(
+            "parse", stages.parse_workers, parse_queue, p2rank_queue, stages.p2rank_workers,
+            lambda item: self._parse_stage(item, parse_pool, p2rank_queue, results_queue),
+        )
+        threads += self._start_stage(
+            "p2rank", stages.p2rank_workers, p2rank_queue, results_queue, 1,
+            lambda first: self._p2rank_stage(first, p2rank_queue, results_queue),
+            cpu_sets=stages.p2rank_cpus,
+        )
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = results_queue.get()
+                if item is _DONE:
+                    break
+                if item.protein_path in reserved:
+                    self.budget.release(reserved.pop(item.protein_path))
+                yield item
+        finally:
+            self._stop.set()
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """带取消检查的阻塞写入"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _start_stage(
+        self,
+        name: str,
+        workers: int,
+        in_queue: queue.Queue,
+        out_queue: queue.Queue,
+        downstream_workers: int,
+        handler: Callable[[_StageItem], None],
+        cpu_sets: Optional[List[List[int]]] = None,
+    ) -> List[threading.Thread]:
+        """启动一个阶段的工作线程；最后一个退出的线程向下游发送结束标记
+
+        指定 cpu_sets 时第 i 个线程绑定到 cpu_sets[i]（Linux 上 CPU 亲和性按线程设置，
+        线程启动的 fpocket / prank 子进程会继承）。
+        """
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def loop(index: int) -> None:
+            if cpu_sets:
+                pin_to_cpus(cpu_sets[index])
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    break
+                if self._stop.is_set():
+                    continue
+                handler(item)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(downstream_workers):
+                    out_queue.put(_DONE)
+
+        return [
+            threading.Thread(target=loop, args=(i,), name=f"stage-{name}-{i}", daemon=True) for i in range(workers)
+        ]
+
+    def _fail(self, item: _StageItem, error: Exception, started: float, results_queue: queue.Queue) -> None:
+        item.elapsed += time.time() - started
+        # 解析完成后耗时记录在 detected.spans 中，之前在 item.spans 中
+        spans = item.detected.spans if item.detected is not None else item.spans
+        results_queue.put(_failed_batch_result(
+            structure_stem(item.protein_path), item.protein_path, error, item.elapsed, spans
+        ))
+
+    def _fpocket_stage(self, item: _StageItem, parse_queue: queue.Queue, results_queue: queue.Queue) -> None:
+        started = time.time()
+        try:
+            item.result_subdir = _protein_result_dir(item.protein_path, self.input_dir, self.results_dir)
+            if self._cache is not None:
+                with stage_span(item.spans, "cache"):
+                    cached, item.cache_key = load_cached_pockets(
+                        self._cache, str(item.protein_path), str(item.result_subdir)
+                    )
+                if cached is not None:
+                    # 命中缓存：直接完成，不进入后续阶段
+                    detected, rescored = cached
+                    detected.spans = item.spans
+                    self._finish(item, detected, rescored, started, results_queue, store=False)
+                    return
+            with stage_span(item.spans, "fpocket"):
+                item.fpocket_dir = run_fpocket(
+                    item.protein_path, item.result_subdir,
+                    scratch_dir=self.config.scratch_dir, copy_all=copies_all_fpocket_output(self.config.keep),
+                    timeout=self.config.fpocket_timeout, retry=self.config.retry,
+                )
+        except Exception as e:
+            self._fail(item, e, started, results_queue)
+            return
+        item.elapsed += time.time() - started
+        self._put(parse_queue, item)
+
+    def _parse_stage(
+        self, item: _StageItem, parse_pool: ProcessPoolExecutor, p2rank_queue: queue.Queue, results_queue: queue.Queue
+    ) -> None:
+        started = time.time()
+        try:
+            item.detected = parse_pool.submit(
+                parse_detected_pockets, str(item.protein_path), item.result_subdir, item.fpocket_dir
+            ).result()
+            item.detected.cache_key = item.cache_key
+            item.detected.spans = item.spans + item.detected.spans
+        except Exception as e:
+            self._fail(item, e, started, results_queue)
+            return
+        item.elapsed += time.time() - started
+        self._put(p2rank_queue, item)
+
+    def _p2rank_stage(self, first: _StageItem, p2rank_queue: queue.Queue, results_queue: queue.Queue) -> None:
+        # 合并队列中已经就绪的蛋白质，凑成一次 prank 启动
+        items = [first]
+        while len(items) < self.stages.p2rank_chunk_size:
+            try:
+                item = p2rank_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                # 结束标记放回去，由本线程的主循环处理
+                p2rank_queue.put(_DONE)
+                break
+            items.append(item)
+
+        started = time.time()
+        launch_spans: list = []
+        if len(items) == 1:
+            try:
+                with stage_span(launch_spans, "p2rank"):
+                    outcomes = [rescore_with_p2rank(
+                        items[0].detected.pockets_filtered,
+                        items[0].detected.pdb_path,
+                        items[0].detected.work_dir,
+                        self.config.prank_home,
+                        threads=self.config.p2rank_threads,
+                        heap_mb=self.config.p2rank_heap_mb,
+                        timeout=self.config.p2rank_timeout,
+                        retry=self.config.retry,
+                    )]
+            except Exception as e:
+                outcomes = [e]
+        else:
+            jobs = [RescoreJob(pdb_path=i.detected.pdb_path, work_dir=i.detected.work_dir) for i in items]
+            chunk_out_dir = self.results_dir / ".p2rank_chunks" / f"{threading.current_thread().name}_{time.time_ns()}"
+            try:
+                with stage_span(launch_spans, "p2rank", shared_with=len(items)):
+                    outcomes = rescore_batch_with_p2rank(
+                        jobs, chunk_out_dir, self.config.prank_home,
+                        threads=self.config.p2rank_threads, heap_mb=self.config.p2rank_heap_mb,
+                        timeout=self.config.p2rank_timeout, retry=self.config.retry,
+                    )
+            except Exception as e:
+                outcomes = [e] * len(items)
+        # P2Rank 的耗时由同一次启动中的蛋白质平均分摊
+        rescore_share = (time.time() - started) / len(items)
+
+        for item, outcome in zip(items, outcomes):
+            item.elapsed += rescore_share
+            item.detected.spans.extend(launch_spans)
+            if isinstance(outcome, Exception):
+                self._fail(item, outcome, time.time(), results_queue)
+            else:
+                self._finish(item, item.detected, outcome, time.time(), results_queue, store=True)
+
+    def _finish(
+        self,
+        item: _StageItem,
+        detected: DetectedPockets,
+        rescored: list,
+        started: float,
+        results_queue: queue.Queue,
+        store: bool,
+    ) -> None:
+        """排序、断崖分析并保存该蛋白质的详细结果"""
+        try:
+            if store and self._cache is not None:
+                with stage_span(detected.spans, "cache"):
+                    store_cached_pockets(self._cache, detected, rescored)
+            result = finalize_pipeline_result(
+                detected, rescored, self.config.topk, enable_cliff_analysis=self.config.enable_cliff_analysis
+            )
+            apply_retention(detected.work_dir, detected.pdb_path, self.config.keep)
+            item.elapsed += time.time() - started
+            results_queue.put(_success_batch_result(
+                structure_stem(item.protein_path), item.protein_path, result, item.result_subdir, item.elapsed,
+                keep=self.config.keep, record_all_pockets=self.config.record_all_pockets,
+            ))
+        except Exception as e:
+            self._fail(item, e, started, results_queue)
@@ -0,0 +1,401 @@
+"""
+本地口袋检测服务 - `protein-pocket serve` 的 HTTP 任务接口
+
+服务进程启动时解析一次 P2Rank 路径、打开结果缓存，之后由常驻的 asyncio 事件循环（aio.AsyncPocketPipeline）
+处理所有任务，调用方不再为每个结构承担 Python 启动和工具解析的开销。
+
+接口（JSON）：
+    POST /jobs                      {"path": "/abs/1abc.pdb"} 提交服务器本地的结构文件；
+                                    或以 application/octet-stream 上传结构内容，文件名放在 ?name=1abc.pdb
+    GET  /jobs/<id>                 任务状态
+    GET  /jobs/<id>/result[?wait=s] 任务结果；未完成时返回 202，wait 指定最多等待的秒数
+    GET  /health                    队列与工作线程状态
+
+排队的任务数达到 queue_size 时新提交返回 429（带 Retry-After），由调用方退避重试。
+结构内容（gzip 压缩的按解压后内容）相同的任务在排队或运行期间合并为一个：后来的提交直接返回已有任务的 ID。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from rich.console import Console
+
+from .aio import AsyncPocketPipeline
+from .cache import structure_digest
+from .pipeline import PipelineConfig, PipelineResult
+from .proc import classify_failure
+from .timing import spans_to_records, stage_totals
+
+console = Console()
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+MAX_UPLOAD_BYTES = 512 * 1024 ** 2
+MAX_RESULT_WAIT = 300.0  # 秒，GET /jobs/<id>/result?wait= 的上限
+STRUCTURE_SUFFIXES = (".pdb", ".cif", ".ent", ".mmcif")
+
+
+class QueueFull(Exception):
+    """排队的任务数已达上限"""
+
+
+def _discard_upload(pdb_path: Path) -> None:
+    # 每个上传文件单独放在一个目录中
+    shutil.rmtree(pdb_path.parent, ignore_errors=True)
+
+
+@dataclass
+class Job:
+    job_id: str
+    digest: str
+    pdb_path: Path
+    name: str
+    upload: bool = False  # pdb_path 是服务保存的上传文件，任务结束后删除
+    status: str = STATUS_QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    submissions: int = 1  # 合并到该任务的提交次数
+    error: Optional[str] = None
+    failure_class: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def status_record(self) -> Dict[str, Any]:
+        record = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "name": self.name,
+            "digest": self.digest,
+            "submissions": self.submissions,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == STATUS_FAILED:
+            record["error"] = self.error
+            record["failure_class"] = self.failure_class
+        return record
+
+
+def result_to_record(result: PipelineResult) -> Dict[str, Any]:
+    """PipelineResult 的 JSON 表示"""
+    spans = spans_to_records(result.stage_spans)
+    return {
+        "top_pockets": [asdict(p) for p in result.top_pockets],
+        "num_pockets_detected": result.num_pockets_detected,
+        "num_pockets_filtered": result.num_pockets_filtered,
+        "cliff_analysis": asdict(result.cliff_analysis) if result.cliff_analysis else None,
+        "stage_times": stage_totals(spans),
+    }
+
+
+class JobManager:
+    """任务表、有界队列与按内容合并
+
+    HTTP 处理线程调用 submit / get；任务在 start() 启动的事件循环线程中由 workers 个协程处理。
+    已结束的任务最多保留 max_finished 个，超出时丢弃最早结束的任务。
+    """
+
+    def __init__(
+        self,
+        pipeline: AsyncPocketPipeline,
+        work_root: Path,
+        workers: int,
+        queue_size: int,
+        max_finished: int = 1000,
+    ):
+        self.pipeline = pipeline
+        self.work_root = work_root
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_finished = max_finished
+        self.jobs: Dict[str, Job] = {}
+        self._inflight: Dict[str, Job] = {}  # 排队或运行中的任务，按结构内容摘要索引
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),), name="job-loop", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stop = asyncio.Event()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._ready.set()
+        await self._stop.wait()
+        # 取消运行中的任务会杀死其 fpocket / prank 进程组
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def stop(self) -> None:
+        if self._loop is not None and self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                job.status = STATUS_RUNNING
+                job.started_at = time.time()
+            work_dir = self.work_root / job.job_id
+            try:
+                result = await self.pipeline.run(job.pdb_path, work_dir=work_dir)
+                self._finish(job, result=result_to_record(result))
+            except asyncio.CancelledError:
+                self._finish(job, error=RuntimeError("服务已停止"))
+                raise
+            except Exception as e:
+                self._finish(job, error=e)
+            finally:
+                await asyncio.to_thread(shutil.rmtree, work_dir, True)
+                if job.upload:
+                    await asyncio.to_thread(_discard_upload, job.pdb_path)
+
+    def _finish(self, job: Job, result: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._running -= 1
+            job.finished_at = time.time()
+            if error is None:
+                job.status = STATUS_SUCCEEDED
+                job.result = result
+            else:
+                job.status = STATUS_FAILED
+                job.error = str(error)
+                job.failure_class = classify_failure(error)
+            if self._inflight.get(job.digest) is job:
+                del self._inflight[job.digest]
+            self._finished[job.job_id] = None
+            while len(self._finished) > self.max_finished:
+                expired, _ = self._finished.popitem(last=False)
+                self.jobs.pop(expired, None)
+        job.done.set()
+
+    def submit(self, pdb_path: Path, name: str, digest: str, upload: bool = False) -> Tuple[Job, bool]:
+        """提交任务；内容相同的任务正在排队或运行时返回 (已有任务, True)
+
+        队列已满时抛出 QueueFull。
+        """
+        with self._lock:
+            existing = self._inflight.get(digest)
+            if existing is not None:
+                existing.submissions += 1
+                return existing, True
+            if self._queued >= self.queue_size:
+                raise QueueFull(f"排队的任务已达上限 ({self.queue_size})")
+            job = Job(job_id=uuid.uuid4().hex[:16], digest=digest, pdb_path=pdb_path, name=name, upload=upload)
+            self.jobs[job.job_id] = job
+            self._inflight[digest] = job
+            self._queued += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": "ok",
+                "workers": self.workers,
+                "queued": self._queued,
+                "running": self._running,
+                "queue_size": self.queue_size,
+                "jobs": len(self.jobs),
+            }
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP 接口；manager 与 upload_dir 由 serve() 在子类上设置"""
+    server_version = "protein-pocket"
+    manager: JobManager
+    upload_dir: Path
+    retry_after: int = 5
+
+    def log_message(self, format: str, *args) -> None:
+        console.log(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"error": message}, headers)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["health"]:
+            self._send_json(HTTPStatus.OK, self.manager.health())
+            return
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or (len(parts) == 3 and parts[2] != "result"):
+            self._error(HTTPStatus.NOT_FOUND, f"未知的路径: {url.path}")
+            return
+        job = self.manager.get(parts[1])
+        if job is None:
+            self._error(HTTPStatus.NOT_FOUND, f"任务不存在或已过期: {parts[1]}")
+            return
+        if len(parts) == 2:
+            self._send_json(HTTPStatus.OK, job.status_record())
+            return
+
+        try:
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            self._error(HTTPStatus.BAD_REQUEST, "wait 必须是秒数")
+            return
+        if wait > 0:
+            job.done.wait(min(wait, MAX_RESULT_WAIT))
+        if job.status == STATUS_SUCCEEDED:
+            self._send_json(HTTPStatus.OK, {**job.status_record(), "result": job.result})
+        elif job.status == STATUS_FAILED:
+            self._send_json(HTTPStatus.UNPROCESSABLE_ENTITY, job.status_record())
+        else:
+            self._send_json(HTTPStatus.ACCEPTED, job.status_record())
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._error(HTTPStatus.NOT_FOUND, f"未知的路径: {url.path}")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_UPLOAD_BYTES:
+            self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"请求体必须在 0 到 {MAX_UPLOAD_BYTES} 字节之间")
+            return
+
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        try:
+            if content_type == "application/octet-stream":
+                name = parse_qs(url.query).get("name", [""])[0]
+                pdb_path, upload = self._save_upload(name, length), True
+            else:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                pdb_path, upload = Path(request["path"]).expanduser().resolve(), False
+                if not pdb_path.is_file():
+                    raise FileNotFoundError(f"结构文件不存在: {pdb_path}")
+                name = pdb_path.name
+            digest = structure_digest(pdb_path)
+        except (ValueError, KeyError, TypeError) as e:
+            self._error(HTTPStatus.BAD_REQUEST, f"无效的请求: {e}")
+            return
+        except OSError as e:
+            # 包括 gzip.BadGzipFile
+            self._error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        try:
+            job, coalesced = self.manager.submit(pdb_path, name, digest, upload=upload)
+        except QueueFull as e:
+            if upload:
+                _discard_upload(pdb_path)
+            self._error(HTTPStatus.TOO_MANY_REQUESTS, str(e), {"Retry-After": str(self.retry_after)})
+            return
+        if coalesced and upload:
+            _discard_upload(pdb_path)
+        self._send_json(
+            HTTPStatus.OK if coalesced else HTTPStatus.ACCEPTED,
+            {**job.status_record(), "coalesced": coalesced},
+            {"Location": f"/jobs/{job.job_id}"},
+        )
+
+    def _save_upload(self, name: str, length: int) -> Path:
+        name = Path(name).name
+        stem_suffix = name[:-3] if name.endswith(".gz") else name
+        if not name or not stem_suffix.lower().endswith(STRUCTURE_SUFFIXES):
+            raise ValueError(f"上传需要在 ?name= 中给出结构文件名（{'/'.join(STRUCTURE_SUFFIXES)}，可带 .gz）")
+        # 每个上传一个目录，保留原始文件名（fpocket 输出与结果中的蛋白质名称由文件名决定）
+        target_dir = Path(tempfile.mkdtemp(prefix="upload_", dir=self.upload_dir))
+        target = target_dir / name
+        remaining = length
+        with open(target, "wb") as f:
+            while remaining > 0:
+                block = self.rfile.read(min(remaining, 1 << 20))
+                if not block:
+                    raise ValueError("上传内容不完整")
+                f.write(block)
+                remaining -= len(block)
+        return target
+
+
+def serve(
+    config: PipelineConfig,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    workers: int = 4,
+    p2rank_workers: Optional[int] = None,
+    queue_size: int = 64,
+    work_dir: Optional[str] = None,
+) -> None:
+    """启动服务并阻塞到 Ctrl+C
+
+    workers 为同时处理的任务数（同时运行的 fpocket 上限），p2rank_workers 为同时运行的 P2Rank 上限
+    （默认 workers / 2）。work_dir 存放上传的结构和任务的中间文件，默认使用临时目录，任务结束后即删除。
+    """
+    root = Path(work_dir) if work_dir else Path(tempfile.mkdtemp(prefix="protein_pocket_serve_"))
+    upload_dir = root / "uploads"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    pipeline = AsyncPocketPipeline(
+        config, workdir=root / "jobs", fpocket_concurrency=workers,
+        p2rank_concurrency=p2rank_workers or max(1, workers // 2),
+    )
+    manager = JobManager(pipeline, root / "jobs", workers=workers, queue_size=queue_size)
+    manager.start()
+
+    handler = type("Handler", (JobRequestHandler,), {"manager": manager, "upload_dir": upload_dir})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    console.print(f"[green]✓ 服务已启动: http://{host}:{httpd.server_port}[/green]")
+    console.print(
+        f"P2Rank: {pipeline.config.prank_home}，{workers} 个任务并发（P2Rank {pipeline.p2rank_concurrency}），"
+        f"队列上限 {queue_size}，工作目录 {root}"
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n[yellow]正在停止服务，取消运行中的任务...[/yellow]")
+    finally:
+        httpd.server_close()
+        manager.stop()
+        if not work_dir:
+            shutil.rmtree(root, ignore_errors=True)
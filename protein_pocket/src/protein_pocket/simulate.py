@@ -0,0 +1,243 @@
+"""
+模拟的 fpocket / prank 可执行文件 - 在没有真实工具的环境中测量批量调度的吞吐量
+
+模拟工具写出与真实工具相同布局的输出（*_info.txt、pockets/pocketN_atm.pdb、*_out.pdb、
+*_predictions.csv），并按配置模拟固定延迟、CPU 占用和内存占用，计时结果不受真实工具波动影响。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import stat
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# 与 fpocket 4.x *_info.txt 相同的描述符顺序
+FPOCKET_DESCRIPTORS = [
+    "Score",
+    "Druggability Score",
+    "Number of Alpha Spheres",
+    "Total SASA",
+    "Polar SASA",
+    "Apolar SASA",
+    "Volume",
+    "Mean local hydrophobic density",
+    "Mean alpha sphere radius",
+    "Mean alp. sph. solvent access",
+    "Apolar alpha sphere proportion",
+    "Hydrophobicity score",
+    "Volume score",
+    "Polarity score",
+    "Charge score",
+    "Proportion of polar atoms",
+    "Alpha sphere density",
+    "Cent. of mass - Alpha Sphere max dist",
+    "Flexibility",
+]
+
+SIMULATED_P2RANK_VERSION = "2.5.1 (simulated)"
+
+
+@dataclass
+class SimulationProfile:
+    """模拟工具的资源消耗（时间单位为秒，内存单位为 MiB）"""
+    fpocket_latency: float = 0.05  # 等待时间（模拟 I/O）
+    fpocket_cpu: float = 0.2  # 占满一个核的时间
+    fpocket_memory_mb: int = 50
+    pockets: int = 20
+    atoms_per_pocket: int = 40
+    prank_startup: float = 1.0  # 每次启动的固定开销（JVM 启动与模型加载）
+    prank_latency: float = 0.05  # 每个蛋白质的等待时间
+    prank_cpu: float = 0.2  # 每个蛋白质占满一个核的时间
+    prank_memory_mb: int = 500
+    fail_pattern: Optional[str] = None  # 文件名包含该字符串的蛋白质在 P2Rank 阶段失败
+
+
+def write_fpocket_output(
+    out_dir: Path,
+    stem: str,
+    n_pockets: int,
+    atoms_per_pocket: int = 40,
+    seed: int = 0,
+    extras: bool = False,
+) -> Path:
+    """写出与 fpocket 相同布局的输出目录（<stem>_info.txt、<stem>_out.pdb、pockets/pocketN_atm.pdb）
+
+    extras=True 时同时写出 fpocket 的可视化脚本和 PQR 文件（内容为占位），用于模拟真实的文件数。
+    """
+    rnd = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pockets_dir = out_dir / "pockets"
+    pockets_dir.mkdir(exist_ok=True)
+
+    info_lines = []
+    stp_lines = []
+    for n in range(1, n_pockets + 1):
+        info_lines.append(f"Pocket {n} :")
+        for name in FPOCKET_DESCRIPTORS:
+            value = rnd.randint(0, 20) if name in ("Polarity score", "Charge score") else rnd.uniform(0, 100)
+            info_lines.append(f"\t{name} : \t{value:.3f}" if isinstance(value, float) else f"\t{name} : \t{value}")
+        info_lines.append("")
+
+        cx, cy, cz = (rnd.uniform(-60, 60) for _ in range(3))
+        atom_lines = [f"HEADER Information about the pocket {n:5d}:"]
+        for a in range(atoms_per_pocket):
+            x, y, z = cx + rnd.uniform(-4, 4), cy + rnd.uniform(-4, 4), cz + rnd.uniform(-4, 4)
+            residue = rnd.randint(1, 999)
+            atom_lines.append(
+                f"ATOM  {a + 1:5d}  CA  ALA A{residue:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C"
+            )
+        (pockets_dir / f"pocket{n}_atm.pdb").write_text("\n".join(atom_lines) + "\n")
+        stp_lines.append(f"HETATM{n:5d}    C STP  {n:4d}    {cx:8.3f}{cy:8.3f}{cz:8.3f}  0.00  0.00          Ve")
+        if extras:
+            (pockets_dir / f"pocket{n}_vert.pqr").write_text("REMARK simulated\n")
+
+    (out_dir / f"{stem}_info.txt").write_text("\n".join(info_lines) + "\n")
+    (out_dir / f"{stem}_out.pdb").write_text("\n".join(stp_lines) + "\n")
+    if extras:
+        for name in (f"{stem}.pml", f"{stem}_VMD.tcl", f"{stem}_pockets.pqr", f"{stem}_PYMOL.sh"):
+            (out_dir / name).write_text("# simulated\n")
+    return out_dir
+
+
+def write_synthetic_structures(input_dir: Path, count: int, atoms: int = 2000) -> List[Path]:
+    """写出 count 个内容互不相同的最小 PDB 文件（模拟工具只读取文件名和原子数）"""
+    input_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        rnd = random.Random(i)
+        lines = [f"REMARK   1 SYNTHETIC STRUCTURE {i}"]
+        for a in range(atoms):
+            x, y, z = (rnd.uniform(-40, 40) for _ in range(3))
+            lines.append(
+                f"ATOM  {a % 100000:5d}  CA  ALA A{a % 10000:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C"
+            )
+        path = input_dir / f"sim_{i:06d}.pdb"
+        path.write_text("\n".join(lines) + "\nEND\n")
+        paths.append(path)
+    return paths
+
+
+def _consume(seconds_wait: float, seconds_cpu: float, memory_mb: int) -> bytearray:
+    """按配置消耗资源：分配并触碰内存页，等待，然后占用一个核"""
+    block = bytearray(memory_mb * 1024 * 1024)
+    for offset in range(0, len(block), 4096):
+        block[offset] = 1
+    time.sleep(seconds_wait)
+    deadline = time.process_time() + seconds_cpu
+    x = 0
+    while time.process_time() < deadline:
+        x = (x * 1103515245 + 12345) & 0x7FFFFFFF
+    return block
+
+
+def _seed(name: str) -> int:
+    return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16)
+
+
+def fpocket_main(argv: List[str], profile: SimulationProfile) -> int:
+    """模拟 `fpocket -f <structure>`：在输入文件旁写出 <stem>_out 目录"""
+    if "-f" not in argv:
+        print("usage: fpocket -f <structure>", file=sys.stderr)
+        return 2
+    structure = Path(argv[argv.index("-f") + 1])
+    if not structure.exists():
+        print(f"fpocket: cannot open {structure}", file=sys.stderr)
+        return 1
+
+    print("***** POCKET HUNTING BEGINS *****")
+    # 写出结果期间继续持有模拟的内存，峰值内存覆盖整个运行过程（与 prank_main 的 heap 相同）
+    memory = _consume(profile.fpocket_latency, profile.fpocket_cpu, profile.fpocket_memory_mb)
+    write_fpocket_output(
+        structure.parent / f"{structure.stem}_out",
+        structure.stem,
+        profile.pockets,
+        atoms_per_pocket=profile.atoms_per_pocket,
+        seed=_seed(structure.name),
+        extras=True,
+    )
+    del memory
+    print("***** POCKET HUNTING ENDS *****")
+    return 0
+
+
+def _read_stp_centers(fpocket_out: Path) -> List[Tuple[float, float, float]]:
+    centers = []
+    with open(fpocket_out, "r") as f:
+        for line in f:
+            if line.startswith("HETATM") and "STP" in line:
+                centers.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return centers
+
+
+def prank_main(argv: List[str], profile: SimulationProfile) -> int:
+    """模拟 `prank rescore <dataset> -o <out_dir> [-threads N]`"""
+    if argv and argv[0] in ("--version", "-v"):
+        print(f"P2Rank {SIMULATED_P2RANK_VERSION}")
+        return 0
+    if len(argv) < 2 or argv[0] != "rescore" or "-o" not in argv:
+        print("usage: prank rescore <dataset.ds> -o <out_dir>", file=sys.stderr)
+        return 2
+    dataset = Path(argv[1])
+    out_dir = Path(argv[argv.index("-o") + 1])
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = []
+    for line in dataset.read_text().splitlines():
+        if not line.strip() or line.startswith(("PARAM", "HEADER")):
+            continue
+        prediction, protein = line.split()
+        rows.append((Path(prediction), Path(protein)))
+    # 与真实 P2Rank 一样，数据集中任一蛋白质出错时整次运行失败
+    for _, protein in rows:
+        if profile.fail_pattern and profile.fail_pattern in protein.name:
+            print(f"ERROR: simulated failure for {protein.name}", file=sys.stderr)
+            return 1
+
+    heap = _consume(profile.prank_startup, 0.0, profile.prank_memory_mb)
+    visualizations = out_dir / "visualizations"
+    visualizations.mkdir(exist_ok=True)
+    for prediction, protein in rows:
+        _consume(profile.prank_latency, profile.prank_cpu, 0)
+        rnd = random.Random(_seed(protein.name))
+        centers = _read_stp_centers(prediction)
+        scores = sorted((rnd.uniform(0, 50) for _ in centers), reverse=True)
+        with open(out_dir / f"{protein.name}_predictions.csv", "w") as f:
+            f.write("name     ,  rank,   score, probability, sas_points, surf_atoms,   center_x,   center_y,   center_z, residue_ids, surf_atom_ids\n")
+            for rank, ((x, y, z), score) in enumerate(zip(centers, scores), start=1):
+                f.write(
+                    f"pocket{rank} , {rank:5d}, {score:7.2f}, {min(score / 50, 1):.3f}, {rnd.randint(10, 200):5d}, "
+                    f"{rnd.randint(5, 60):5d}, {x:10.4f}, {y:10.4f}, {z:10.4f}, A_{rank} A_{rank + 1}, {rank} {rank + 1}\n"
+                )
+        (visualizations / f"{protein.name}.pml").write_text("# simulated\n")
+    (out_dir / "run.log").write_text(f"simulated P2Rank {len(rows)} proteins, heap {len(heap)} bytes\n")
+    return 0
+
+
+def install_simulated_tools(tool_dir: Path, profile: SimulationProfile) -> Tuple[Path, Path]:
+    """写出模拟的 fpocket 与 prank 可执行文件
+
+    Returns:
+        (包含 fpocket 的 bin 目录（加入 PATH）, 模拟的 P2Rank 目录（作为 prank_home）)
+    """
+    bin_dir = tool_dir / "bin"
+    prank_home = tool_dir / "p2rank_simulated"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    prank_home.mkdir(parents=True, exist_ok=True)
+
+    package_root = Path(__file__).resolve().parents[1]
+    profile_json = json.dumps(asdict(profile))
+    for path, entry in ((bin_dir / "fpocket", "fpocket_main"), (prank_home / "prank", "prank_main")):
+        path.write_text(
+            f"#!{sys.executable}\n"
+            "import json, sys\n"
+            f"sys.path.insert(0, {str(package_root)!r})\n"
+            f"from protein_pocket.simulate import SimulationProfile, {entry}\n"
+            f"sys.exit({entry}(sys.argv[1:], SimulationProfile(**json.loads({profile_json!r}))))\n"
+        )
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir, prank_home
@@ -0,0 +1,112 @@
+"""
+阶段计时模块 - 记录每个蛋白质在各处理阶段的耗时，并导出为 Chrome trace JSON
+
+trace 文件可以在 chrome://tracing 或 https://ui.perfetto.dev 中打开。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# 汇总 CSV 中按此顺序输出各阶段耗时列
+STAGES = ("cache", "fpocket", "parse", "dedup", "p2rank", "cliff", "output")
+
+
+@dataclass
+class StageSpan:
+    """一个阶段的一次执行"""
+    stage: str
+    start: float  # Unix 时间戳（秒）
+    duration: float  # 秒
+    pid: int = 0
+    tid: int = 0
+    shared_with: int = 1  # 同一次执行处理的蛋白质数量（批量 P2Rank 重打分时大于 1）
+
+
+@contextmanager
+def stage_span(spans: List[StageSpan], stage: str, shared_with: int = 1) -> Iterator[None]:
+    """记录 with 块的耗时并追加到 spans；块内抛出异常时同样记录"""
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append(StageSpan(
+            stage=stage,
+            start=start,
+            duration=time.perf_counter() - started,
+            pid=os.getpid(),
+            tid=threading.get_native_id(),
+            shared_with=shared_with,
+        ))
+
+
+def spans_to_records(spans: Iterable[StageSpan]) -> List[Dict[str, Any]]:
+    return [asdict(s) for s in spans]
+
+
+def stage_totals(spans: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+    """按阶段累加耗时（spans 为 spans_to_records 的输出）
+
+    多个蛋白质共享的执行（shared_with > 1，如批量 P2Rank 重打分）按组内蛋白质数平均分摊，
+    与 processing_time 的计算一致，汇总列相加时不会重复计算；完整的时间段只出现在 Chrome trace 中。
+    """
+    totals: Dict[str, float] = {}
+    for span in spans:
+        share = span["duration"] / max(1, span.get("shared_with", 1))
+        totals[span["stage"]] = totals.get(span["stage"], 0.0) + share
+    return totals
+
+
+def format_stage_totals(totals: Dict[str, float]) -> str:
+    return ", ".join(f"{stage} {totals[stage]:.2f}s" for stage in STAGES if stage in totals)
+
+
+class ChromeTraceWriter:
+    """流式写入 Chrome trace（JSON 数组格式）
+
+    每个阶段是一个 "X"（complete）事件，按进程 / 线程分行显示，蛋白质名称放在 args 中。
+    数组格式允许缺少结尾的 "]"，批处理中途被杀死时已写入的事件仍然可以加载。
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write("[\n")
+        self._first = True
+
+    def write_spans(self, protein: str, spans: Iterable[Dict[str, Any]], status: Optional[str] = None) -> None:
+        for span in spans:
+            event = {
+                "name": span["stage"],
+                "cat": "stage",
+                "ph": "X",
+                "ts": round(span["start"] * 1e6),
+                "dur": round(span["duration"] * 1e6),
+                "pid": span.get("pid", 0),
+                "tid": span.get("tid", 0),
+                "args": {"protein": protein, "shared_with": span.get("shared_with", 1)},
+            }
+            if status is not None:
+                event["args"]["status"] = status
+            self._file.write(("" if self._first else ",\n") + json.dumps(event, ensure_ascii=False))
+            self._first = False
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.write("\n]\n")
+            self._file.close()
+
+    def __enter__(self) -> "ChromeTraceWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()